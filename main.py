@@ -1,57 +1,63 @@
-from tools.airpods_manual_fetch import scrape_airpods_manual
-from tools.load_save_data import load_json_data, save_to_json
-from tools.similarity_calculation import calculate
-from tools.similarity_calculation import print_similarity_results
-import os
+import argparse
 
-def main():
-    LLM = "openai"
-    
-    try:
-        import importlib
-        embedding_module = importlib.import_module(f"tools.generate_embedding_{LLM}")
-        process_and_embed_data = embedding_module.process_and_embed_data
-        process_and_embed_questions = embedding_module.process_and_embed_questions
-    except ImportError:
-        print(f"{LLM} embedding module not found")
-    """
-    # Fetch and embed AirPods manual data
-    url = "https://support.apple.com/en-us/guide/airpods/welcome/web"
-    input_data = scrape_airpods_manual(url)
-    """
-    embedding_output_file = f"output/json/text_embedding_{LLM}.json"
-    question_output_file = f"output/json/question_embeddings_{LLM}.json"
-    """
-    if input_data:
-        final_data_with_embeddings = process_and_embed_data(input_data)
-        save_to_json(final_data_with_embeddings, embedding_output_file)
-    
-    # Create and embed questions
-    questions = [
+from tools.pipeline import PipelineRunner, build_stages
+
+# Manual table of contents page; {locale} is the support site locale, e.g. "en-us" or "zh-tw"
+MANUAL_URL = "https://support.apple.com/{locale}/guide/airpods/welcome/web"
+
+# Question sets of the evaluate stage
+QUESTION_SETS = {
+    "en": [
         "How to pair AirPods with an iPhone?",
         "How to reset AirPods?",
         "How to check AirPods battery status?",
         "How to use AirPods with a Mac?",
-    ]
-    questions = [
+    ],
+    "zh-tw": [
         "怎麼配對AirPods？",
         "怎麼重置AirPods？",
         "怎麼確認AirPods的電量？",
         "怎麼在Mac上使用AirPods？",
-    ]
-
-    if not questions:
-        question_embeddings = process_and_embed_questions(questions)
-        save_to_json(question_embeddings, question_output_file)
-    """
-    # Calculate similarity and display results
-    qa_data = calculate(
-        question_file=question_output_file,
-        data_file=embedding_output_file,
-        chunk_top_percentage=0.5
-        )
-    print_similarity_results(qa_data)
-    save_to_json(qa_data, f"output/json/similarity_results_{LLM}.json")
+    ],
+}
+
+def main():
+    LLM = "openai"
+
+    stage_names = [stage.name for stage in build_stages(llm=LLM, url="", questions=[])]
+
+    parser = argparse.ArgumentParser(description="Run the AirPods manual pipeline incrementally.")
+    parser.add_argument("stages", nargs="*", metavar="stage",
+                        help=f"Stages to run (default: all). One of: {', '.join(stage_names)}")
+    parser.add_argument("--force", nargs="*", default=[], metavar="stage",
+                        help="Rebuild these stages even if they are up to date")
+    parser.add_argument("--status", action="store_true",
+                        help="Only show which stages are stale")
+    parser.add_argument("--locale", default="zh-tw",
+                        help="Locale of the manual to scrape (default: zh-tw, the committed manual data)")
+    parser.add_argument("--questions", default=None, choices=sorted(QUESTION_SETS),
+                        help="Question set of the evaluate stage (default: the language of --locale)")
+    parser.add_argument("--route-by-language", action="store_true",
+                        help="Search each question only in the chunks of its language (compare with evaluate_retrieval first)")
+    args = parser.parse_args()
+    # Chinese locales (zh-tw, zh-hk, ...) are evaluated with the Chinese questions
+    question_set = args.questions or ("zh-tw" if args.locale.lower().startswith("zh") else "en")
+
+    stages = build_stages(
+        llm=LLM,
+        url=MANUAL_URL.format(locale=args.locale),
+        questions=QUESTION_SETS[question_set],
+        chunk_top_percentage=0.5,
+        route_by_language=args.route_by_language,
+    )
+    runner = PipelineRunner(stages)
+
+    if args.status:
+        for name, stale in runner.status().items():
+            print(f"{name:<16}{'stale' if stale else 'up to date'}")
+        return
+
+    runner.run(targets=args.stages, force=args.force)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,52 +1,91 @@
 import chromadb
 import dotenv
+import importlib
 import os
 import sys
 # 動態添加專案根目錄到 sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from tools.load_save_data import load_json_data
-from tools.generate_embedding_openai import EmbeddingGenerator
+from tools.corpus import Corpus
+from tools.source_metadata import PAGE_FIELDS, SOURCE_FIELDS, content_hash, source_key, source_where
+from tools.generate_embedding_openai import EmbeddingGenerator, Model_Name
 from tools.generate_output import generate_output
+from tools.answer_router import AnswerRouter, EXTRACTIVE
+from tools.language_partitions import language_where
+from tools.index_versions import ActiveIndex, IndexRegistry, build_index_version
+from tools.pipeline import fingerprint_file
 
 dotenv.load_dotenv()
 
-def initialize_chroma_db(db_path, collection_name):
+def initialize_chroma_db(db_path, collection_name, metadata=None):
     """
     初始化 ChromaDB 並取得指定的 collection。
+    metadata 只在建立新的 collection 時寫入，例如索引版本的 embedding provider / model。
     """
     client = chromadb.PersistentClient(path=db_path)
-    collection = client.get_or_create_collection(name=collection_name)
+    collection = client.get_or_create_collection(name=collection_name, metadata=metadata)
     return collection
 
+def reset_chroma_collection(db_path, collection_name):
+    """
+    刪除指定的 collection（若存在），讓下一次插入從空的 collection 開始。
+    """
+    client = chromadb.PersistentClient(path=db_path)
+    if collection_name in [collection.name for collection in client.list_collections()]:
+        client.delete_collection(name=collection_name)
+
 def prepare_data_for_insertion(input_file):
     """
     準備資料以插入到 ChromaDB 中（僅插入 chunks 的內容）。
+    每個 chunk 的 metadata 包含來源頁面的 title、url、product、language 與 content_hash，
+    以及 chunk 本身的語言 chunk_language，查詢時可以用 where 條件先縮小範圍再比對向量。
     """
     # 載入 JSON 資料
     data = load_json_data(input_file)
     if not data:
         raise ValueError("輸入的 JSON 檔案為空或格式不正確！")
 
-    # 提取 ids, documents, embeddings, metadatas 
+    # 以 Corpus 讀取一次，向量與字串都集中存放
+    corpus = Corpus.from_records(data)
+    # 舊檔案沒有存 chunk 的語言，在這裡補上偵測，chunk_language 篩選才有值
+    corpus.detect_chunk_languages()
+    embeddings = corpus.chunk_vectors().tolist()
+
     ids = []
     documents = []
-    embeddings = []
     metadatas = []
-    id_counter = 0
-
-    for item in data:
-        chunks = item.get("chunks", [])
-
-        # 儲存 chunk 的資料
-        for chunk in chunks:
-            ids.append(f"chunk_{id_counter}")
-            documents.append(chunk["chunk_text"])
-            embeddings.append(chunk["chunk_embedding"])
-            metadatas.append({
-                "type": "chunk",
-            })
-            id_counter += 1
+    # 標題對應到第一個同名頁面，用來查詢來源頁面的欄位
+    title_rows = {corpus.title(row): row for row in reversed(range(corpus.n_titles))}
+
+    for row in range(corpus.n_chunks):
+        title_row = int(corpus.chunk_title_ids[row])
+        ids.append(f"chunk_{row}")
+        documents.append(corpus.chunk_text(row))
+        # title 與 chunk_index 用來合併同一頁中相鄰的 chunk
+        metadatas.append({
+            "type": "chunk",
+            "title": corpus.title(title_row),
+            "chunk_index": row - int(corpus.chunk_offsets[title_row]),
+            "content_hash": content_hash(corpus.chunk_text(row)),
+        })
+        if corpus.chunk_language(row):
+            metadatas[-1]["chunk_language"] = corpus.chunk_language(row)
+        # 沒有來源資訊的欄位不存入（Chroma 的 metadata 不接受 None）
+        for field in PAGE_FIELDS:
+            if corpus.title_field(title_row, field):
+                metadatas[-1][field] = corpus.title_field(title_row, field)
+        # 去除近似重複後，同一個 chunk 可能來自多個頁面（Chroma 的 metadata 不支援 list）
+        source_titles = corpus.chunk_source_titles(row)
+        if source_titles:
+            metadatas[-1]["source_titles"] = "\n".join(source_titles)
+        # 每個來源頁面的 title / url / product / language 另存為布林欄位（例如 "product:AirPods Pro"），
+        # 以 source_where 改寫的 where 條件才能經由任一來源頁面找到此 chunk，與本地搜尋的結果一致
+        source_rows = [title_row] + [title_rows[title] for title in source_titles if title in title_rows]
+        for source_row in source_rows:
+            for field in SOURCE_FIELDS:
+                if corpus.title_field(source_row, field):
+                    metadatas[-1][source_key(field, corpus.title_field(source_row, field))] = True
 
     return ids, documents, embeddings, metadatas
 
@@ -68,11 +107,40 @@ def insert_data_into_chromadb(collection, ids, documents, embeddings, metadatas=
 # 初始化 EmbeddingGenerator
 embedding_generator = EmbeddingGenerator(api_key=os.getenv("OPENAI_API_KEY"))
 
-def query_chromadb(collection, query_text, n_results=1):
+def embed_query_for_collection(collection, query_text):
     """
-    從 ChromaDB 中查詢資料，先將查詢文字相量化，並顯示相似度最高的 chunk。
+    以 collection 標記的 embedding provider / model 將查詢文字向量化，
+    查詢向量與索引中的向量才會在同一個向量空間；沒有標記的 collection 使用預設的 OpenAI 模型。
+    """
+    stamp = collection.metadata or {}
+    provider = stamp.get("embedding_provider", "openai")
+    model_name = stamp.get("embedding_model", Model_Name)
+    if provider == "openai" and model_name == Model_Name:
+        return embedding_generator.generate_embedding(query_text)
+
+    embedding_module = importlib.import_module(f"tools.generate_embedding_{provider}")
+    question_data = embedding_module.process_and_embed_questions([query_text], model_name)
+    if not question_data:
+        raise RuntimeError(f"無法以 {provider} / {model_name} 將查詢文字向量化！")
+    return question_data[0]["question_embedding"]
+
+def query_chromadb_results(collection, query_text, n_results=1, where=None, route_by_language=False):
     """
-    query_embedding = embedding_generator.generate_embedding(query_text)
+    從 ChromaDB 中查詢資料，先將查詢文字相量化，並回傳完整的查詢結果。
+    where 為 metadata 篩選條件，例如 {"product": "AirPods Pro"} 或
+    {"$and": [{"language": "zh-tw"}, {"product": {"$in": ["AirPods Pro", "AirPods"]}}]}，
+    只有符合條件的 chunk 會參與向量比對；頁面欄位的條件會以 source_where 改寫，
+    去除近似重複後的 chunk 也能經由它的任一來源頁面被找到。
+    route_by_language 為 True 時，以 langid 判斷問題的語言，只在相同語言的 chunk 中查詢；
+    判斷的信心不足，或索引中沒有該語言的 chunk 時，則跨語言查詢。
+    """
+    where = source_where(where)
+    routed_where = language_where(query_text, where) if route_by_language else where
+
+    # 傳入 ActiveIndex 時，整個查詢都使用同一個索引版本（與它的 embedding 模型）
+    if isinstance(collection, ActiveIndex):
+        collection = collection.current()
+    query_embedding = embed_query_for_collection(collection, query_text)
 
     # 如果嵌入向量是嵌套列表，展平它
     # 例如：[[0.1, 0.2, 0.3]] → [0.1, 0.2, 0.3]
@@ -94,8 +162,24 @@ def query_chromadb(collection, query_text, n_results=1):
     # }
     results = collection.query(
         query_embeddings=[query_embedding],  # 必須是 list[list[float]]
-        n_results=n_results
+        n_results=n_results,
+        where=routed_where or None
     )
+    # 索引中沒有該語言的 chunk 時（例如只有英文的索引，或沒有 chunk_language 的舊索引），
+    # 改為跨語言查詢，與 LanguagePartitions 的退回方式相同
+    if routed_where is not where and not (results.get("ids") or [[]])[0]:
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=where or None
+        )
+    return results
+
+def query_chromadb(collection, query_text, n_results=1, where=None, route_by_language=False):
+    """
+    從 ChromaDB 中查詢資料，先將查詢文字相量化，並顯示相似度最高的 chunk。
+    """
+    results = query_chromadb_results(collection, query_text, n_results, where, route_by_language)
 
     # 嚴謹檢查查詢結果
     if results and "documents" in results and results["documents"] and len(results["documents"][0]) > 0:
@@ -111,18 +195,23 @@ if __name__ == "__main__":
     query_text = input("你想搜尋的內容：")  # ← 你想搜尋的內容
     n_results = 1                   # ← 只顯示相似度最高的結果
 
-    # 初始化 ChromaDB
-    collection = initialize_chroma_db(db_path, collection_name)
-
-    # 檢查資料是否已插入
-    if collection.count() == 0:
-        ids, documents, embeddings, metadatas = prepare_data_for_insertion(input_file)
-        insert_data_into_chromadb(collection, ids, documents, embeddings, metadatas)
+    # 目前使用中的索引版本不是由這個檔案與模型建立時（或還沒有索引），建立新版本並切換過去
+    active = IndexRegistry().active(collection_name)
+    if active is None or active.get("model") != Model_Name or active.get("source_hash") != fingerprint_file(input_file):
+        build_index_version(db_path, collection_name, input_file, "openai", Model_Name)
     else:
-        print("資料已存在於 ChromaDB 中，跳過插入。")
+        print(f"資料已存在於 ChromaDB 中（{active['name']}），跳過插入。")
 
-    # 查詢範例
-    result = query_chromadb(collection, query_text, n_results)
-    print(f"查詢結果：{generate_output(result)}")
+    # 查詢時才解析使用中的版本
+    collection = ActiveIndex(db_path, collection_name)
+
+    # 查詢範例：最相近的 chunk 幾乎完全相符時直接顯示，不再呼叫 LLM 整理
+    router = AnswerRouter(extractive_threshold=0.8)
+    results = query_chromadb_results(collection, query_text, n_results)
+    if router.choose_for_results(results) == EXTRACTIVE:
+        print(f"查詢結果：{router.extractive_answer(results)}")
+    else:
+        result = results["documents"][0][0] if results.get("documents") and results["documents"][0] else "沒有找到相關的內容。"
+        print(f"查詢結果：{generate_output(result)}")
 
 
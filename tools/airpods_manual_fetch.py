@@ -3,9 +3,10 @@
 2. 便利每個分頁並且獲取其中的AppleTopic apd-topic dark-mode-enabled book book-content類別中的文字
 3. 輸出結果爲JSON檔
 
-提供兩種使用方法：
+提供三種使用方法：
     1. 傳入url與output_filename參數，會將結果儲存至指定檔案
     2. 僅傳入url參數，會回傳結果列表一個list[dict]
+    3. iter_airpods_manual(url) 逐頁 yield 結果，供串流處理使用
 """
 
 import requests
@@ -15,76 +16,83 @@ import os
 from urllib.parse import urljoin
 from .load_save_data import load_json_data, save_to_json
 
-def scrape_airpods_manual(url: str, output_filename = "") -> list:
+Headers = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+def iter_airpods_manual(url: str, delay: float = 0.5):
+    """
+    逐頁抓取說明頁面，每抓完一頁就 yield {'title', 'url', 'content'}，
+    讓後續的清理、切分與嵌入不必等整個網站抓完。
+    目錄頁面無法取得時會拋出 requests.RequestException 或 ValueError。
+    """
     toc_url = url
-    
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
 
     print(f"正在抓取目錄頁面：{toc_url}")
 
-    try:
-        # 獲取目錄頁面
-        response = requests.get(toc_url, headers=headers)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # 找到目錄列表
-        toc_list = soup.select_one('ul.toc.hasIcons')
-        
-        if not toc_list:
-            print("錯誤：找不到指定的目錄列表 (class='toc hasIcons')")
-            return None
-            
-        page_links = toc_list.find_all('a')
-        
-        rag_database = []
-        
-        print(f"找到 {len(page_links)} 個說明頁面連結。抓取內容...")
-        
-        # 遍歷所有連結，抓取分頁內容
-        for i, link in enumerate(page_links):
-            page_title = link.get_text(strip=True)
-            relative_url = link.get('href')
-            page_url = urljoin(toc_url, relative_url)
-            
-            print(f"  ({i+1}/{len(page_links)}) 正在處理: {page_title} - {page_url}")
-            
-            try:
-                # 抓取每個說明的詳細內容
-                page_response = requests.get(page_url, headers=headers)
-                page_response.raise_for_status()
-                
-                page_soup = BeautifulSoup(page_response.text, 'html.parser')
-                
-                content_div = page_soup.find('div', class_='AppleTopic apd-topic dark-mode-enabled book book-content')
-                
-                if content_div:
-                    content_text = content_div.get_text(separator='\n', strip=True)
-                    
-                    rag_database.append({
-                        'title': page_title,
-                        'url': page_url,
-                        'content': content_text
-                    })
-                else:
-                    print(f"    [Warning] 在頁面 '{page_title}' 中找不到 class='AppleTopic apd-topic dark-mode-enabled book book-content' 的內容區塊")
-
-                time.sleep(0.5)
-
-            except requests.RequestException as e:
-                print(f"    [Error] 抓取頁面 '{page_title}' ({page_url}) 時發生錯誤: {e}")
-
-        if output_filename:
-            save_to_json(rag_database, output_filename)
-        else:
-            return rag_database
+    # 獲取目錄頁面
+    response = requests.get(toc_url, headers=Headers)
+    response.raise_for_status()
+
+    soup = BeautifulSoup(response.text, 'html.parser')
+
+    # 找到目錄列表
+    toc_list = soup.select_one('ul.toc.hasIcons')
+
+    if not toc_list:
+        raise ValueError("錯誤：找不到指定的目錄列表 (class='toc hasIcons')")
+
+    page_links = toc_list.find_all('a')
+
+    print(f"找到 {len(page_links)} 個說明頁面連結。抓取內容...")
+
+    # 遍歷所有連結，抓取分頁內容
+    for i, link in enumerate(page_links):
+        page_title = link.get_text(strip=True)
+        relative_url = link.get('href')
+        page_url = urljoin(toc_url, relative_url)
+
+        print(f"  ({i+1}/{len(page_links)}) 正在處理: {page_title} - {page_url}")
+
+        try:
+            # 抓取每個說明的詳細內容
+            page_response = requests.get(page_url, headers=Headers)
+            page_response.raise_for_status()
 
+            page_soup = BeautifulSoup(page_response.text, 'html.parser')
+
+            content_div = page_soup.find('div', class_='AppleTopic apd-topic dark-mode-enabled book book-content')
+
+            if content_div:
+                content_text = content_div.get_text(separator='\n', strip=True)
+
+                yield {
+                    'title': page_title,
+                    'url': page_url,
+                    'content': content_text
+                }
+            else:
+                print(f"    [Warning] 在頁面 '{page_title}' 中找不到 class='AppleTopic apd-topic dark-mode-enabled book book-content' 的內容區塊")
+
+            time.sleep(delay)
+
+        except requests.RequestException as e:
+            print(f"    [Error] 抓取頁面 '{page_title}' ({page_url}) 時發生錯誤: {e}")
+
+def scrape_airpods_manual(url: str, output_filename = "") -> list:
+    try:
+        rag_database = list(iter_airpods_manual(url))
+    except ValueError as e:
+        print(e)
+        return None
     except requests.RequestException as e:
-        print(f"無法訪問目錄頁面 {toc_url}。錯誤: {e}")
+        print(f"無法訪問目錄頁面 {url}。錯誤: {e}")
         return None
 
+    if output_filename:
+        save_to_json(rag_database, output_filename)
+    else:
+        return rag_database
+
 if __name__ == '__main__':
     data = scrape_airpods_manual("https://support.apple.com/zh-tw/guide/airpods/welcome/web")
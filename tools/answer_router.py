@@ -0,0 +1,145 @@
+"""
+Confidence-based routing of answers by retrieval score.
+Steps:
+1. Convert the retrieval result of a question into similarities (Chroma returns distances).
+2. If the best chunk is a near-exact match (>= extractive_threshold), return it directly
+   without calling an LLM.
+3. If it is a good match (>= cheap_threshold), answer with the cheap model.
+4. Otherwise answer with the full model.
+5. Count every route and its latency, so the thresholds can be tuned from real traffic.
+"""
+
+import threading
+from typing import List, Dict, Any, Optional
+
+
+EXTRACTIVE = "extractive"
+CHEAP = "cheap"
+FULL = "full"
+ROUTES = (EXTRACTIVE, CHEAP, FULL)
+
+
+def distance_to_similarity(distance: float, space: str = "l2") -> float:
+    """
+    Convert a Chroma distance into cosine similarity.
+
+    Args:
+        distance: Distance returned by collection.query
+        space: Distance function of the collection ("l2", "cosine" or "ip"). Chroma's
+            default "l2" is the squared euclidean distance, which equals 2 - 2 * cosine
+            for unit length embeddings such as OpenAI's.
+
+    Returns:
+        float: Cosine similarity
+    """
+
+    if space == "l2":
+        return 1.0 - distance / 2.0
+    if space in ("cosine", "ip"):
+        return 1.0 - distance
+    raise ValueError(f"Unknown distance space: {space}")
+
+
+def result_similarities(results: Dict[str, Any], space: str = "l2") -> List[float]:
+    """Similarities of the first query of a Chroma result, best first."""
+
+    distances = results.get("distances") or [[]]
+    return [distance_to_similarity(distance, space) for distance in distances[0]]
+
+
+class AnswerRouter:
+    """
+    Choose how to answer a question from its retrieval scores.
+
+    Args:
+        extractive_threshold: Minimum top similarity to return the best chunk as the answer
+            (None disables the extractive route)
+        cheap_threshold: Minimum top similarity to use cheap_model (None disables the cheap route)
+        cheap_model: Chat model of the cheap route
+        full_model: Chat model of the full route
+        distance_space: Distance function of the Chroma collection, see distance_to_similarity
+    """
+
+    def __init__(
+        self,
+        extractive_threshold: Optional[float] = 0.8,
+        cheap_threshold: Optional[float] = 0.6,
+        cheap_model: str = "gpt-4.1-nano-2025-04-14",
+        full_model: str = "gpt-4o-mini",
+        distance_space: str = "l2"
+    ):
+        if extractive_threshold is not None and cheap_threshold is not None and cheap_threshold > extractive_threshold:
+            raise ValueError("cheap_threshold must not be above extractive_threshold")
+
+        self.extractive_threshold = extractive_threshold
+        self.cheap_threshold = cheap_threshold
+        self.cheap_model = cheap_model
+        self.full_model = full_model
+        self.distance_space = distance_space
+
+        self._lock = threading.Lock()
+        self._counts = {route: 0 for route in ROUTES}
+        self._seconds = {route: 0.0 for route in ROUTES}
+
+    def choose(self, similarities: List[float]) -> str:
+        """
+        Route for the given retrieval similarities (any order).
+
+        Returns:
+            str: EXTRACTIVE, CHEAP or FULL
+        """
+
+        top = max(similarities, default=None)
+        if top is None:
+            return FULL
+        if self.extractive_threshold is not None and top >= self.extractive_threshold:
+            return EXTRACTIVE
+        if self.cheap_threshold is not None and top >= self.cheap_threshold:
+            return CHEAP
+        return FULL
+
+    def choose_for_results(self, results: Dict[str, Any]) -> str:
+        """Route for a Chroma query result."""
+
+        return self.choose(result_similarities(results, self.distance_space))
+
+    def model_for(self, route: str) -> Optional[str]:
+        """Chat model of a route, None for the extractive route."""
+
+        return {EXTRACTIVE: None, CHEAP: self.cheap_model, FULL: self.full_model}[route]
+
+    @staticmethod
+    def extractive_answer(results: Dict[str, Any]) -> str:
+        """The best chunk of a Chroma result, returned as the answer."""
+
+        documents = results.get("documents") or [[]]
+        return documents[0][0].strip() if documents[0] else ""
+
+    def record(self, route: str, seconds: float) -> None:
+        """Count one answered question and its end-to-end latency."""
+
+        with self._lock:
+            self._counts[route] += 1
+            self._seconds[route] += seconds
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns:
+            Dict: For every route, its count, share of all questions and average latency in ms
+        """
+
+        with self._lock:
+            total = sum(self._counts.values())
+            return {
+                route: {
+                    "count": self._counts[route],
+                    "share": self._counts[route] / total if total else 0.0,
+                    "avg_ms": 1000 * self._seconds[route] / self._counts[route] if self._counts[route] else 0.0,
+                }
+                for route in ROUTES
+            }
+
+    def print_metrics(self) -> None:
+        for route, values in self.metrics().items():
+            print(f"{route:<10} : {values['count']:>6} ({values['share']:.1%}), avg {values['avg_ms']:.0f} ms")
+
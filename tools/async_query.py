@@ -0,0 +1,407 @@
+"""
+Concurrent version of ask_with_context for serving many questions from one process.
+Steps:
+1. Admit at most max_pending unfinished questions; the producer waits for one to finish
+   before reading the next question (backpressure).
+2. For each question, embed it, query ChromaDB, pack the context and call the chat model.
+3. Every upstream (embedding API, vector store, LLM) has its own semaphore, so a slow
+   upstream limits only its own in-flight calls and the others keep working.
+   Question embeddings arriving close together are coalesced into one request
+   (EmbeddingBatcher).
+4. ChromaDB is synchronous, so its queries run in worker threads (asyncio.to_thread).
+5. With an ActiveIndex as the collection, every question resolves the active index version
+   once (in a worker thread, as it may read the registry and open a collection) and embeds with the model that version is stamped with, so a version switch
+   takes effect between two questions.
+
+api_base / embedding_api_base / llm_api_base point the OpenAI calls at another server,
+e.g. local stub servers for load tests.
+"""
+
+import asyncio
+import os
+import sys
+import time
+from typing import List, Dict, Optional, Any, Iterable, AsyncIterable, Union, Callable
+
+import aiohttp
+import openai
+
+# 動態添加專案根目錄到 sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.answer_router import AnswerRouter, EXTRACTIVE
+from tools.embedding_batcher import EmbeddingBatcher
+from tools.index_versions import ActiveIndex
+from tools.language_partitions import language_where
+from tools.generate_embedding_openai import Model_Name
+from tools.query_with_llm import LLM_Model, build_context, build_prompt
+from tools.source_metadata import source_where
+
+
+class AsyncRateLimiter:
+    """
+    Space requests evenly so at most requests_per_minute start in any minute.
+    """
+
+    def __init__(self, requests_per_minute: float):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
+        self.interval = 60.0 / requests_per_minute
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        """Wait until the next request may start."""
+
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AsyncQueryPipeline:
+    """
+    Answer questions concurrently with bounded concurrency per upstream.
+
+    Use it as an async context manager so all OpenAI calls share one HTTP session:
+
+        async with AsyncQueryPipeline(collection) as pipeline:
+            answers = await pipeline.ask_many(questions, top_k=5)
+    """
+
+    def __init__(
+        self,
+        collection: Any,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        embedding_api_base: Optional[str] = None,
+        llm_api_base: Optional[str] = None,
+        embedding_model: str = Model_Name,
+        llm_model: str = LLM_Model,
+        embedding_concurrency: int = 16,
+        vector_store_concurrency: int = 4,
+        llm_concurrency: int = 8,
+        max_pending: int = 64,
+        request_timeout: float = 60.0,
+        embedding_batch_size: int = 64,
+        embedding_batch_wait: float = 0.005,
+        embedding_requests_per_minute: Optional[float] = None,
+        llm_requests_per_minute: Optional[float] = None,
+        router: Optional[AnswerRouter] = None,
+        route_by_language: bool = False
+    ):
+
+        """
+        Args:
+            collection: ChromaDB collection (anything with a compatible query method), or an
+                ActiveIndex to follow index version switches
+            api_key: OpenAI API key (default is the OPENAI_API_KEY environment variable)
+            api_base: Base URL of both OpenAI endpoints (default is the official API)
+            embedding_api_base: Base URL of the embedding endpoint, overrides api_base
+            llm_api_base: Base URL of the chat endpoint, overrides api_base
+            embedding_model: Model used to embed the questions, unless the collection is
+                stamped with its embedding model
+            llm_model: Chat model used to answer
+            embedding_concurrency: Maximum embedding requests in flight
+            vector_store_concurrency: Maximum ChromaDB queries in flight (worker threads)
+            llm_concurrency: Maximum chat requests in flight
+            max_pending: Maximum questions admitted by ask_many at a time
+            request_timeout: Timeout of each OpenAI request in seconds
+            embedding_batch_size: Maximum questions embedded in one request (1 disables batching)
+            embedding_batch_wait: Seconds a question waits for others to share its embedding request
+            embedding_requests_per_minute: Rate limit of the embedding requests (None is unlimited)
+            llm_requests_per_minute: Rate limit of the chat requests (None is unlimited)
+            router: Chooses per question between the best chunk, the cheap model and
+                llm_model from the retrieval scores (None always uses llm_model)
+            route_by_language: Query only the chunks in the detected language of each question
+        """
+
+        self.collection = collection
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.embedding_api_base = embedding_api_base or api_base
+        self.llm_api_base = llm_api_base or api_base
+        self.embedding_model = embedding_model
+        self.llm_model = llm_model
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self.router = router
+        self.route_by_language = route_by_language
+
+        self._embedding_slots = asyncio.Semaphore(embedding_concurrency)
+        self._vector_store_slots = asyncio.Semaphore(vector_store_concurrency)
+        self._llm_slots = asyncio.Semaphore(llm_concurrency)
+        self._embedding_rate = AsyncRateLimiter(embedding_requests_per_minute) if embedding_requests_per_minute else None
+        self._llm_rate = AsyncRateLimiter(llm_requests_per_minute) if llm_requests_per_minute else None
+        self._embedding_batch_size = embedding_batch_size
+        self._embedding_batch_wait = embedding_batch_wait
+        # One batcher per embedding model, questions of different index versions never share a request
+        self._embedding_batchers: Dict[str, EmbeddingBatcher] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_token = None
+
+    async def __aenter__(self) -> "AsyncQueryPipeline":
+        # openai reuses the session in openai.aiosession instead of opening one per request
+        self._session = aiohttp.ClientSession()
+        self._session_token = openai.aiosession.set(self._session)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        for batcher in self._embedding_batchers.values():
+            await batcher.close()
+        openai.aiosession.reset(self._session_token)
+        await self._session.close()
+        self._session = None
+
+    async def embed_texts(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        """Embed a batch of texts in one request."""
+
+        if self._embedding_rate:
+            await self._embedding_rate.wait()
+        async with self._embedding_slots:
+            response = await openai.Embedding.acreate(
+                model=model or self.embedding_model,
+                input=texts,
+                api_key=self.api_key,
+                api_base=self.embedding_api_base,
+                request_timeout=self.request_timeout,
+            )
+        # The API may return the items out of order, each carries its input index
+        return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+    async def embed_query(self, question: str, model: Optional[str] = None) -> List[float]:
+        """Embed one question, sharing the request with questions arriving at the same time."""
+
+        model = model or self.embedding_model
+        batcher = self._embedding_batchers.get(model)
+        if batcher is None:
+            batcher = EmbeddingBatcher(
+                lambda texts: self.embed_texts(texts, model),
+                self._embedding_batch_size,
+                self._embedding_batch_wait,
+            )
+            self._embedding_batchers[model] = batcher
+        return await batcher.embed(question)
+
+    def query_model(self, collection: Any) -> str:
+        """Embedding model of the vectors in a collection, from its stamp."""
+
+        stamp = getattr(collection, "metadata", None) or {}
+        provider = stamp.get("embedding_provider", "openai")
+        if provider != "openai":
+            raise ValueError(f"'{collection.name}' is embedded with {provider}, questions are embedded with OpenAI only")
+        return stamp.get("embedding_model") or self.embedding_model
+
+    async def resolve_collection(self) -> Any:
+        """
+        Collection the next question is searched in.
+
+        ActiveIndex.current() stats the registry and, after a version switch, reads it and
+        opens the new collection, so it runs in a worker thread like the queries. It is
+        resolved once per question, so the question is embedded with the model of the
+        version it is searched in even if the version switches meanwhile.
+        """
+
+        if isinstance(self.collection, ActiveIndex):
+            return await asyncio.to_thread(self.collection.current)
+        return self.collection
+
+    async def query_collection(
+        self,
+        query_embedding: List[float],
+        n_results: int,
+        where: Optional[dict] = None,
+        collection: Any = None
+    ) -> dict:
+        """Query ChromaDB in a worker thread, pre-filtered by the metadata in where."""
+
+        async with self._vector_store_slots:
+            return await asyncio.to_thread(
+                (collection or self.collection).query,
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                where=where or None,
+            )
+
+    async def complete(self, prompt: str, model: Optional[str] = None) -> str:
+        """Ask the chat model (llm_model unless model is given)."""
+
+        if self._llm_rate:
+            await self._llm_rate.wait()
+        async with self._llm_slots:
+            response = await openai.ChatCompletion.acreate(
+                model=model or self.llm_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                api_key=self.api_key,
+                api_base=self.llm_api_base,
+                request_timeout=self.request_timeout,
+            )
+        return response.choices[0].message.content.strip()
+
+    async def ask(
+        self,
+        question: str,
+        top_k: int = 1,
+        max_context_tokens: int = 1500,
+        where: Optional[dict] = None
+    ) -> str:
+
+        """
+        Async ask_with_context: answer one question from the collection
+        (only from the chunks matching where, if given).
+        """
+
+        start = time.perf_counter()
+        # Page conditions also match the other source pages of deduplicated chunks
+        where = source_where(where)
+        routed_where = language_where(question, where) if self.route_by_language else where
+        collection = await self.resolve_collection()
+        query_embedding = await self.embed_query(question, self.query_model(collection))
+        results = await self.query_collection(query_embedding, top_k, routed_where, collection)
+        if routed_where is not where and not (results.get("ids") or [[]])[0]:
+            # The index has no chunk in the question's language (or no chunk_language at all,
+            # e.g. a legacy version), so search across languages like LanguagePartitions
+            results = await self.query_collection(query_embedding, top_k, where, collection)
+
+        if self.router is None:
+            prompt = build_prompt(question, build_context(results, max_context_tokens))
+            return await self.complete(prompt)
+
+        route = self.router.choose_for_results(results)
+        if route == EXTRACTIVE:
+            answer = self.router.extractive_answer(results)
+        else:
+            prompt = build_prompt(question, build_context(results, max_context_tokens))
+            answer = await self.complete(prompt, self.router.model_for(route))
+        self.router.record(route, time.perf_counter() - start)
+        return answer
+
+    async def ask_many(
+        self,
+        questions: Union[Iterable[str], AsyncIterable[str]],
+        top_k: int = 1,
+        max_context_tokens: int = 1500,
+        return_exceptions: bool = True,
+        on_answer: Optional[Callable[[int, str, Union[str, BaseException]], None]] = None
+    ) -> List[Union[str, BaseException]]:
+
+        """
+        Answer many questions concurrently.
+
+        At most max_pending questions are read from questions and not finished yet;
+        reading pauses until one of them finishes, so a large (async) source of questions
+        is consumed at the pace the upstreams can serve it.
+
+        Args:
+            questions: Questions to answer, an iterable or an async iterable
+            top_k: Number of chunks retrieved per question
+            max_context_tokens: Token budget of the context
+            return_exceptions: Put the exception of a failed question in its slot
+                instead of cancelling the whole run
+            on_answer: Called as on_answer(index, question, answer) as soon as each question
+                finishes (answer is the exception if it failed and return_exceptions is set)
+
+        Returns:
+            List: Answers in the order of the questions
+        """
+
+        # A slot is taken before a question is read and released when it finishes, so the
+        # queue itself never holds more than max_pending questions
+        admitted = asyncio.Semaphore(self.max_pending)
+        queue: asyncio.Queue = asyncio.Queue()
+        answers: List[Union[str, BaseException]] = []
+
+        async def worker() -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                index, question = item
+                try:
+                    try:
+                        answers[index] = await self.ask(question, top_k, max_context_tokens)
+                    except Exception as e:
+                        if not return_exceptions:
+                            raise
+                        answers[index] = e
+                    if on_answer is not None:
+                        on_answer(index, question, answers[index])
+                finally:
+                    admitted.release()
+
+        async def next_question() -> Optional[str]:
+            try:
+                if isinstance(questions, AsyncIterable):
+                    return await source.__anext__()
+                return next(source)
+            except (StopIteration, StopAsyncIteration):
+                return None
+
+        async def produce() -> None:
+            index = 0
+            while True:
+                await admitted.acquire()
+                question = await next_question()
+                if question is None:
+                    break
+                answers.append(None)
+                queue.put_nowait((index, question))
+                index += 1
+            for _ in workers:
+                queue.put_nowait(None)
+
+        source = questions.__aiter__() if isinstance(questions, AsyncIterable) else iter(questions)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_pending)]
+        tasks = [asyncio.create_task(produce()), *workers]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # A raised exception leaves the producer and the other workers waiting on the queue
+            for task in tasks:
+                task.cancel()
+
+        return answers
+
+
+async def ask_many_with_context(
+    questions: Iterable[str],
+    top_k: int = 1,
+    max_context_tokens: int = 1500,
+    db_path: str = "./chroma_db",
+    collection_name: str = "text_embedding_openai",
+    **pipeline_options: Any
+) -> List[Union[str, BaseException]]:
+
+    """
+    Answer many questions concurrently with the default ChromaDB collection.
+
+    Args:
+        questions: Questions to answer
+        top_k: Number of chunks retrieved per question
+        max_context_tokens: Token budget of the context
+        db_path: Path of the ChromaDB database
+        collection_name: Index alias, the active version is queried
+        pipeline_options: Keyword arguments of AsyncQueryPipeline (api_base, concurrency limits, ...)
+
+    Returns:
+        List: Answers (or exceptions) in the order of the questions
+    """
+
+    collection = ActiveIndex(db_path, collection_name)
+    async with AsyncQueryPipeline(collection, **pipeline_options) as pipeline:
+        return await pipeline.ask_many(questions, top_k, max_context_tokens)
+
+
+if __name__ == "__main__":
+    questions = [
+        "怎麼配對AirPods？",
+        "怎麼重置AirPods？",
+        "怎麼確認AirPods的電量？",
+        "怎麼在Mac上使用AirPods？",
+    ]
+    answers = asyncio.run(ask_many_with_context(questions, top_k=5))
+    for question, answer in zip(questions, answers):
+        print(f"問題：{question}\n回答：{answer}\n")
@@ -0,0 +1,287 @@
+"""
+Out-of-core similarity search for corpora larger than RAM.
+Steps:
+1. Export the chunk embeddings once into a float32 .npy file plus a text blob with an
+   offset array, streaming the data one title at a time.
+2. At query time, memory-map the matrix and stream it in fixed-size blocks.
+3. Keep only a bounded heap of the best matches (top-k, or at most max_results matches
+   above a threshold), so memory use does not depend on the size of the corpus.
+4. Decode the texts of the final matches only.
+
+Run with:
+    python -m tools.blocked_search export output/json/text_embedding_openai.json output/blocked/text_embedding_openai
+    python -m tools.blocked_search search output/blocked/text_embedding_openai "怎麼重置AirPods？" --top-k 5
+"""
+
+import argparse
+import heapq
+import importlib
+import json
+import os
+from typing import List, Dict, Any, Union, Optional, Tuple, Iterable, Iterator
+import numpy as np
+from numpy.typing import NDArray
+
+from .corpus import Corpus
+from .load_save_data import iter_json_data
+
+
+def _paths(prefix: str) -> Dict[str, str]:
+    return {
+        "matrix": f"{prefix}.npy",
+        "texts": f"{prefix}_texts.bin",
+        "offsets": f"{prefix}_offsets.npy",
+        "title_ids": f"{prefix}_title_ids.npy",
+        "titles": f"{prefix}_titles.json",
+    }
+
+
+def _iter_title_blocks(
+    data_with_embeddings: Union[Iterable[Dict[str, Any]], Corpus]
+) -> Iterator[Tuple[str, List[str], NDArray[np.float32]]]:
+
+    """Yield (title, chunk texts, normalized chunk rows) per title, one title in memory at a time."""
+
+    if isinstance(data_with_embeddings, Corpus):
+        corpus = data_with_embeddings
+        for title_row in range(corpus.n_titles):
+            start, end = corpus.chunk_offsets[title_row], corpus.chunk_offsets[title_row + 1]
+            yield corpus.title(title_row), [corpus.chunk_text(row) for row in range(start, end)], corpus.chunk_matrix[start:end]
+        return
+
+    for item in data_with_embeddings:
+        # Chunks without text or embedding are skipped, as in Corpus.from_records
+        chunks = [
+            chunk for chunk in item.get('chunks', [])
+            if chunk.get('chunk_text') is not None and chunk.get('chunk_embedding')
+        ]
+        if not chunks:
+            yield item.get('title', ''), [], np.zeros((0, 0), dtype=np.float32)
+            continue
+        rows = np.array([chunk['chunk_embedding'] for chunk in chunks], dtype=np.float32)
+        if rows.ndim != 2:
+            raise ValueError(f"Chunk embeddings of '{item.get('title', '')}' do not have the same dimension")
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        rows /= np.where(norms == 0, 1.0, norms)
+        yield item.get('title', ''), [chunk['chunk_text'] for chunk in chunks], rows
+
+
+def _raw_to_npy(raw_path: str, npy_path: str, dtype: Any, shape: Tuple[int, ...], block_bytes: int = 1 << 26) -> None:
+    """Turn a file of raw array bytes into a .npy file, copying it block by block."""
+
+    with open(npy_path, 'wb') as npy_file, open(raw_path, 'rb') as raw_file:
+        np.lib.format.write_array_header_1_0(
+            npy_file, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape}
+        )
+        for block in iter(lambda: raw_file.read(block_bytes), b''):
+            npy_file.write(block)
+    os.remove(raw_path)
+
+
+def export_chunk_matrix(
+    data_with_embeddings: Union[str, Iterable[Dict[str, Any]], Corpus],
+    output_prefix: str
+) -> int:
+
+    """
+    Write the chunk embeddings and texts in the on-disk layout used by stream_search.
+
+    The data is streamed one title at a time, so a file path (read with iter_json_data)
+    or a generator of records can be exported without holding the corpus in memory.
+
+    Files written next to output_prefix:
+        <prefix>.npy            float32 matrix, one unit-length row per chunk
+        <prefix>_texts.bin      UTF-8 chunk texts, concatenated
+        <prefix>_offsets.npy    int64 byte offsets of each text (n + 1 entries)
+        <prefix>_title_ids.npy  int32 title index of each chunk
+        <prefix>_titles.json    list of titles
+
+    Args:
+        data_with_embeddings: Path of a file written by process_and_embed_data, an iterable
+            of its data items, or a Corpus
+        output_prefix: Path prefix of the output files
+
+    Returns:
+        int: Number of chunks written
+
+    Raises:
+        ValueError: If there is no chunk embedding or the dimensions do not match
+    """
+
+    if isinstance(data_with_embeddings, str):
+        data_with_embeddings = iter_json_data(data_with_embeddings)
+
+    paths = _paths(output_prefix)
+    os.makedirs(os.path.dirname(output_prefix) or ".", exist_ok=True)
+
+    # Rows, offsets and title ids are appended to raw files first, since the number
+    # of chunks is only known at the end
+    raw_paths = {name: f"{paths[name]}.raw" for name in ("matrix", "offsets", "title_ids")}
+    titles = []
+    count = 0
+    dimension = None
+    text_offset = 0
+
+    with open(raw_paths["matrix"], 'wb') as matrix_file, \
+            open(raw_paths["offsets"], 'wb') as offsets_file, \
+            open(raw_paths["title_ids"], 'wb') as title_ids_file, \
+            open(paths["texts"], 'wb') as texts_file:
+
+        offsets_file.write(np.zeros(1, dtype=np.int64).tobytes())
+        for title, texts, rows in _iter_title_blocks(data_with_embeddings):
+            title_id = len(titles)
+            titles.append(title)
+            if not texts:
+                continue
+
+            if dimension is None:
+                dimension = rows.shape[1]
+            elif rows.shape[1] != dimension:
+                raise ValueError(f"Dimension do not match: {rows.shape[1]} vs {dimension}")
+
+            offsets = np.empty(len(texts), dtype=np.int64)
+            for idx, text in enumerate(texts):
+                encoded = text.encode('utf-8')
+                texts_file.write(encoded)
+                text_offset += len(encoded)
+                offsets[idx] = text_offset
+
+            matrix_file.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+            offsets_file.write(offsets.tobytes())
+            title_ids_file.write(np.full(len(texts), title_id, dtype=np.int32).tobytes())
+            count += len(texts)
+
+    if count == 0:
+        for raw_path in raw_paths.values():
+            os.remove(raw_path)
+        raise ValueError("Data with embeddings does not contain any chunk embedding")
+
+    _raw_to_npy(raw_paths["matrix"], paths["matrix"], np.float32, (count, dimension))
+    _raw_to_npy(raw_paths["offsets"], paths["offsets"], np.int64, (count + 1,))
+    _raw_to_npy(raw_paths["title_ids"], paths["title_ids"], np.int32, (count,))
+    with open(paths["titles"], 'w', encoding='utf-8') as f:
+        json.dump(titles, f, ensure_ascii=False)
+
+    print(f"Exported {count} chunks to '{paths['matrix']}'")
+    return count
+
+
+def stream_search(
+    query_embedding: Union[List[float], NDArray[np.float64]],
+    matrix_prefix: str,
+    top_k: Optional[int] = None,
+    threshold: Optional[float] = None,
+    block_size: int = 65536,
+    max_results: int = 10000
+) -> List[Dict[str, Any]]:
+
+    """
+    Search a memory-mapped chunk matrix block by block.
+
+    Only one block of scores is held at a time. With top_k a min-heap of at most
+    top_k entries is kept; with only a threshold, the best max_results matches above
+    it are kept, so a low threshold can't grow the heap with the corpus.
+
+    Args:
+        query_embedding: The embedding vector for the query
+        matrix_prefix: Path prefix given to export_chunk_matrix
+        top_k: Number of top results to return (if specified)
+        threshold: Minimum similarity threshold (if specified)
+        block_size: Number of matrix rows scored per block
+        max_results: Maximum number of results in threshold-only mode
+
+    Returns:
+        List[Dict]: Matches sorted by similarity, each containing "chunk_text",
+        "title" and "similarity"
+
+    Raises:
+        ValueError: If neither top_k nor threshold is given, or the dimensions do not match
+    """
+
+    if top_k is None and threshold is None:
+        raise ValueError("Either top_k or threshold must be specified")
+
+    paths = _paths(matrix_prefix)
+    matrix = np.load(paths["matrix"], mmap_mode='r')
+
+    query = np.asarray(query_embedding, dtype=np.float32)
+    if query.shape != (matrix.shape[1],):
+        raise ValueError(f"Dimension do not match: {query.shape} vs ({matrix.shape[1]},)")
+    norm = np.linalg.norm(query)
+    if norm == 0:
+        return []
+    query = query / norm
+
+    limit = top_k if top_k is not None else max_results
+    matches = 0
+
+    heap: List[Tuple[float, int]] = []
+    for start in range(0, matrix.shape[0], block_size):
+        scores = matrix[start:start + block_size] @ query
+
+        candidates = np.arange(len(scores))
+        if threshold is not None:
+            candidates = np.flatnonzero(scores >= threshold)
+        matches += len(candidates)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+
+        for idx in candidates:
+            entry = (float(scores[idx]), start + int(idx))
+            if len(heap) < limit:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    del matrix
+
+    if top_k is None and matches > max_results:
+        print(f"Warning : {matches} chunks are above the threshold, only the best {max_results} are returned")
+
+    offsets = np.load(paths["offsets"], mmap_mode='r')
+    title_ids = np.load(paths["title_ids"], mmap_mode='r')
+    with open(paths["titles"], 'r', encoding='utf-8') as f:
+        titles = json.load(f)
+
+    results = []
+    with open(paths["texts"], 'rb') as texts_file:
+        for similarity, idx in sorted(heap, reverse=True):
+            texts_file.seek(int(offsets[idx]))
+            chunk_text = texts_file.read(int(offsets[idx + 1] - offsets[idx])).decode('utf-8')
+            results.append({
+                'chunk_text': chunk_text,
+                'title': titles[int(title_ids[idx])],
+                'similarity': similarity,
+            })
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Out-of-core similarity search over an exported chunk matrix.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export an embedded data file for stream_search")
+    export_parser.add_argument("data_file", help="File written by process_and_embed_data")
+    export_parser.add_argument("output_prefix", help="Path prefix of the exported files")
+
+    search_parser = subparsers.add_parser("search", help="Embed a question and search an exported matrix")
+    search_parser.add_argument("matrix_prefix", help="Path prefix given to export")
+    search_parser.add_argument("question")
+    search_parser.add_argument("--llm", default="openai", choices=["openai", "gemini"], help="Embedding provider of the export")
+    search_parser.add_argument("--top-k", type=int, default=None)
+    search_parser.add_argument("--threshold", type=float, default=None)
+    search_parser.add_argument("--max-results", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_chunk_matrix(args.data_file, args.output_prefix)
+    else:
+        embedding_module = importlib.import_module(f"tools.generate_embedding_{args.llm}")
+        embedded = embedding_module.process_and_embed_questions([args.question])
+        if not embedded:
+            raise SystemExit("Can't embed the question")
+        top_k = args.top_k if args.top_k is not None or args.threshold is not None else 5
+        for result in stream_search(embedded[0]["question_embedding"], args.matrix_prefix, top_k, args.threshold,
+                                    max_results=args.max_results):
+            print(f"{result['similarity']:.4f}  [{result['title']}]  {result['chunk_text'][:80]}")
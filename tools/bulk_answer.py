@@ -0,0 +1,210 @@
+"""
+Bulk offline Q&A job: answer a whole question file with the async query pipeline.
+Steps:
+1. Read the questions (JSON list of strings or of {"question": ...}, JSON Lines, or plain text
+   with one question per line) and drop duplicates.
+2. Skip the questions that already have an answer in the output JSON Lines file (resume);
+   a torn last line left by a killed job is cut first.
+3. Answer the rest with AsyncQueryPipeline: bounded concurrency per upstream plus
+   optional per-minute rate limits.
+4. Append every result to the output file as soon as it is ready, so an interrupted job
+   loses at most the questions in flight. Failed questions are recorded with their error
+   and retried by the next run.
+
+Run with:
+    python -m tools.bulk_answer questions.json --output output/answers.jsonl --top-k 5
+    python -m tools.stub_servers serve --port 8000   # stand-in LLM server
+    python -m tools.bulk_answer questions.txt --api-base http://localhost:8000/v1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import List, Dict, Any, Set, Union
+
+from .answer_router import AnswerRouter
+from .async_query import AsyncQueryPipeline
+
+
+def load_questions(question_file: str) -> List[str]:
+    """
+    Load questions from a JSON, JSON Lines or plain text file, without duplicates.
+
+    Args:
+        question_file: Path of the question file
+
+    Returns:
+        List[str]: Questions in file order
+    """
+
+    with open(question_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    if question_file.endswith('.json'):
+        items = json.loads(content)
+    elif question_file.endswith('.jsonl'):
+        items = [json.loads(line) for line in content.splitlines() if line.strip()]
+    else:
+        items = content.splitlines()
+
+    questions = []
+    for item in items:
+        question = item.get('question', '') if isinstance(item, dict) else item
+        question = question.strip()
+        if question:
+            questions.append(question)
+
+    return list(dict.fromkeys(questions))
+
+
+def load_answered(output_file: str) -> Set[str]:
+    """Questions that already have an answer in the output file, ignoring a torn last line."""
+
+    answered = set()
+    if not os.path.exists(output_file):
+        return answered
+
+    with open(output_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The job was killed while writing this line
+                continue
+            if record.get('answer') is not None:
+                answered.add(record['question'])
+
+    return answered
+
+
+def drop_torn_line(output_file: str) -> None:
+    """Cut a last line without newline (left by a killed job), so appended records start on their own line."""
+
+    if not os.path.exists(output_file):
+        return
+
+    with open(output_file, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
+
+
+async def run_bulk_job(
+    questions: List[str],
+    output_file: str,
+    collection: Any,
+    top_k: int = 5,
+    max_context_tokens: int = 1500,
+    **pipeline_options: Any
+) -> Dict[str, Any]:
+
+    """
+    Answer questions concurrently and append the results to a JSON Lines file.
+
+    Args:
+        questions: Questions to answer
+        output_file: JSON Lines output, one {"question", "answer", "error", "seconds"} per line
+        collection: ChromaDB collection to retrieve from
+        top_k: Number of chunks retrieved per question
+        max_context_tokens: Token budget of the context
+        pipeline_options: Keyword arguments of AsyncQueryPipeline (api_base, concurrency limits,
+            llm_requests_per_minute, ...)
+
+    Returns:
+        Dict: Counts of skipped, answered and failed questions and the elapsed time
+    """
+
+    drop_torn_line(output_file)
+    answered = load_answered(output_file)
+    pending = [question for question in questions if question not in answered]
+    summary = {"total": len(questions), "skipped": len(questions) - len(pending), "answered": 0, "failed": 0}
+    print(f"{summary['skipped']} / {len(questions)} questions already answered, {len(pending)} to go")
+
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    started = time.perf_counter()
+    started_at: Dict[int, float] = {}
+
+    async def timed_questions():
+        for index, question in enumerate(pending):
+            started_at[index] = time.perf_counter()
+            yield question
+
+    with open(output_file, 'a', encoding='utf-8') as f:
+        def write_result(index: int, question: str, answer: Union[str, BaseException]) -> None:
+            failed = isinstance(answer, BaseException)
+            summary["failed" if failed else "answered"] += 1
+            record = {
+                "question": question,
+                "answer": None if failed else answer,
+                "error": f"{type(answer).__name__}: {answer}" if failed else None,
+                "seconds": round(time.perf_counter() - started_at.pop(index), 3),
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+
+            done = summary["answered"] + summary["failed"]
+            if done % 100 == 0 or done == len(pending):
+                print(f"  {done} / {len(pending)} done ({summary['failed']} failed)")
+
+        async with AsyncQueryPipeline(collection, **pipeline_options) as pipeline:
+            await pipeline.ask_many(timed_questions(), top_k, max_context_tokens, on_answer=write_result)
+
+    summary["seconds"] = round(time.perf_counter() - started, 1)
+    if pipeline_options.get("router") is not None:
+        summary["routes"] = pipeline_options["router"].metrics()
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a file of questions with retrieval and the LLM.")
+    parser.add_argument("question_file", help="JSON, JSON Lines or text file with the questions")
+    parser.add_argument("--output", default="output/answers.jsonl", help="JSON Lines file of the answers (resumed if it exists)")
+    parser.add_argument("--db-path", default="./chroma_db")
+    parser.add_argument("--collection", default="text_embedding_openai", help="Index alias, the active version is queried")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--max-context-tokens", type=int, default=1500)
+    parser.add_argument("--api-base", default=None, help="Base URL of an OpenAI compatible server (e.g. a local stand-in)")
+    parser.add_argument("--llm-api-base", default=None, help="Base URL of the chat endpoint only")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--embedding-concurrency", type=int, default=4)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--llm-rpm", type=float, default=None, help="Chat requests per minute")
+    parser.add_argument("--embedding-rpm", type=float, default=None, help="Embedding requests per minute")
+    parser.add_argument("--route", action="store_true",
+                        help="Answer confident matches extractively or with the cheap model")
+    parser.add_argument("--extractive-threshold", type=float, default=0.8)
+    parser.add_argument("--cheap-threshold", type=float, default=0.6)
+    parser.add_argument("--route-by-language", action="store_true",
+                        help="Query only the chunks in the language of each question")
+    args = parser.parse_args()
+
+    from .index_versions import ActiveIndex
+
+    summary = asyncio.run(run_bulk_job(
+        load_questions(args.question_file),
+        args.output,
+        ActiveIndex(args.db_path, args.collection),
+        top_k=args.top_k,
+        max_context_tokens=args.max_context_tokens,
+        api_base=args.api_base,
+        llm_api_base=args.llm_api_base,
+        llm_concurrency=args.llm_concurrency,
+        embedding_concurrency=args.embedding_concurrency,
+        max_pending=args.max_pending,
+        llm_requests_per_minute=args.llm_rpm,
+        embedding_requests_per_minute=args.embedding_rpm,
+        router=AnswerRouter(args.extractive_threshold, args.cheap_threshold) if args.route else None,
+        route_by_language=args.route_by_language,
+    ))
+    print(json.dumps(summary, ensure_ascii=False))
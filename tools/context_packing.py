@@ -0,0 +1,214 @@
+"""
+Pack retrieved chunks into a prompt context under a token budget.
+Steps:
+1. Walk the retrieved chunks in relevance order.
+2. Merge chunks that are adjacent or overlapping in the same title into one passage
+   (the splitter emits overlapping neighbours, so the overlap is written only once).
+3. Drop passages that are near-duplicates of a passage already selected.
+4. Add passages in relevance order until the token budget is used up; a merged passage
+   that does not fit is trimmed to the neighbours of its best ranked chunk that do.
+"""
+
+import re
+from typing import List, Dict, Any, Optional, Set
+
+
+# CJK ideographs, kana and full-width punctuation are roughly one token per character
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of LLM tokens in a text without a tokenizer.
+
+    CJK characters are counted as one token each and the remaining characters as
+    one token per four characters, which is close to the GPT tokenizers for the
+    mixed Chinese / English manual text.
+    """
+
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def _shingles(text: str, size: int = 5) -> Set[str]:
+    """Character shingles of a whitespace-normalized text."""
+
+    normalized = re.sub(r'\s+', ' ', text).strip()
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i+size] for i in range(len(normalized) - size + 1)}
+
+
+def _containment(candidate: Set[str], other: Set[str]) -> float:
+    """Share of the candidate's shingles that also appear in the other text."""
+
+    if not candidate or not other:
+        return 0.0
+    return len(candidate & other) / len(candidate)
+
+
+def merge_overlapping_text(first: str, second: str, max_overlap: int = 200, min_overlap: int = 10) -> str:
+    """
+    Join two consecutive chunks, writing the text they share only once.
+
+    Overlaps shorter than min_overlap are treated as coincidental (a punctuation mark
+    or a single CJK character), so the chunks are joined with a newline instead.
+
+    Args:
+        first: The earlier chunk
+        second: The later chunk
+        max_overlap: Longest suffix / prefix overlap to look for
+        min_overlap: Shortest suffix / prefix overlap that is merged
+
+    Returns:
+        str: The merged text
+    """
+
+    if len(second) >= min_overlap and second in first:
+        return first
+    if len(first) >= min_overlap and first in second:
+        return second
+
+    for size in range(min(max_overlap, len(first), len(second)), min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+
+    return f"{first}\n{second}"
+
+
+def _merge_chunks(chunks: Dict[Optional[int], str], indices: List[Optional[int]]) -> str:
+    """Merge the chunks of a passage in chunk order."""
+
+    text = chunks[indices[0]]
+    for index in indices[1:]:
+        text = merge_overlapping_text(text, chunks[index])
+    return text
+
+
+def _trim_passage(passage: Dict[str, Any], token_budget: int) -> Optional[List[int]]:
+    """
+    Longest run of neighbouring chunks around the best ranked chunk of a passage that
+    fits the budget, grown one better ranked neighbour at a time.
+
+    Returns:
+        Optional[List[int]]: Chunk indices of the trimmed passage, None if even the best
+        ranked chunk alone does not fit
+    """
+
+    indices = sorted(passage["chunks"])
+    ranks = passage["ranks"]
+    low = high = min(range(len(indices)), key=lambda position: ranks[indices[position]])
+    if estimate_tokens(passage["chunks"][indices[low]]) > token_budget:
+        return None
+
+    while True:
+        neighbours = [position for position in (low - 1, high + 1) if 0 <= position < len(indices)]
+        for position in sorted(neighbours, key=lambda position: ranks[indices[position]]):
+            run = indices[min(low, position):max(high, position) + 1]
+            if estimate_tokens(_merge_chunks(passage["chunks"], run)) <= token_budget:
+                low, high = min(low, position), max(high, position)
+                break
+        else:
+            return indices[low:high + 1]
+
+
+def pack_context(
+    documents: List[str],
+    metadatas: Optional[List[Dict[str, Any]]] = None,
+    token_budget: int = 1500,
+    duplicate_threshold: float = 0.8
+) -> List[Dict[str, Any]]:
+
+    """
+    Select and merge retrieved chunks into passages that fit a token budget.
+
+    Args:
+        documents: Retrieved chunk texts, most relevant first
+        metadatas: Metadata of each chunk; "title" and "chunk_index" enable merging of
+            neighbouring chunks (default is None, no merging)
+        token_budget: Maximum estimated tokens of all selected passages together
+        duplicate_threshold: Share of a passage's shingles found in an already selected
+            passage above which it is considered a near-duplicate and dropped
+
+    Returns:
+        List[Dict]: Selected passages in relevance order, each containing
+        "title", "text", "chunk_indices" and "tokens"
+    """
+
+    if metadatas is None:
+        metadatas = [{}] * len(documents)
+
+    # Group chunks into passages, in the order of the best ranked chunk of each passage
+    passages = []
+    for rank, (document, metadata) in enumerate(zip(documents, metadatas)):
+        metadata = metadata or {}
+        title = metadata.get("title")
+        chunk_index = metadata.get("chunk_index")
+
+        if title is None or chunk_index is None:
+            passages.append({"title": title, "chunks": {None: document}, "ranks": {None: rank}})
+            continue
+
+        neighbours = [
+            passage for passage in passages
+            if passage["title"] == title and None not in passage["chunks"]
+            and any(abs(chunk_index - index) <= 1 for index in passage["chunks"])
+        ]
+        if not neighbours:
+            passages.append({"title": title, "chunks": {chunk_index: document}, "ranks": {chunk_index: rank}})
+            continue
+
+        # The new chunk may bridge two passages of the same title, keep the higher ranked one
+        target = neighbours[0]
+        target["chunks"][chunk_index] = document
+        target["ranks"].setdefault(chunk_index, rank)
+        for passage in neighbours[1:]:
+            target["chunks"].update(passage["chunks"])
+            target["ranks"].update(passage["ranks"])
+            passages.remove(passage)
+
+    packed = []
+    selected_shingles = []
+    used_tokens = 0
+
+    for passage in passages:
+        indices = sorted(passage["chunks"], key=lambda index: -1 if index is None else index)
+        text = _merge_chunks(passage["chunks"], indices)
+        tokens = estimate_tokens(text)
+
+        if used_tokens + tokens > token_budget:
+            # The neighbours merged into a passage must not push its best match out
+            indices = _trim_passage(passage, token_budget - used_tokens) if None not in passage["chunks"] else None
+            if indices is None:
+                # A smaller, less relevant passage may still fit
+                continue
+            text = _merge_chunks(passage["chunks"], indices)
+            tokens = estimate_tokens(text)
+
+        shingles = _shingles(text)
+        if any(_containment(shingles, other) >= duplicate_threshold for other in selected_shingles):
+            continue
+
+        packed.append({
+            "title": passage["title"],
+            "text": text,
+            "chunk_indices": [index for index in indices if index is not None],
+            "tokens": tokens,
+        })
+        selected_shingles.append(shingles)
+        used_tokens += tokens
+
+    return packed
+
+
+def format_context(passages: List[Dict[str, Any]]) -> str:
+    """Render packed passages as the document section of a prompt."""
+
+    sections = []
+    for passage in passages:
+        if passage.get("title"):
+            sections.append(f"【{passage['title']}】\n{passage['text']}")
+        else:
+            sections.append(passage["text"])
+
+    return "\n\n".join(sections)
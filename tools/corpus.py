@@ -0,0 +1,592 @@
+"""
+Columnar in-memory corpus shared by all retrieval code.
+
+Instead of the nested list of dicts stored in text_embedding_*.json
+(title, title_embedding, chunks[{chunk_text, chunk_embedding}]), a Corpus keeps:
+- one interned string table holding every title and chunk text once,
+- float32 embedding matrices (rows normalized to unit length, norms kept aside),
+- offset arrays mapping each title to its contiguous range of chunk rows,
+- a CSR list of extra source titles for chunks collapsed by deduplication,
+- per-title source metadata (url, product, language) as string ids, used by search filters,
+- the detected language of each chunk as a string id, used to partition the corpus by language.
+
+Build it once with Corpus.from_records / Corpus.from_embeddings and pass it to the
+search, indexing and export code; to_records() converts back to the JSON format
+(with the API values for a corpus from from_embeddings, float32 precision otherwise).
+"""
+
+from typing import List, Dict, Any, Union, Optional, Iterable, Tuple
+import numpy as np
+from numpy.typing import NDArray
+
+from .source_metadata import PAGE_FIELDS, chunk_language
+
+
+def _normalize(matrix: NDArray[np.float32]) -> NDArray[np.float32]:
+    """Return the row norms and normalize the matrix rows in place."""
+
+    norms = np.linalg.norm(matrix, axis=1)
+    safe_norms = np.where(norms == 0, 1.0, norms).astype(np.float32)
+    matrix /= safe_norms[:, None]
+    return norms.astype(np.float32)
+
+
+def _stack(embeddings: List[Optional[List[float]]], dimension: int) -> NDArray[np.float32]:
+    """Stack embeddings into a float32 matrix, missing embeddings become zero rows."""
+
+    matrix = np.zeros((len(embeddings), dimension), dtype=np.float32)
+    for row, embedding in enumerate(embeddings):
+        if embedding:
+            if len(embedding) != dimension:
+                raise ValueError(f"Dimension do not match: {len(embedding)} vs {dimension}")
+            matrix[row] = embedding
+    return matrix
+
+
+class Corpus:
+    """
+    Array-backed corpus of titles and chunks with their embeddings.
+
+    Attributes:
+        strings: Interned string table (titles and chunk texts)
+        title_text_ids: String id of each title
+        title_matrix / title_norms: Normalized title embeddings and their original norms
+        chunk_text_ids: String id of each chunk text
+        chunk_matrix / chunk_norms: Normalized chunk embeddings and their original norms
+        chunk_offsets: Chunks of title t are rows chunk_offsets[t]:chunk_offsets[t + 1]
+        chunk_title_ids: Title row of each chunk
+        source_offsets / source_title_ids: CSR list of the source title string ids of each
+            chunk (empty unless the chunk was deduplicated)
+        title_coarse_matrix / chunk_coarse_matrix: Normalized coarse embeddings, or None
+        title_fields: String ids of the source metadata of each title, by field name
+        chunk_language_ids: String id of the language of each chunk (langid code, "" if unknown)
+    """
+
+    __slots__ = (
+        "strings",
+        "_string_ids",
+        "title_text_ids",
+        "title_matrix",
+        "title_norms",
+        "title_coarse_matrix",
+        "chunk_text_ids",
+        "chunk_matrix",
+        "chunk_norms",
+        "chunk_coarse_matrix",
+        "chunk_offsets",
+        "chunk_title_ids",
+        "source_offsets",
+        "source_title_ids",
+        "title_fields",
+        "chunk_language_ids",
+        "_exact_title_embeddings",
+        "_exact_chunk_embeddings",
+    )
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        self.title_text_ids = np.zeros(0, dtype=np.int32)
+        self.title_matrix = np.zeros((0, 0), dtype=np.float32)
+        self.title_norms = np.zeros(0, dtype=np.float32)
+        self.title_coarse_matrix: Optional[NDArray[np.float32]] = None
+        self.chunk_text_ids = np.zeros(0, dtype=np.int32)
+        self.chunk_matrix = np.zeros((0, 0), dtype=np.float32)
+        self.chunk_norms = np.zeros(0, dtype=np.float32)
+        self.chunk_coarse_matrix: Optional[NDArray[np.float32]] = None
+        self.chunk_offsets = np.zeros(1, dtype=np.int64)
+        self.chunk_title_ids = np.zeros(0, dtype=np.int32)
+        self.source_offsets = np.zeros(1, dtype=np.int64)
+        self.source_title_ids = np.zeros(0, dtype=np.int32)
+        self.title_fields: Dict[str, NDArray[np.int32]] = {}
+        self.chunk_language_ids = np.zeros(0, dtype=np.int32)
+        # Embeddings as returned by the API, kept by from_embeddings so to_records writes them unchanged
+        self._exact_title_embeddings: Optional[List[Optional[List[float]]]] = None
+        self._exact_chunk_embeddings: Optional[List[List[float]]] = None
+
+    def intern(self, text: str) -> int:
+        """Return the id of a string in the string table, adding it if needed."""
+
+        string_id = self._string_ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(text)
+            self._string_ids[text] = string_id
+        return string_id
+
+    def string_id(self, text: str) -> Optional[int]:
+        """Return the id of a string, or None if it is not in the corpus."""
+
+        return self._string_ids.get(text)
+
+    @property
+    def n_titles(self) -> int:
+        return len(self.title_text_ids)
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self.chunk_text_ids)
+
+    def title(self, row: int) -> str:
+        return self.strings[self.title_text_ids[row]]
+
+    def chunk_text(self, row: int) -> str:
+        return self.strings[self.chunk_text_ids[row]]
+
+    def title_field(self, row: int, field: str) -> str:
+        """Source metadata value of a title ("" if unknown)."""
+
+        if field == "title":
+            return self.title(row)
+        return self.strings[self.title_fields[field][row]] if field in self.title_fields else ""
+
+    def chunk_language(self, row: int) -> str:
+        return self.strings[self.chunk_language_ids[row]] if len(self.chunk_language_ids) else ""
+
+    def detect_chunk_languages(self) -> None:
+        """
+        Detect the language of the chunks that have none stored (files written before
+        languages were kept), with the page locale as the fallback.
+
+        Only the search paths that partition or filter by language call this, so loading
+        a corpus never runs language detection. Chunks that already have a language are
+        not detected again.
+        """
+
+        unknown_id = self.string_id("")
+        if unknown_id is None or not len(self.chunk_language_ids):
+            return
+
+        for row in np.flatnonzero(self.chunk_language_ids == unknown_id):
+            text = self.chunk_text(row)
+            if text.strip():
+                page_language = self.title_field(int(self.chunk_title_ids[row]), "language")
+                self.chunk_language_ids[row] = self.intern(chunk_language(text, page_language))
+
+    def chunk_source_titles(self, row: int) -> List[str]:
+        start, end = self.source_offsets[row], self.source_offsets[row + 1]
+        return [self.strings[string_id] for string_id in self.source_title_ids[start:end]]
+
+    def chunk_vectors(self) -> NDArray[np.float32]:
+        """Chunk embeddings with their original norms restored."""
+
+        return self.chunk_matrix * self.chunk_norms[:, None]
+
+    @classmethod
+    def _build(
+        cls,
+        titles: List[str],
+        title_embeddings: List[Optional[List[float]]],
+        chunks_per_title: List[List[str]],
+        chunk_embeddings: List[Optional[List[float]]],
+        chunk_sources: List[List[str]],
+        title_coarse: Optional[List[List[float]]] = None,
+        chunk_coarse: Optional[List[List[float]]] = None,
+        title_metadata: Optional[List[Dict[str, Any]]] = None,
+        chunk_languages: Optional[List[Optional[str]]] = None
+    ) -> "Corpus":
+
+        corpus = cls()
+        dimension = next((len(e) for e in chunk_embeddings if e), None) \
+            or next((len(e) for e in title_embeddings if e), 0)
+
+        corpus.title_text_ids = np.array([corpus.intern(title) for title in titles], dtype=np.int32)
+        corpus.title_matrix = _stack(title_embeddings, dimension)
+        corpus.title_norms = _normalize(corpus.title_matrix)
+
+        counts = np.array([len(chunks) for chunks in chunks_per_title], dtype=np.int64)
+        corpus.chunk_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        corpus.chunk_title_ids = np.repeat(np.arange(len(titles), dtype=np.int32), counts)
+        corpus.chunk_text_ids = np.array(
+            [corpus.intern(text) for chunks in chunks_per_title for text in chunks], dtype=np.int32
+        )
+        corpus.chunk_matrix = _stack(chunk_embeddings, dimension)
+        corpus.chunk_norms = _normalize(corpus.chunk_matrix)
+
+        source_counts = np.array([len(sources) for sources in chunk_sources], dtype=np.int64)
+        corpus.source_offsets = np.concatenate(([0], np.cumsum(source_counts))).astype(np.int64)
+        corpus.source_title_ids = np.array(
+            [corpus.intern(title) for sources in chunk_sources for title in sources], dtype=np.int32
+        )
+
+        # Languages are detected once at ingestion (from_embeddings); a chunk without a stored
+        # language gets "", see detect_chunk_languages
+        if chunk_languages is None:
+            chunk_languages = [None] * len(corpus.chunk_text_ids)
+        corpus.chunk_language_ids = np.array([corpus.intern(language or "") for language in chunk_languages], dtype=np.int32)
+
+        if title_metadata is not None:
+            corpus.title_fields = {
+                field: np.array([corpus.intern(metadata.get(field) or "") for metadata in title_metadata], dtype=np.int32)
+                for field in PAGE_FIELDS
+            }
+
+        if title_coarse is not None and chunk_coarse is not None:
+            coarse_dimension = len(chunk_coarse[0]) if chunk_coarse else len(title_coarse[0]) if title_coarse else 0
+            corpus.title_coarse_matrix = _stack(title_coarse, coarse_dimension)
+            corpus.chunk_coarse_matrix = _stack(chunk_coarse, coarse_dimension)
+            _normalize(corpus.title_coarse_matrix)
+            _normalize(corpus.chunk_coarse_matrix)
+
+        return corpus
+
+    @classmethod
+    def from_records(cls, data_with_embeddings: List[Dict[str, Any]]) -> "Corpus":
+        """
+        Build a corpus from the JSON format written by process_and_embed_data.
+
+        Chunks without text or embedding are skipped; coarse matrices are kept only
+        when every title and chunk has a coarse embedding.
+        """
+
+        titles, title_embeddings, title_coarse = [], [], []
+        chunks_per_title, chunk_embeddings, chunk_coarse, chunk_sources = [], [], [], []
+        chunk_languages = []
+
+        for item in data_with_embeddings:
+            titles.append(item.get('title', ''))
+            title_embeddings.append(item.get('title_embedding'))
+            title_coarse.append(item.get('title_embedding_coarse'))
+
+            texts = []
+            for chunk in item.get('chunks', []):
+                if chunk.get('chunk_text') is None or not chunk.get('chunk_embedding'):
+                    continue
+                texts.append(chunk['chunk_text'])
+                chunk_embeddings.append(chunk['chunk_embedding'])
+                chunk_coarse.append(chunk.get('chunk_embedding_coarse'))
+                chunk_sources.append(chunk.get('source_titles', []))
+                chunk_languages.append(chunk.get('language'))
+            chunks_per_title.append(texts)
+
+        has_coarse = all(e is not None for e in title_coarse) and all(e is not None for e in chunk_coarse)
+        return cls._build(
+            titles, title_embeddings, chunks_per_title, chunk_embeddings, chunk_sources,
+            title_coarse if has_coarse else None,
+            chunk_coarse if has_coarse else None,
+            data_with_embeddings,
+            chunk_languages,
+        )
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        chunked_data: List[Dict[str, Any]],
+        embeddings: List[List[float]],
+        coarse_dim: Optional[int] = None
+    ) -> "Corpus":
+
+        """
+        Build a corpus from chunk_data output and the embeddings returned for it.
+
+        The corpus keeps a reference to the embeddings, so to_records() writes the values
+        the API returned instead of the float32 matrices.
+
+        Args:
+            chunked_data: List returned by chunk_data (optionally deduplicated)
+            embeddings: Embeddings in the order titles and chunks were sent to the API
+                (each non-empty title followed by the chunks of that title)
+            coarse_dim: If given, also keep reduced embeddings with this many dimensions
+
+        Raises:
+            ValueError: If coarse_dim is not positive
+        """
+
+        if coarse_dim is not None and coarse_dim <= 0:
+            raise ValueError(f"Reduced dimension must be positive, got {coarse_dim}")
+
+        titles, title_embeddings = [], []
+        chunks_per_title, chunk_embeddings, chunk_sources, chunk_languages = [], [], [], []
+
+        embedding_idx = 0
+        for item in chunked_data:
+            title = item.get('title', '')
+            titles.append(title)
+            if title:
+                title_embeddings.append(embeddings[embedding_idx])
+                embedding_idx += 1
+            else:
+                title_embeddings.append(None)
+
+            chunks = item.get('chunks', [])
+            chunks_per_title.append(chunks)
+            chunk_embeddings.extend(embeddings[embedding_idx:embedding_idx + len(chunks)])
+            embedding_idx += len(chunks)
+
+            sources = item.get('chunk_source_titles', [])
+            chunk_sources.extend(sources[idx] if idx < len(sources) else [] for idx in range(len(chunks)))
+
+            # Detected here, at ingestion, and written to the records by to_records
+            chunk_languages.extend(chunk_language(chunk, item.get('language', '')) for chunk in chunks)
+
+        corpus = cls._build(
+            titles, title_embeddings, chunks_per_title, chunk_embeddings, chunk_sources,
+            title_metadata=chunked_data,
+            chunk_languages=chunk_languages,
+        )
+        corpus._exact_title_embeddings = title_embeddings
+        corpus._exact_chunk_embeddings = chunk_embeddings
+        if coarse_dim is not None:
+            # Both text-embedding-3-small and text-embedding-004 are trained so that a prefix of
+            # the vector is itself a usable embedding (what the `dimensions` option of the OpenAI
+            # API returns), so the coarse vectors are derived locally without another API call
+            corpus.title_coarse_matrix = corpus.title_matrix[:, :coarse_dim].copy()
+            corpus.chunk_coarse_matrix = corpus.chunk_matrix[:, :coarse_dim].copy()
+            _normalize(corpus.title_coarse_matrix)
+            _normalize(corpus.chunk_coarse_matrix)
+        return corpus
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """
+        Convert back to the JSON format written by process_and_embed_data.
+
+        A corpus built by from_embeddings writes the embeddings exactly as the API returned
+        them and derives the coarse ones from those in float64. Any other corpus only has
+        its float32 matrices, so the written embeddings are float32 values rounded to
+        8 decimals (a change below 1e-7 per component against the file it was read from).
+        """
+
+        exact = self._exact_chunk_embeddings is not None
+        if exact:
+            title_vectors = self._exact_title_embeddings
+            chunk_vectors = self._exact_chunk_embeddings
+        else:
+            # float32 values printed as float64 get ~17 digits in JSON; 8 decimals keep the
+            # precision float32 actually has for embedding components and keep the file small
+            title_vectors = np.round((self.title_matrix * self.title_norms[:, None]).astype(np.float64), 8).tolist()
+            chunk_vectors = np.round(self.chunk_vectors().astype(np.float64), 8).tolist()
+
+        def coarse(vector: List[float], coarse_matrix: NDArray[np.float32], row: int) -> List[float]:
+            if not exact:
+                return np.round(coarse_matrix[row].astype(np.float64), 8).tolist()
+            reduced = np.asarray(vector, dtype=np.float64)[:coarse_matrix.shape[1]]
+            norm = np.linalg.norm(reduced)
+            return (reduced / norm if norm else reduced).tolist()
+
+        records = []
+        for title_row in range(self.n_titles):
+            record = {"title": self.title(title_row)}
+            for field in self.title_fields:
+                if self.title_field(title_row, field):
+                    record[field] = self.title_field(title_row, field)
+            record["title_embedding"] = list(title_vectors[title_row]) if self.title_norms[title_row] else []
+            if self.title_coarse_matrix is not None:
+                record["title_embedding_coarse"] = coarse(title_vectors[title_row] or [], self.title_coarse_matrix, title_row)
+
+            chunks = []
+            for row in range(self.chunk_offsets[title_row], self.chunk_offsets[title_row + 1]):
+                chunk = {
+                    "chunk_text": self.chunk_text(row),
+                    "chunk_embedding": list(chunk_vectors[row]),
+                }
+                if self.chunk_coarse_matrix is not None:
+                    chunk["chunk_embedding_coarse"] = coarse(chunk_vectors[row], self.chunk_coarse_matrix, row)
+                source_titles = self.chunk_source_titles(row)
+                if source_titles:
+                    chunk["source_titles"] = source_titles
+                if self.chunk_language(row):
+                    chunk["language"] = self.chunk_language(row)
+                chunks.append(chunk)
+
+            record["chunks"] = chunks
+            records.append(record)
+
+        return records
+
+    def subset(self, chunk_rows: Iterable[int]) -> "Corpus":
+        """
+        Corpus of the given chunk rows and the titles they belong to, e.g. one language.
+
+        The matrices are copied, so scoring a subset only touches its own rows; the string
+        table is shared with this corpus.
+        """
+
+        chunk_rows = np.unique(np.fromiter(chunk_rows, dtype=np.int64))
+        title_rows = np.unique(self.chunk_title_ids[chunk_rows])
+        new_title_rows = np.full(self.n_titles, -1, dtype=np.int32)
+        new_title_rows[title_rows] = np.arange(len(title_rows), dtype=np.int32)
+
+        part = Corpus()
+        part.strings = self.strings
+        part._string_ids = self._string_ids
+
+        part.title_text_ids = self.title_text_ids[title_rows]
+        part.title_matrix = self.title_matrix[title_rows]
+        part.title_norms = self.title_norms[title_rows]
+        if self.title_coarse_matrix is not None:
+            part.title_coarse_matrix = self.title_coarse_matrix[title_rows]
+        part.title_fields = {field: values[title_rows] for field, values in self.title_fields.items()}
+
+        # Rows stay in order, so the chunks of each title stay contiguous
+        part.chunk_title_ids = new_title_rows[self.chunk_title_ids[chunk_rows]]
+        counts = np.bincount(part.chunk_title_ids, minlength=len(title_rows))
+        part.chunk_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        part.chunk_text_ids = self.chunk_text_ids[chunk_rows]
+        part.chunk_matrix = self.chunk_matrix[chunk_rows]
+        part.chunk_norms = self.chunk_norms[chunk_rows]
+        if self.chunk_coarse_matrix is not None:
+            part.chunk_coarse_matrix = self.chunk_coarse_matrix[chunk_rows]
+        if len(self.chunk_language_ids):
+            part.chunk_language_ids = self.chunk_language_ids[chunk_rows]
+
+        source_counts = np.diff(self.source_offsets)
+        owners = np.repeat(np.arange(self.n_chunks), source_counts)
+        part.source_title_ids = self.source_title_ids[np.isin(owners, chunk_rows)]
+        part.source_offsets = np.concatenate(([0], np.cumsum(source_counts[chunk_rows]))).astype(np.int64)
+
+        return part
+
+    def title_mask_where(self, where: Dict[str, Any]) -> NDArray[np.bool_]:
+        """
+        Titles matching a metadata filter, in the ChromaDB where syntax.
+
+        Supported: {"field": value}, {"field": {"$eq": value}}, {"field": {"$ne": value}},
+        {"field": {"$in": [...]}}, {"field": {"$nin": [...]}} and {"$and": [...]} / {"$or": [...]}
+        of those, on "title" and the source metadata fields.
+
+        Raises:
+            ValueError: For an unknown field or operator
+        """
+
+        mask = np.ones(self.n_titles, dtype=bool)
+        for field, condition in where.items():
+            if field in ("$and", "$or"):
+                masks = [self.title_mask_where(sub_where) for sub_where in condition]
+                if masks:
+                    mask &= np.logical_and.reduce(masks) if field == "$and" else np.logical_or.reduce(masks)
+                elif field == "$or":
+                    mask[:] = False
+                continue
+
+            if field == "title":
+                values = self.title_text_ids
+            elif field in PAGE_FIELDS:
+                values = self.title_fields.get(field, np.full(self.n_titles, -1, dtype=np.int32))
+            else:
+                raise ValueError(f"Cannot filter on '{field}', available: title, {', '.join(PAGE_FIELDS)}")
+
+            operator, operand = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+            if operator in ("$eq", "$ne"):
+                operand = [operand]
+            elif operator not in ("$in", "$nin"):
+                raise ValueError(f"Unsupported operator '{operator}'")
+
+            # Values that are not in the string table cannot match any title
+            ids = [self.string_id(value) for value in operand if isinstance(value, str)]
+            matched = np.isin(values, [string_id for string_id in ids if string_id is not None])
+            mask &= ~matched if operator in ("$ne", "$nin") else matched
+
+        return mask
+
+    def chunk_rows_for_titles(self, title_string_ids: Iterable[int]) -> NDArray[np.int64]:
+        """
+        Rows of the chunks that belong to any of the given titles, including
+        deduplicated chunks that list one of them in their source titles.
+        """
+
+        title_string_ids = np.fromiter(title_string_ids, dtype=np.int32)
+        mask = np.isin(self.title_text_ids[self.chunk_title_ids], title_string_ids)
+
+        if len(self.source_title_ids):
+            owners = np.repeat(np.arange(self.n_chunks), np.diff(self.source_offsets))
+            mask[owners[np.isin(self.source_title_ids, title_string_ids)]] = True
+
+        return np.flatnonzero(mask)
+
+    def _score(
+        self,
+        query: NDArray[np.float32],
+        matrix: NDArray[np.float32],
+        coarse_matrix: Optional[NDArray[np.float32]],
+        rows: NDArray[np.int64],
+        coarse_candidates: Optional[int]
+    ) -> Tuple[NDArray[np.int64], NDArray[np.float32]]:
+
+        """Score the given rows, optionally shortlisting them with the coarse matrix first."""
+
+        if coarse_candidates is not None and coarse_matrix is not None and len(rows) > coarse_candidates:
+            coarse_query = query[:coarse_matrix.shape[1]]
+            coarse_norm = np.linalg.norm(coarse_query)
+            if coarse_norm > 0:
+                coarse_scores = coarse_matrix[rows] @ (coarse_query / coarse_norm)
+                rows = np.sort(rows[np.argpartition(-coarse_scores, coarse_candidates - 1)[:coarse_candidates]])
+
+        return rows, matrix[rows] @ query
+
+    def search(
+        self,
+        query_embedding: Union[List[float], NDArray[np.float64]],
+        title_top_k: int = 5,
+        chunk_top_percentage: Optional[float] = 0.75,
+        include_titles: bool = True,
+        coarse_candidates: Optional[int] = None,
+        chunk_top_k: Optional[int] = None,
+        chunk_rows: Optional[NDArray[np.int64]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        title_rows: Optional[NDArray[np.int64]] = None
+    ) -> List[Dict[str, Any]]:
+
+        """
+        Find the most similar chunks to a query, see find_most_similar_chunks.
+
+        Args:
+            query_embedding: The embedding vector for the query
+            title_top_k: Number of top similar titles to consider
+            chunk_top_percentage: Minimum similarity threshold for chunks (None keeps all)
+            include_titles: Whether to restrict the chunks to the top similar titles
+            coarse_candidates: Shortlist size for coarse-to-fine search (if specified)
+            chunk_top_k: Maximum number of chunks to return (if specified)
+            chunk_rows: Restrict the search to these chunk rows (if specified)
+            where: Metadata filter applied before scoring (see title_mask_where)
+            title_rows: Restrict the titles ranked by include_titles to these rows (if specified)
+
+        Returns:
+            List[Dict]: Unique chunk texts with their similarity, most similar first
+        """
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if query.shape != (self.chunk_matrix.shape[1],):
+            raise ValueError(f"Dimension do not match: {query.shape} vs ({self.chunk_matrix.shape[1]},)")
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        rows = np.arange(self.n_chunks) if chunk_rows is None else np.asarray(chunk_rows)
+        title_mask = self.title_norms > 0
+        if title_rows is not None:
+            title_mask &= np.isin(np.arange(self.n_titles), title_rows)
+
+        # Pre-filter: only the titles (and their chunks) matching the metadata are scored
+        if where:
+            allowed = self.title_mask_where(where)
+            title_mask &= allowed
+            rows = np.intersect1d(rows, self.chunk_rows_for_titles(self.title_text_ids[allowed]))
+
+        if include_titles:
+            title_rows = np.flatnonzero(title_mask)
+            title_rows, title_scores = self._score(
+                query, self.title_matrix, self.title_coarse_matrix, title_rows, coarse_candidates
+            )
+            top_titles = title_rows[np.argsort(-title_scores, kind='stable')[:title_top_k]]
+            rows = np.intersect1d(rows, self.chunk_rows_for_titles(self.title_text_ids[top_titles]))
+
+        rows, scores = self._score(query, self.chunk_matrix, self.chunk_coarse_matrix, rows, coarse_candidates)
+
+        if chunk_top_percentage is not None:
+            keep = scores >= chunk_top_percentage
+            rows, scores = rows[keep], scores[keep]
+
+        # Sort by similarity and remove duplicates based on chunk text while preserving order
+        results = []
+        seen_text_ids = set()
+        for idx in np.argsort(-scores, kind='stable'):
+            text_id = int(self.chunk_text_ids[rows[idx]])
+            if text_id in seen_text_ids or not self.strings[text_id]:
+                continue
+            seen_text_ids.add(text_id)
+            results.append({'chunk_text': self.strings[text_id], 'similarity': float(scores[idx])})
+            if chunk_top_k is not None and len(results) >= chunk_top_k:
+                break
+
+        return results
@@ -0,0 +1,220 @@
+"""
+Near-duplicate chunk elimination with MinHash / LSH, run between chunking and embedding.
+Steps:
+1. Turn every chunk into a set of character shingles (works for both Chinese and English text).
+2. Build a MinHash signature per chunk from mmh3 hashes of its shingles.
+3. Collapse texts with identical signatures at once, then use LSH banding on the distinct
+   signatures: every member of a bucket is compared with the bucket's group leaders only
+   (not with every other member), so repeated boilerplate stays linear.
+4. Collapse each group of near-duplicates into its first occurrence, which keeps the
+   titles of every page the text appeared in.
+"""
+
+import re
+from collections import defaultdict
+from typing import List, Dict, Any, Tuple, Optional
+import mmh3
+import numpy as np
+from numpy.typing import NDArray
+
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _shingles(text: str, shingle_size: int) -> List[str]:
+    """Character shingles of a whitespace-normalized text."""
+
+    normalized = re.sub(r'\s+', ' ', text).strip().lower()
+    if len(normalized) <= shingle_size:
+        return [normalized]
+    return [normalized[i:i+shingle_size] for i in range(len(normalized) - shingle_size + 1)]
+
+
+def _permutations(num_perm: int, seed: int) -> Tuple[NDArray[np.uint64], NDArray[np.uint64]]:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signature(
+    text: str,
+    num_perm: int = 128,
+    shingle_size: int = 5,
+    seed: int = 1,
+    permutations: Optional[Tuple[NDArray[np.uint64], NDArray[np.uint64]]] = None
+) -> NDArray[np.uint64]:
+
+    """
+    Compute the MinHash signature of a text.
+
+    Each shingle is hashed once with mmh3 and the num_perm hash functions are
+    derived from it as (a * h + b) mod p, so the cost is one mmh3 call per shingle.
+
+    Args:
+        text: Text to sign
+        num_perm: Number of hash functions (signature length)
+        shingle_size: Characters per shingle
+        seed: Seed of the hash function parameters, must match between compared signatures
+        permutations: Hash function parameters from _permutations(num_perm, seed), to reuse
+            them across texts (default is None, derived from seed)
+
+    Returns:
+        NDArray: Signature of length num_perm
+    """
+
+    hashes = np.array(
+        [mmh3.hash(shingle, signed=False) for shingle in set(_shingles(text, shingle_size))],
+        dtype=np.uint64
+    )
+    a, b = permutations if permutations is not None else _permutations(num_perm, seed)
+    # uint64 arithmetic wraps around, as in the usual MinHash implementations
+    permuted = (np.outer(hashes, a) + b) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0)
+
+
+def find_near_duplicates(
+    texts: List[str],
+    threshold: float = 0.85,
+    num_perm: int = 128,
+    bands: int = 32,
+    shingle_size: int = 5
+) -> List[int]:
+
+    """
+    Group near-duplicate texts.
+
+    Args:
+        texts: Texts to compare
+        threshold: Minimum estimated Jaccard similarity of two duplicates
+        num_perm: Signature length, must be divisible by bands
+        bands: Number of LSH bands; more bands find more candidates at lower similarity
+        shingle_size: Characters per shingle
+
+    Returns:
+        List[int]: For every text, the index of the canonical (first) text of its group
+
+    Raises:
+        ValueError: If num_perm is not divisible by bands
+    """
+
+    if num_perm % bands != 0:
+        raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+
+    if not texts:
+        return []
+
+    rows = num_perm // bands
+    permutations = _permutations(num_perm, seed=1)
+    signatures = np.stack([
+        minhash_signature(text, num_perm, shingle_size, permutations=permutations) for text in texts
+    ])
+
+    parent = list(range(len(texts)))
+
+    def find(idx: int) -> int:
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    def union(first: int, other: int) -> None:
+        root_first, root_other = find(first), find(other)
+        if root_first != root_other:
+            # The smaller index is the earlier chunk and becomes the canonical one
+            parent[max(root_first, root_other)] = min(root_first, root_other)
+
+    # Identical signatures (exact copies, e.g. repeated boilerplate) are merged without comparing
+    distinct: Dict[bytes, int] = {}
+    for idx, signature in enumerate(signatures):
+        union(distinct.setdefault(signature.tobytes(), idx), idx)
+    representatives = list(distinct.values())
+
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for idx in representatives:
+            buckets[signatures[idx, band * rows:(band + 1) * rows].tobytes()].append(idx)
+
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            # Each member is compared with the leaders of the groups found so far in this
+            # bucket and joins every one it matches, or becomes a new leader
+            leaders = [members[0]]
+            for idx in members[1:]:
+                root = find(idx)
+                if any(find(leader) == root for leader in leaders):
+                    continue
+                similarity = np.mean(signatures[leaders] == signatures[idx], axis=1)
+                matched = np.flatnonzero(similarity >= threshold)
+                for position in matched:
+                    union(leaders[position], idx)
+                if not len(matched):
+                    leaders.append(idx)
+
+    return [find(idx) for idx in range(len(texts))]
+
+
+def deduplicate_chunks(
+    chunked_data: List[Dict[str, Any]],
+    threshold: float = 0.85,
+    num_perm: int = 128,
+    bands: int = 32
+) -> List[Dict[str, Any]]:
+
+    """
+    Collapse near-duplicate chunks across all titles into one canonical chunk.
+
+    Args:
+        chunked_data: List returned by chunk_data of an embedding module
+        threshold: Minimum estimated Jaccard similarity of two duplicates
+        num_perm: Signature length
+        bands: Number of LSH bands
+
+    Returns:
+        List[Dict]: The same format as chunked_data with duplicates removed. Every item
+        also has "chunk_source_titles", aligned with "chunks", listing the titles of all
+        pages the canonical chunk was found in.
+        format:
+        [
+            {
+                "title": "Title text",
+                "chunks": ["Chunk text", ...],
+                "chunk_source_titles": [["Title text", "Other title", ...], ...]
+            },
+            ...
+        ]
+    """
+
+    positions = []
+    texts = []
+    for item_idx, item in enumerate(chunked_data):
+        for chunk_idx, chunk in enumerate(item.get('chunks', [])):
+            positions.append((item_idx, chunk_idx))
+            texts.append(chunk)
+
+    canonical = find_near_duplicates(texts, threshold, num_perm, bands)
+
+    source_titles = defaultdict(list)
+    for idx, root in enumerate(canonical):
+        title = chunked_data[positions[idx][0]].get('title', '')
+        if title not in source_titles[root]:
+            source_titles[root].append(title)
+
+    # Keep the title and source metadata of every item
+    deduplicated = [
+        {**item, "title": item.get('title', ''), "chunks": [], "chunk_source_titles": []}
+        for item in chunked_data
+    ]
+    for idx, root in enumerate(canonical):
+        if idx != root:
+            continue
+        item_idx, _ = positions[idx]
+        deduplicated[item_idx]["chunks"].append(texts[idx])
+        deduplicated[item_idx]["chunk_source_titles"].append(source_titles[root])
+
+    removed = len(texts) - sum(len(item["chunks"]) for item in deduplicated)
+    print(f"Near-duplicate chunks removed : {removed} / {len(texts)}")
+
+    return deduplicated
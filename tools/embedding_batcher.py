@@ -0,0 +1,110 @@
+"""
+Micro-batching of concurrent embedding requests.
+Steps:
+1. Callers await embed(text); the text and a future are added to the pending batch.
+2. The batch is sent when it reaches max_batch_size, or max_wait seconds after its
+   first text arrived, whichever comes first.
+3. One embedding call is made for the whole batch (identical texts are sent once).
+4. Each caller's future is resolved with its own vector, or with the error of the call;
+   if the batch is cancelled, the callers still waiting are cancelled too.
+"""
+
+import asyncio
+from typing import List, Dict, Tuple, Callable, Awaitable, Optional
+
+
+class EmbeddingBatcher:
+    """
+    Coalesce texts that arrive close together into one embedding request.
+
+        batcher = EmbeddingBatcher(embed_batch, max_batch_size=64, max_wait=0.005)
+        vector = await batcher.embed("怎麼重置AirPods？")
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+        max_batch_size: int = 64,
+        max_wait: float = 0.005
+    ):
+
+        """
+        Args:
+            embed_batch: Coroutine function embedding a list of texts, returning one vector per text
+            max_batch_size: Maximum number of texts sent in one call
+            max_wait: Maximum seconds the first text of a batch waits for others
+        """
+
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight: set = set()
+
+        # Counters for monitoring how well requests are coalesced
+        self.texts_embedded = 0
+        self.calls_made = 0
+
+    async def embed(self, text: str) -> List[float]:
+        """Embed one text as part of the next batch."""
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    async def close(self) -> None:
+        """Send the pending texts now and wait for every batch in flight."""
+
+        self._flush()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        unique_texts: Dict[str, int] = {}
+        for text, _ in batch:
+            unique_texts.setdefault(text, len(unique_texts))
+
+        try:
+            embeddings = await self.embed_batch(list(unique_texts))
+            if len(embeddings) != len(unique_texts):
+                raise ValueError(f"Expected {len(unique_texts)} embeddings, got {len(embeddings)}")
+
+            self.calls_made += 1
+            self.texts_embedded += len(unique_texts)
+            for text, future in batch:
+                # A caller may have been cancelled while the batch was in flight
+                if not future.done():
+                    future.set_result(embeddings[unique_texts[text]])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # If the batch itself was cancelled (or interrupted), no caller is left waiting
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
@@ -0,0 +1,321 @@
+"""
+Resumable batch embedding shared by the embedding modules.
+Steps:
+1. Split the texts into fixed-size batches and key every batch by model name and content.
+2. Reuse batches already recorded in the checkpoint file (JSON Lines, one batch per line).
+3. Embed the remaining batches, retrying transient API errors (rate limits, timeouts,
+   5xx) with exponential backoff; other errors, e.g. a bad API key, fail at once.
+4. Append each finished batch to the checkpoint as soon as it returns, so an interrupted
+   job resumes from the last completed batch instead of starting over.
+5. EmbeddingCache keeps embeddings per text instead of per batch, for jobs that embed
+   overlapping sets of texts (e.g. several chunkings of the same pages).
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import List, Dict, Callable, Optional
+
+
+def _batch_key(model_name: str, batch: List[str]) -> str:
+    """Identify a batch by the model and the exact texts it contains."""
+
+    digest = hashlib.sha256(model_name.encode('utf-8'))
+    for text in batch:
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _load_checkpoint(checkpoint_path: str) -> Dict[str, List[List[float]]]:
+    """Load completed batches from a checkpoint file, ignoring a torn last line."""
+
+    completed = {}
+    if not os.path.exists(checkpoint_path):
+        return completed
+
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The process was killed while writing this line
+                continue
+            completed[record["key"]] = record["embeddings"]
+
+    return completed
+
+
+class BatchCheckpoint:
+    """
+    Completed batches of one embedding job, shared safely by several threads.
+
+    Args:
+        checkpoint_path: JSON Lines file recording completed batches (None keeps nothing)
+        model_name: Embedding model name, part of the batch key
+    """
+
+    def __init__(self, checkpoint_path: Optional[str], model_name: str):
+        self.checkpoint_path = checkpoint_path
+        self.model_name = model_name
+        self.completed = _load_checkpoint(checkpoint_path) if checkpoint_path else {}
+        self._lock = threading.Lock()
+        self._file = None
+
+        if self.completed:
+            print(f"Resuming embedding job, {len(self.completed)} batches found in checkpoint '{checkpoint_path}'")
+
+    def get(self, batch: List[str]) -> Optional[List[List[float]]]:
+        """Return the embeddings of a batch completed earlier, or None."""
+
+        return self.completed.get(_batch_key(self.model_name, batch))
+
+    def add(self, batch: List[str], embeddings: List[List[float]]) -> None:
+        """Record a completed batch, durably before returning."""
+
+        if not self.checkpoint_path:
+            return
+
+        line = json.dumps({"key": _batch_key(self.model_name, batch), "embeddings": embeddings}) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+                self._file = open(self.checkpoint_path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# Provider exceptions worth retrying that carry no HTTP status (openai 0.28 and google.api_core)
+_TRANSIENT_ERROR_NAMES = {
+    "RateLimitError",
+    "Timeout",
+    "APIConnectionError",
+    "ServiceUnavailableError",
+    "TryAgain",
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "InternalServerError",
+}
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Whether an embedding API error may succeed when retried.
+
+    Rate limits (429), request timeouts (408), server errors (5xx) and connection
+    errors are transient; authentication, permission and invalid request errors are not.
+    """
+
+    # openai uses http_status, google.api_core code, aiohttp status
+    for attribute in ("http_status", "code", "status"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int) and 400 <= status < 600:
+            return status in (408, 429) or status >= 500
+
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return type(error).__name__ in _TRANSIENT_ERROR_NAMES
+
+
+def embed_with_retry(
+    embed_batch: Callable[[List[str]], List[List[float]]],
+    batch: List[str],
+    max_retries: int = 5,
+    backoff_base: float = 1.0,
+    backoff_max: float = 60.0
+) -> List[List[float]]:
+
+    """
+    Call embed_batch, retrying transient errors with exponential backoff and jitter.
+
+    Raises:
+        Exception: A non transient error at once, a transient one after max_retries
+        ValueError: If the API returns a different number of embeddings than texts
+    """
+
+    for attempt in range(max_retries + 1):
+        try:
+            embeddings = embed_batch(batch)
+        except Exception as e:
+            if attempt == max_retries or not is_transient_error(e):
+                raise
+            wait = min(backoff_max, backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            print(f"Warning : Embedding batch failed ({e}), retry {attempt + 1}/{max_retries} in {wait:.1f} sec...")
+            time.sleep(wait)
+            continue
+
+        if len(embeddings) != len(batch):
+            raise ValueError(f"Expected {len(batch)} embeddings, got {len(embeddings)}")
+        return embeddings
+
+
+def embed_in_batches(
+    texts: List[str],
+    embed_batch: Callable[[List[str]], List[List[float]]],
+    model_name: str,
+    batch_size: int = 100,
+    checkpoint_path: Optional[str] = None,
+    max_retries: int = 5,
+    backoff_base: float = 1.0,
+    backoff_max: float = 60.0,
+    delay_between_batches: float = 0.0
+) -> List[List[float]]:
+
+    """
+    Embed texts batch by batch with retries and an optional on-disk checkpoint.
+
+    Args:
+        texts: Texts to embed
+        embed_batch: Callable that embeds one batch of texts and returns one vector per text
+        model_name: Embedding model name, part of the checkpoint key
+        batch_size: Number of texts sent per API request
+        checkpoint_path: JSON Lines file recording completed batches (None disables checkpointing)
+        max_retries: Number of retries for a batch failing with a transient error before giving up
+        backoff_base: Initial retry delay in seconds, doubled on every retry
+        backoff_max: Upper bound of a single retry delay in seconds
+        delay_between_batches: Pause between two API requests to respect per-minute limits
+
+    Returns:
+        List[List[float]]: One embedding per input text, in input order
+
+    Raises:
+        Exception: The first non transient API error, or the last transient one of a batch
+            that still fails after max_retries. Completed batches stay in the checkpoint, so
+            calling again resumes the job; remove it with clear_checkpoint only after the
+            embeddings have been saved.
+    """
+
+    checkpoint = BatchCheckpoint(checkpoint_path, model_name)
+
+    all_embeddings = []
+    requested = 0
+    try:
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i:i+batch_size]
+
+            completed = checkpoint.get(batch)
+            if completed is not None:
+                all_embeddings.extend(completed)
+                continue
+
+            # To avoid hitting the per-minute request limit, wait between two requests
+            if requested > 0 and delay_between_batches > 0:
+                print(f"{i} items has been processed, Wait {delay_between_batches} sec...")
+                time.sleep(delay_between_batches)
+
+            embeddings = embed_with_retry(embed_batch, batch, max_retries, backoff_base, backoff_max)
+            requested += 1
+            all_embeddings.extend(embeddings)
+            checkpoint.add(batch, embeddings)
+    finally:
+        checkpoint.close()
+
+    return all_embeddings
+
+
+def clear_checkpoint(checkpoint_path: Optional[str]) -> None:
+    """Remove a checkpoint once its embeddings have been saved elsewhere."""
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+class EmbeddingCache:
+    """
+    Embeddings of single texts, kept across runs so a text is embedded only once per model.
+
+    Unlike BatchCheckpoint, which reuses a batch only if exactly the same texts are sent
+    again, the cache is keyed per text, so re-chunking a page only embeds the chunks
+    that changed.
+
+    Args:
+        cache_path: JSON Lines file with one {"key", "embedding"} per text (None keeps
+            the cache in memory only)
+        model_name: Embedding model name, part of the key
+    """
+
+    def __init__(self, cache_path: Optional[str], model_name: str):
+        self.cache_path = cache_path
+        self.model_name = model_name
+        self.embeddings: Dict[str, List[float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The process was killed while writing this line
+                        continue
+                    self.embeddings[record["key"]] = record["embedding"]
+
+    def key(self, text: str) -> str:
+        return _batch_key(self.model_name, [text])
+
+    def __len__(self) -> int:
+        return len(self.embeddings)
+
+    def embed(
+        self,
+        texts: List[str],
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        batch_size: int = 100,
+        max_retries: int = 5,
+        delay_between_batches: float = 0.0
+    ) -> List[List[float]]:
+
+        """
+        Embed texts, sending only the ones not in the cache to the API.
+
+        Args:
+            texts: Texts to embed (duplicates are sent once)
+            embed_batch: Callable that embeds one batch of texts
+            batch_size: Number of texts sent per API request
+            max_retries: Number of retries for a failing batch before giving up
+            delay_between_batches: Pause between two API requests to respect per-minute limits
+
+        Returns:
+            List[List[float]]: One embedding per input text, in input order
+        """
+
+        keys = [self.key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.embeddings:
+                missing.setdefault(key, text)
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+
+        missing_keys = list(missing)
+        for i in range(0, len(missing_keys), batch_size):
+            if i > 0 and delay_between_batches > 0:
+                time.sleep(delay_between_batches)
+
+            batch_keys = missing_keys[i:i+batch_size]
+            embeddings = embed_with_retry(embed_batch, [missing[key] for key in batch_keys], max_retries)
+            self._save(batch_keys, embeddings)
+
+        return [self.embeddings[key] for key in keys]
+
+    def _save(self, keys: List[str], embeddings: List[List[float]]) -> None:
+        self.embeddings.update(zip(keys, embeddings))
+        if not self.cache_path:
+            return
+
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        with open(self.cache_path, 'a', encoding='utf-8') as f:
+            for key, embedding in zip(keys, embeddings):
+                f.write(json.dumps({"key": key, "embedding": embedding}) + "\n")
@@ -0,0 +1,479 @@
+"""
+Retrieval evaluation harness over a labeled question set.
+Steps:
+1. Load labeled questions (question → expected title / URL) and embed them once.
+2. Run every question through the selected backends: the JSON similarity path
+   (find_most_similar_chunks), the ChromaDB path and the out-of-core blocked search
+   (stream_search over a memory-mapped export of the data file).
+3. Find the rank of the first retrieved chunk that belongs to the expected page.
+4. Report recall@k, MRR and p50 / p95 / p99 search latency per backend, together
+   with the configuration that produced them.
+
+Labeled question file format:
+[
+    {
+        "question": "Question text",
+        "expected_title": "Title of the page that answers it",
+        "expected_url": "URL of that page"          # optional
+    },
+    ...
+]
+"""
+
+import argparse
+import importlib
+import time
+from typing import List, Dict, Any, Optional, Set, Iterable
+
+import numpy as np
+
+from .load_save_data import load_json_data, save_to_json, iter_json_data
+from .blocked_search import export_chunk_matrix, stream_search
+from .corpus import Corpus
+from .similarity_calculation import find_most_similar_chunks
+
+
+def first_relevant_rank(
+    retrieved_sources: List[Set[str]],
+    expected_title: Optional[str],
+    expected_url: Optional[str] = None
+) -> Optional[int]:
+
+    """
+    Return the 1-based rank of the first result that belongs to the expected page.
+
+    Args:
+        retrieved_sources: For each retrieved chunk, the titles / URLs it belongs to
+        expected_title: Title of the page that answers the question
+        expected_url: URL of that page (optional)
+
+    Returns:
+        Optional[int]: The rank, or None if no result is relevant
+    """
+
+    expected = {value for value in (expected_title, expected_url) if value}
+    for rank, sources in enumerate(retrieved_sources, 1):
+        if expected & sources:
+            return rank
+    return None
+
+
+def summarize_run(
+    ranks: List[Optional[int]],
+    latencies: Optional[List[float]],
+    ks: Iterable[int] = (1, 3, 5)
+) -> Dict[str, Any]:
+
+    """
+    Aggregate per-question ranks and latencies.
+
+    Args:
+        ranks: Rank of the first relevant result per question (None if not found)
+        latencies: Search latency per question in seconds (None leaves out the latencies)
+        ks: Cutoffs for recall@k
+
+    Returns:
+        Dict: recall@k values, MRR and latency percentiles in milliseconds
+    """
+
+    count = len(ranks)
+    summary = {"questions": count}
+    for k in ks:
+        summary[f"recall@{k}"] = sum(1 for rank in ranks if rank is not None and rank <= k) / count if count else 0.0
+    summary["mrr"] = sum(1.0 / rank for rank in ranks if rank is not None) / count if count else 0.0
+    if latencies is None:
+        return summary
+
+    latencies_ms = np.array(latencies, dtype=np.float64) * 1000
+    summary["latency_ms"] = {
+        "mean": float(latencies_ms.mean()) if count else 0.0,
+        "p50": float(np.percentile(latencies_ms, 50)) if count else 0.0,
+        "p95": float(np.percentile(latencies_ms, 95)) if count else 0.0,
+        "p99": float(np.percentile(latencies_ms, 99)) if count else 0.0,
+    }
+    return summary
+
+
+def _chunk_sources(data_with_embeddings: Iterable[Dict[str, Any]]) -> Dict[str, Set[str]]:
+    """Map every chunk text to the titles / URLs of the pages it belongs to."""
+
+    sources: Dict[str, Set[str]] = {}
+    for item in data_with_embeddings:
+        item_sources = {value for value in (item.get('title'), item.get('url')) if value}
+        for chunk in item.get('chunks', []):
+            chunk_sources = sources.setdefault(chunk.get('chunk_text', ''), set())
+            chunk_sources.update(item_sources)
+            chunk_sources.update(chunk.get('source_titles', ()))
+    return sources
+
+
+def evaluate_json_backend(
+    labeled_questions: List[Dict[str, Any]],
+    question_embeddings: Dict[str, List[float]],
+    data_with_embeddings: List[Dict[str, Any]],
+    title_top_k: int = 1,
+    chunk_top_percentage: float = 0.5,
+    coarse_candidates: Optional[int] = None,
+    ks: Iterable[int] = (1, 3, 5)
+) -> Dict[str, Any]:
+
+    """
+    Evaluate the JSON similarity path (find_most_similar_chunks).
+
+    Args:
+        labeled_questions: Labeled questions
+        question_embeddings: Mapping of question text to its embedding
+        data_with_embeddings: List of data items with their embeddings
+        title_top_k: Number of top similar titles to consider
+        chunk_top_percentage: Minimum similarity threshold for chunks
+        coarse_candidates: Shortlist size for coarse-to-fine search (if specified)
+        ks: Cutoffs for recall@k
+
+    Returns:
+        Dict: Config, metrics and per-question ranks of the run
+    """
+
+    sources = _chunk_sources(data_with_embeddings)
+    # Built once so the timed search does not include the matrix construction
+    corpus = Corpus.from_records(data_with_embeddings)
+    ranks = []
+    latencies = []
+    per_question = []
+
+    for label in labeled_questions:
+        question = label["question"]
+
+        start = time.perf_counter()
+        results = find_most_similar_chunks(
+            question_embeddings[question],
+            corpus,
+            title_top_k,
+            chunk_top_percentage,
+            coarse_candidates=coarse_candidates,
+        )
+        latencies.append(time.perf_counter() - start)
+
+        rank = first_relevant_rank(
+            [sources.get(result['chunk_text'], set()) for result in results],
+            label.get("expected_title"),
+            label.get("expected_url"),
+        )
+        ranks.append(rank)
+        per_question.append({"question": question, "rank": rank, "retrieved": len(results)})
+
+    return {
+        "backend": "json",
+        "config": {
+            "title_top_k": title_top_k,
+            "chunk_top_percentage": chunk_top_percentage,
+            "coarse_candidates": coarse_candidates,
+        },
+        "metrics": summarize_run(ranks, latencies, ks),
+        "per_question": per_question,
+    }
+
+
+def evaluate_chroma_backend(
+    labeled_questions: List[Dict[str, Any]],
+    question_embeddings: Dict[str, List[float]],
+    db_path: str,
+    collection_name: str,
+    n_results: int = 5,
+    ks: Iterable[int] = (1, 3, 5),
+    embedding_model: Optional[str] = None
+) -> Dict[str, Any]:
+
+    """
+    Evaluate the ChromaDB path with the same question embeddings.
+
+    Args:
+        labeled_questions: Labeled questions
+        question_embeddings: Mapping of question text to its embedding
+        db_path: ChromaDB directory
+        collection_name: Collection to query
+        n_results: Number of chunks retrieved per question
+        ks: Cutoffs for recall@k
+        embedding_model: Model the questions were embedded with, checked against the
+            model stamp of the active index (default is None, not checked)
+
+    Returns:
+        Dict: Config, metrics and per-question ranks of the run
+
+    Raises:
+        ValueError: If the active index was embedded with another model
+    """
+
+    from .index_versions import ActiveIndex
+
+    # The active version of the index, with the model stamp it was embedded with
+    collection = ActiveIndex(db_path, collection_name).current()
+    index_model = (collection.metadata or {}).get("embedding_model")
+    if embedding_model and index_model and index_model != embedding_model:
+        raise ValueError(
+            f"The questions are embedded with '{embedding_model}' but the active index of "
+            f"'{collection_name}' with '{index_model}', their similarities are not comparable"
+        )
+    ranks = []
+    latencies = []
+    per_question = []
+
+    for label in labeled_questions:
+        question = label["question"]
+
+        start = time.perf_counter()
+        results = collection.query(query_embeddings=[question_embeddings[question]], n_results=n_results)
+        latencies.append(time.perf_counter() - start)
+
+        retrieved_sources = []
+        for metadata in (results.get("metadatas") or [[]])[0]:
+            metadata = metadata or {}
+            chunk_sources = {value for value in (metadata.get("title"), metadata.get("url")) if value}
+            if metadata.get("source_titles"):
+                chunk_sources.update(metadata["source_titles"].split("\n"))
+            retrieved_sources.append(chunk_sources)
+
+        rank = first_relevant_rank(retrieved_sources, label.get("expected_title"), label.get("expected_url"))
+        ranks.append(rank)
+        per_question.append({"question": question, "rank": rank, "retrieved": len(retrieved_sources)})
+
+    return {
+        "backend": "chroma",
+        "config": {
+            "collection_name": collection.name,
+            "embedding_model": (collection.metadata or {}).get("embedding_model"),
+            "n_results": n_results,
+        },
+        "metrics": summarize_run(ranks, latencies, ks),
+        "per_question": per_question,
+    }
+
+
+def evaluate_blocked_backend(
+    labeled_questions: List[Dict[str, Any]],
+    question_embeddings: Dict[str, List[float]],
+    data_file: str,
+    matrix_prefix: str,
+    n_results: int = 5,
+    ks: Iterable[int] = (1, 3, 5)
+) -> Dict[str, Any]:
+
+    """
+    Evaluate the out-of-core path: export the data file once, then stream_search it.
+
+    The data file is streamed both for the export and for the chunk sources, so it is
+    never loaded as a whole.
+
+    Args:
+        labeled_questions: Labeled questions
+        question_embeddings: Mapping of question text to its embedding
+        data_file: Embedded data file
+        matrix_prefix: Path prefix of the exported matrix files
+        n_results: Number of chunks retrieved per question
+        ks: Cutoffs for recall@k
+
+    Returns:
+        Dict: Config, metrics and per-question ranks of the run
+    """
+
+    export_chunk_matrix(data_file, matrix_prefix)
+    sources = _chunk_sources(iter_json_data(data_file))
+    ranks = []
+    latencies = []
+    per_question = []
+
+    for label in labeled_questions:
+        question = label["question"]
+
+        start = time.perf_counter()
+        results = stream_search(question_embeddings[question], matrix_prefix, top_k=n_results)
+        latencies.append(time.perf_counter() - start)
+
+        rank = first_relevant_rank(
+            [sources.get(result['chunk_text'], {result['title']}) for result in results],
+            label.get("expected_title"),
+            label.get("expected_url"),
+        )
+        ranks.append(rank)
+        per_question.append({"question": question, "rank": rank, "retrieved": len(results)})
+
+    return {
+        "backend": "blocked",
+        "config": {
+            "matrix_prefix": matrix_prefix,
+            "n_results": n_results,
+        },
+        "metrics": summarize_run(ranks, latencies, ks),
+        "per_question": per_question,
+    }
+
+
+def embed_labeled_questions(
+    labeled_questions: List[Dict[str, Any]],
+    llm: str,
+    question_embedding_file: Optional[str] = None
+) -> Dict[str, List[float]]:
+
+    """
+    Embed the labeled questions, reusing a question embedding file when given.
+
+    Args:
+        labeled_questions: Labeled questions
+        llm: Embedding provider, "openai" or "gemini"
+        question_embedding_file: Optional file in process_and_embed_questions format
+
+    Returns:
+        Dict: Mapping of question text to its embedding
+    """
+
+    embeddings = {}
+    if question_embedding_file:
+        for item in load_json_data(question_embedding_file):
+            embeddings[item["question"]] = item["question_embedding"]
+
+    missing = [label["question"] for label in labeled_questions if label["question"] not in embeddings]
+    if missing:
+        embedding_module = importlib.import_module(f"tools.generate_embedding_{llm}")
+        for item in embedding_module.process_and_embed_questions(missing):
+            embeddings[item["question"]] = item["question_embedding"]
+
+    still_missing = [question for question in missing if question not in embeddings]
+    if still_missing:
+        raise ValueError(f"Can't embed {len(still_missing)} labeled questions")
+
+    return embeddings
+
+
+def print_evaluation_report(report: List[Dict[str, Any]]) -> None:
+    """Print one line of metrics per backend run."""
+
+    print(f"\n{'='*80}")
+    for run in report:
+        metrics = run["metrics"]
+        recalls = "  ".join(f"{key}={value:.3f}" for key, value in metrics.items() if key.startswith("recall@"))
+        latency = metrics["latency_ms"]
+        print(f"[{run['backend']}] {run['config']}")
+        print(f"  {recalls}  MRR={metrics['mrr']:.3f}")
+        print(f"  latency p50={latency['p50']:.2f}ms  p95={latency['p95']:.2f}ms  p99={latency['p99']:.2f}ms")
+    print(f"{'='*80}\n")
+
+
+def run_evaluation(
+    labels_file: str,
+    llm: str = "openai",
+    data_file: Optional[str] = None,
+    question_embedding_file: Optional[str] = None,
+    backends: Iterable[str] = ("json", "chroma"),
+    title_top_k: int = 1,
+    chunk_top_percentage: float = 0.5,
+    coarse_candidates: Optional[int] = None,
+    n_results: int = 5,
+    db_path: str = "./chroma_db",
+    matrix_prefix: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    ks: Iterable[int] = (1, 3, 5)
+) -> List[Dict[str, Any]]:
+
+    """
+    Evaluate the selected backends on a labeled question file.
+
+    Args:
+        labels_file: Labeled question file
+        llm: Embedding provider, "openai" or "gemini"
+        data_file: Embedded data file (default is output/json/text_embedding_<llm>.json)
+        question_embedding_file: Optional file with precomputed question embeddings
+        backends: Backends to evaluate, any of "json", "chroma" and "blocked"
+        title_top_k: Number of top similar titles to consider (json backend)
+        chunk_top_percentage: Minimum similarity threshold for chunks (json backend)
+        coarse_candidates: Shortlist size for coarse-to-fine search (json backend)
+        n_results: Number of chunks retrieved per question (chroma and blocked backends)
+        db_path: ChromaDB directory (chroma backend)
+        matrix_prefix: Path prefix of the exported matrix (blocked backend, default is
+            output/blocked/text_embedding_<llm>)
+        chunk_size: Chunk size the data was built with, recorded in the config (None if unknown)
+        chunk_overlap: Chunk overlap the data was built with, recorded in the config (None if unknown)
+        ks: Cutoffs for recall@k
+
+    Returns:
+        List[Dict]: One entry per backend with its config, metrics and per-question ranks
+    """
+
+    labeled_questions = load_json_data(labels_file)
+    if not labeled_questions:
+        raise ValueError(f"Can't load labeled questions from '{labels_file}'")
+
+    data_file = data_file or f"output/json/text_embedding_{llm}.json"
+    question_embeddings = embed_labeled_questions(labeled_questions, llm, question_embedding_file)
+
+    shared_config = {
+        "provider": llm,
+        "data_file": data_file,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+    }
+
+    report = []
+    for backend in backends:
+        if backend == "json":
+            data_with_embeddings = load_json_data(data_file)
+            if not data_with_embeddings:
+                raise ValueError(f"Can't load embedded data from '{data_file}'")
+            run = evaluate_json_backend(
+                labeled_questions, question_embeddings, data_with_embeddings,
+                title_top_k, chunk_top_percentage, coarse_candidates, ks
+            )
+        elif backend == "chroma":
+            run = evaluate_chroma_backend(
+                labeled_questions, question_embeddings, db_path,
+                f"text_embedding_{llm}", n_results, ks,
+                embedding_model=importlib.import_module(f"tools.generate_embedding_{llm}").Model_Name,
+            )
+        elif backend == "blocked":
+            run = evaluate_blocked_backend(
+                labeled_questions, question_embeddings, data_file,
+                matrix_prefix or f"output/blocked/text_embedding_{llm}", n_results, ks
+            )
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+
+        run["config"] = {**shared_config, **run["config"]}
+        report.append(run)
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency on a labeled question set.")
+    parser.add_argument("--labels", default="output/json/labeled_questions.json", help="Labeled question file")
+    parser.add_argument("--llm", default="openai", choices=["openai", "gemini"], help="Embedding provider")
+    parser.add_argument("--data-file", help="Embedded data file")
+    parser.add_argument("--question-embeddings", help="Precomputed question embedding file")
+    parser.add_argument("--backends", nargs="+", default=["json", "chroma"], choices=["json", "chroma", "blocked"])
+    parser.add_argument("--title-top-k", type=int, default=1)
+    parser.add_argument("--threshold", type=float, default=0.5, help="chunk_top_percentage of the json backend")
+    parser.add_argument("--coarse-candidates", type=int)
+    parser.add_argument("--n-results", type=int, default=5, help="Chunks retrieved per question by chroma and blocked")
+    parser.add_argument("--matrix-prefix", help="Path prefix of the exported matrix of the blocked backend")
+    # Not known from the data file (the gemini module splits on lines, not with split_text),
+    # so only the values given here are recorded, null otherwise
+    parser.add_argument("--chunk-size", type=int, default=None, help="Chunk size the data was built with, if known")
+    parser.add_argument("--chunk-overlap", type=int, default=None, help="Chunk overlap the data was built with, if known")
+    parser.add_argument("--output", default="output/json/retrieval_evaluation.json", help="Report file")
+    args = parser.parse_args()
+
+    report = run_evaluation(
+        labels_file=args.labels,
+        llm=args.llm,
+        data_file=args.data_file,
+        question_embedding_file=args.question_embeddings,
+        backends=args.backends,
+        title_top_k=args.title_top_k,
+        chunk_top_percentage=args.threshold,
+        coarse_candidates=args.coarse_candidates,
+        n_results=args.n_results,
+        matrix_prefix=args.matrix_prefix,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+    )
+    print_evaluation_report(report)
+    save_to_json(report, args.output)
@@ -1,22 +1,86 @@
 import json
 import google.generativeai as genai
 import os
-import time
 import dotenv
+from tools.corpus import Corpus
+from tools.embedding_jobs import embed_in_batches, clear_checkpoint
+from tools.deduplicate import deduplicate_chunks
+from tools.source_metadata import page_metadata
 
 Model_Name = 'models/text-embedding-004'
+Checkpoint_Path = 'output/checkpoints/text_embedding_gemini.jsonl'
+# Gemini api only support max 100 texts per request, and the per-minute request limit
+# needs a short delay between batches
+Batch_Size = 100
+Delay_Between_Batches = 1
 
 dotenv.load_dotenv()
 GOOGLE_API_KEY = os.getenv('GEMINI_API_KEY')
 genai.configure(api_key=GOOGLE_API_KEY)
 
-def process_and_embed_data(raw_data: list, model_name: str = Model_Name) -> list:
+def chunk_data(raw_data: list) -> list:
+    """
+    Split the content of each fetched page into chunks。
+
+    Args:
+        raw_data: List that fetched from JSON file。
+
+    Returns:
+        A List that contain title, source metadata and chunk texts。
+        format:
+        [
+            {
+                "title": "Title text",
+                "url": "Page url",
+                "product": "AirPods Pro",
+                "language": "zh-tw",
+                "chunks": ["Chunk text", ...]
+            },
+            ...
+        ]
+    """
+    return [chunk_page(item) for item in raw_data]
+
+def chunk_page(item: dict) -> dict:
+    """
+    Split the content of one fetched page into chunks, see chunk_data。
+    """
+    content = item.get('content', '')
+
+    """
+    Should find a better way to split content into chunks.
+    """
+    chunks = [chunk.strip() for chunk in content.split('\n') if chunk.strip()]
+
+    return {
+        "title": item.get('title', ''),
+        **page_metadata(item),
+        "chunks": chunks
+    }
+
+def embed_batch(texts: list, model_name: str = Model_Name) -> list:
+    """
+    Embed one batch of texts (at most Batch_Size) in a single API request。
+    """
+    return genai.embed_content(model=model_name,
+                               content=texts,
+                               task_type="RETRIEVAL_DOCUMENT")['embedding']
+
+def process_and_embed_data(raw_data: list, model_name: str = Model_Name, coarse_dim: int = None,
+                           dedup_threshold: float = None) -> list:
     """
     Process raw data and batch generate titles and chunks in each title。
 
     Args:
         raw_data: List that fetched from JSON file。
         model_name: Which model we use。
+        coarse_dim: If given, also store a reduced embedding with this many dimensions
+                    (e.g. 256) next to the full one for coarse-to-fine search。
+        dedup_threshold: If given, collapse chunks whose estimated Jaccard similarity is at
+                         least this value into one canonical chunk before embedding。
+
+    The checkpoint is removed once every batch is embedded; to keep it until the data is
+    saved, call embed_chunked_data and clear_checkpoint instead (as the pipeline does)。
 
     Returns:
         A List that contain title, chunks, embeddings。
@@ -24,11 +88,15 @@ def process_and_embed_data(raw_data: list, model_name: str = Model_Name) -> list
         [
             {
                 "title": "Title text",
+                "url": "Page url",  # with "product" and "language", see source_metadata
                 "title_embedding": [...],
+                "title_embedding_coarse": [...],  # only when coarse_dim is given
                 "chunks": [
                     {
                         "chunk_text": "Chunk text",
-                        "chunk_embedding": [...]
+                        "chunk_embedding": [...],
+                        "chunk_embedding_coarse": [...],  # only when coarse_dim is given
+                        "source_titles": [...]  # only when dedup_threshold is given
                     },
                     ...
                 ]
@@ -39,72 +107,75 @@ def process_and_embed_data(raw_data: list, model_name: str = Model_Name) -> list
     if not raw_data:
         return []
 
-    texts_to_embed = []
-    processed_data = []
-
     print("Getting data and preparing for embedding...")
-    
+    chunked_data = chunk_data(raw_data)
+    if dedup_threshold is not None:
+        chunked_data = deduplicate_chunks(chunked_data, threshold=dedup_threshold)
+
+    processed_data = embed_chunked_data(chunked_data, model_name, coarse_dim)
+    if processed_data:
+        clear_checkpoint(Checkpoint_Path)
+    return processed_data
+
+def embed_chunked_data(chunked_data: list, model_name: str = Model_Name, coarse_dim: int = None,
+                       checkpoint_path: str = Checkpoint_Path) -> list:
+    """
+    Batch generate embeddings for titles and chunks that are already split by chunk_data。
 
-    for item in raw_data:
+    Args:
+        chunked_data: List returned by chunk_data。
+        model_name: Which model we use。
+        coarse_dim: If given, also store a reduced embedding with this many dimensions。
+        checkpoint_path: JSON Lines file that records completed batches so an interrupted
+                         job can resume (None disables checkpointing)。The caller removes it
+                         with clear_checkpoint once the returned data is saved。
+
+    Returns:
+        A List in the same format as process_and_embed_data。
+    """
+    if not chunked_data:
+        return []
+
+    texts_to_embed = []
+
+    for item in chunked_data:
         title = item.get('title', '')
-        content = item.get('content', '')
+        chunks = item.get('chunks', [])
 
         # Add title to texts_to_embed if it exists
         if title:    
             texts_to_embed.append(title)
         
-        """
-        Should find a better way to split content into chunks.
-        """
-        chunks = [chunk.strip() for chunk in content.split('\n') if chunk.strip()]
-        
         # Add chunks to texts_to_embed
         texts_to_embed.extend(chunks)
 
-        # Prepare processed_data structure
-        processed_data.append({
-            "title": title,
-            "title_embedding": [],
-            "chunks": [{"chunk_text": chunk, "chunk_embedding": []} for chunk in chunks]
-        })
-
     print(f"Chunks waiting for batch embedding：{len(texts_to_embed)}")
 
     print("Batch Embedding...")
     try:
-        
         # Gemini api only support max 100 texts per request so we set batch_size = 100.
-        batch_size = 100
-        all_embeddings = []
-        for i in range(0, len(texts_to_embed), batch_size):
-            batch = texts_to_embed[i:i+batch_size]
-            
-            # To avoid hitting the per-minute request limit, we can embed in batches with a short delay between batches.
-            if i > 0:
-                print(f"{i} items has been processed, Wait 1 sec...")
-                time.sleep(1)
-            
-            result = genai.embed_content(model=model_name,
-                                         content=batch,
-                                         task_type="RETRIEVAL_DOCUMENT")
-            all_embeddings.extend(result['embedding'])
+        # To avoid hitting the per-minute request limit, we embed in batches with a short delay between batches.
+        # Completed batches are checkpointed, so a failed job resumes where it stopped.
+        all_embeddings = embed_in_batches(
+            texts_to_embed,
+            lambda batch: embed_batch(batch, model_name),
+            model_name=model_name,
+            batch_size=Batch_Size,
+            checkpoint_path=checkpoint_path,
+            delay_between_batches=Delay_Between_Batches
+        )
             
     except Exception as e:
         print(f"Error occurs when calling API : {e}")
+        print(f"Completed batches are kept in '{checkpoint_path}', run again to resume.")
         return []
 
-    print("Mapping data to processed_data that initialized earlier...")
-    embedding_idx = 0
-    for doc in processed_data:
-        # Corresponding title's embedding
-        doc['title_embedding'] = all_embeddings[embedding_idx]
-        embedding_idx += 1
-        
-        # Corresponding chunks' embeddings
-        for chunk in doc['chunks']:
-            chunk['chunk_embedding'] = all_embeddings[embedding_idx]
-            embedding_idx += 1
-            
+    # The Corpus maps the embeddings back to their titles and chunks in the same order
+    # they were sent, and derives the coarse embeddings when coarse_dim is given
+    print("Mapping embeddings to titles and chunks...")
+    corpus = Corpus.from_embeddings(chunked_data, all_embeddings, coarse_dim)
+    processed_data = corpus.to_records()
+
     print("Data processing and embedding completed.")
     return processed_data
 
@@ -0,0 +1,484 @@
+"""
+Versioned ChromaDB indexes and online re-embedding when the embedding model changes.
+Steps:
+1. Every index version is its own collection ("<alias>_v<N>"), stamped with the embedding
+   provider, model and version in the collection metadata and in the metadata of every vector.
+2. A registry file maps each alias (e.g. "text_embedding_openai") to its active version and is
+   rewritten atomically (temporary file + os.replace), so readers see the old or the new
+   mapping, never a partial one.
+3. migrate_index re-embeds the documents of the active version with the new provider / model
+   into a new version, page by page and under a request rate limit. Documents already in the
+   new version are skipped, so an interrupted migration resumes where it stopped.
+4. Only a complete version is activated. ActiveIndex resolves the active version once per
+   query, so queries use the old version (and its query embedding model) until the switch
+   and the new one from the next query on.
+5. The previous version is kept for queries still in flight; older versions are dropped.
+
+Aliases without a registry entry resolve to the collection with the alias name, as before.
+The registry expects one writer per alias at a time (the pipeline or a migration job).
+
+Run with:
+    python -m tools.index_versions status
+    python -m tools.index_versions migrate --alias text_embedding_openai --provider openai \\
+        --model text-embedding-3-large --rpm 300
+"""
+
+import argparse
+import importlib
+import json
+import os
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+from .embedding_jobs import embed_with_retry
+
+
+REGISTRY_PATH = "output/index_registry.json"
+
+
+def embedding_stamp(provider: str, model_name: str, version: int) -> Dict[str, Any]:
+    """Metadata identifying the embedding space of an index version."""
+
+    return {"embedding_provider": provider, "embedding_model": model_name, "embedding_version": version}
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class IndexRegistry:
+    """
+    Index versions per alias and the active one, stored as JSON.
+
+    Format:
+    {
+        "<alias>": {
+            "active": "<alias>_v2",
+            "next_version": 3,
+            "versions": {
+                "<alias>_v2": {"version": 2, "provider": "openai", "model": "...",
+                               "status": "complete", "count": 1234, ...},
+                ...
+            }
+        }
+    }
+    """
+
+    def __init__(self, path: str = REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save(self, state: Dict[str, Any]) -> None:
+        # Write a temporary file and rename it, so a reader never sees a partial registry
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def active(self, alias: str) -> Optional[Dict[str, Any]]:
+        """The active version of an alias ({"name", "version", "provider", "model", ...}), or None."""
+
+        entry = self.load().get(alias)
+        if not entry or not entry.get("active"):
+            return None
+        return {"name": entry["active"], **entry["versions"][entry["active"]]}
+
+    def versions(self, alias: str) -> Dict[str, Dict[str, Any]]:
+        return self.load().get(alias, {}).get("versions", {})
+
+    def create_version(self, alias: str, provider: str, model_name: str, **fields: Any) -> Dict[str, Any]:
+        """Register a new version in the "building" state and return it with its collection name."""
+
+        with self._lock:
+            state = self.load()
+            entry = state.setdefault(alias, {"active": None, "next_version": 1, "versions": {}})
+            version = entry["next_version"]
+            name = f"{alias}_v{version}"
+            entry["next_version"] = version + 1
+            entry["versions"][name] = {
+                "version": version,
+                "provider": provider,
+                "model": model_name,
+                "status": "building",
+                "created_at": _now(),
+                **fields,
+            }
+            self._save(state)
+        return {"name": name, **entry["versions"][name]}
+
+    def find_building(self, alias: str, provider: str, model_name: str, source: str) -> Optional[Dict[str, Any]]:
+        """
+        An unfinished migration of the same source version to the same provider and model, to resume.
+
+        Only versions created by migrate_index (they record their source) are resumed: their
+        documents are copies of the source ones, so the ids already present can be skipped.
+        """
+
+        for name, record in self.versions(alias).items():
+            if record["status"] == "building" and record.get("source") == source \
+                    and record["provider"] == provider and record["model"] == model_name:
+                return {"name": name, **record}
+        return None
+
+    def update_version(self, alias: str, name: str, **fields: Any) -> None:
+        with self._lock:
+            state = self.load()
+            state[alias]["versions"][name].update(fields)
+            self._save(state)
+
+    def activate(self, alias: str, name: str) -> Optional[str]:
+        """
+        Make a complete version the active one.
+
+        Returns:
+            Optional[str]: The previously active version
+        """
+
+        with self._lock:
+            state = self.load()
+            entry = state[alias]
+            if entry["versions"][name]["status"] != "complete":
+                raise ValueError(f"Version '{name}' is not complete")
+            previous = entry.get("active")
+            entry["active"] = name
+            entry["versions"][name]["activated_at"] = _now()
+            self._save(state)
+        return previous
+
+    def adopt(self, alias: str, name: str, **record: Any) -> None:
+        """Register an existing complete collection as the active version of an alias."""
+
+        with self._lock:
+            state = self.load()
+            entry = state.setdefault(alias, {"active": None, "next_version": 1, "versions": {}})
+            entry["versions"][name] = {"status": "complete", "created_at": _now(), **record}
+            entry["active"] = name
+            self._save(state)
+
+    def remove_version(self, alias: str, name: str) -> None:
+        with self._lock:
+            state = self.load()
+            if state.get(alias, {}).get("active") == name:
+                raise ValueError(f"Can't remove the active version '{name}'")
+            state.get(alias, {}).get("versions", {}).pop(name, None)
+            self._save(state)
+
+
+class ActiveIndex:
+    """
+    The active version of an alias, usable wherever a Chroma collection is queried.
+
+    current() re-reads the registry only when the file changed, so resolving it per query
+    is cheap; callers that embed the query themselves should call current() once and use
+    that collection (and its embedding stamp) for the whole query.
+
+    Args:
+        db_path: ChromaDB directory
+        alias: Index alias, e.g. "text_embedding_openai"
+        registry_path: Registry file
+    """
+
+    def __init__(self, db_path: str, alias: str, registry_path: str = REGISTRY_PATH):
+        self.db_path = db_path
+        self.alias = alias
+        self.registry = IndexRegistry(registry_path)
+        self._lock = threading.Lock()
+        self._registry_mtime: Optional[float] = None
+        self._name = alias
+        self._collections: Dict[str, Any] = {}
+
+    def current(self) -> Any:
+        """Collection of the active version."""
+
+        from .ChromaDB import initialize_chroma_db
+
+        try:
+            mtime = os.stat(self.registry.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        with self._lock:
+            if mtime != self._registry_mtime:
+                active = self.registry.active(self.alias) if mtime is not None else None
+                self._name = active["name"] if active else self.alias
+                self._registry_mtime = mtime
+            name = self._name
+            if name not in self._collections:
+                self._collections[name] = initialize_chroma_db(self.db_path, name)
+            return self._collections[name]
+
+    @property
+    def name(self) -> str:
+        return self.current().name
+
+    @property
+    def metadata(self) -> Optional[Dict[str, Any]]:
+        return self.current().metadata
+
+    def query(self, **query_options: Any) -> Dict[str, Any]:
+        return self.current().query(**query_options)
+
+    def count(self) -> int:
+        return self.current().count()
+
+
+def _register_legacy(registry: IndexRegistry, db_path: str, alias: str) -> None:
+    """Adopt a collection named like the alias as version 0, so it can be replaced and dropped."""
+
+    from .ChromaDB import initialize_chroma_db
+
+    if registry.active(alias) is not None:
+        return
+    collection = initialize_chroma_db(db_path, alias)
+    if collection.count() == 0:
+        return
+
+    stamp = collection.metadata or {}
+    registry.adopt(
+        alias,
+        alias,
+        version=0,
+        provider=stamp.get("embedding_provider", "openai"),
+        model=stamp.get("embedding_model", "unknown"),
+        count=collection.count(),
+    )
+
+
+def drop_old_versions(db_path: str, alias: str, registry: IndexRegistry, keep_versions: int = 2) -> List[str]:
+    """
+    Delete all but the active version and the newest keep_versions - 1 complete ones before it.
+
+    Returns:
+        List[str]: Names of the dropped versions
+    """
+
+    from .ChromaDB import reset_chroma_collection
+
+    active = registry.active(alias)
+    if active is None:
+        return []
+
+    complete = sorted(
+        (record["version"], name) for name, record in registry.versions(alias).items()
+        if record["status"] == "complete" and record["version"] < active["version"]
+    )
+    dropped = [name for _, name in complete[:max(0, len(complete) - (keep_versions - 1))]]
+    for name in dropped:
+        reset_chroma_collection(db_path, name)
+        registry.remove_version(alias, name)
+    return dropped
+
+
+def build_index_version(
+    db_path: str,
+    alias: str,
+    data_file: str,
+    provider: str,
+    model_name: str,
+    registry_path: str = REGISTRY_PATH,
+    keep_versions: int = 2
+) -> Dict[str, Any]:
+
+    """
+    Insert an embedded data file as a new version of an alias and activate it.
+
+    Args:
+        db_path: ChromaDB directory
+        alias: Index alias
+        data_file: File written by process_and_embed_data
+        provider: Embedding provider of the file, "openai" or "gemini"
+        model_name: Embedding model of the file
+        registry_path: Registry file
+        keep_versions: Number of versions kept, the active one included
+
+    Returns:
+        Dict: The registry record of the new version
+    """
+
+    from .ChromaDB import initialize_chroma_db, reset_chroma_collection, prepare_data_for_insertion, insert_data_into_chromadb
+    from .pipeline import fingerprint_file
+
+    registry = IndexRegistry(registry_path)
+    _register_legacy(registry, db_path, alias)
+
+    ids, documents, embeddings, metadatas = prepare_data_for_insertion(data_file)
+    record = registry.create_version(alias, provider, model_name, source_hash=fingerprint_file(data_file))
+    stamp = embedding_stamp(provider, model_name, record["version"])
+
+    try:
+        reset_chroma_collection(db_path, record["name"])
+        collection = initialize_chroma_db(db_path, record["name"], metadata=stamp)
+        insert_data_into_chromadb(collection, ids, documents, embeddings, [{**metadata, **stamp} for metadata in metadatas])
+    except BaseException:
+        # Don't leave a half-filled collection behind a "building" record
+        registry.update_version(alias, record["name"], status="failed", failed_at=_now())
+        reset_chroma_collection(db_path, record["name"])
+        raise
+
+    registry.update_version(alias, record["name"], status="complete", count=len(ids), completed_at=_now())
+    registry.activate(alias, record["name"])
+    drop_old_versions(db_path, alias, registry, keep_versions)
+    return registry.active(alias)
+
+
+def migrate_index(
+    db_path: str,
+    alias: str,
+    provider: str,
+    model_name: Optional[str] = None,
+    registry_path: str = REGISTRY_PATH,
+    batch_size: Optional[int] = None,
+    requests_per_minute: Optional[float] = None,
+    page_size: int = 1000,
+    keep_versions: int = 2,
+    max_retries: int = 5
+) -> Dict[str, Any]:
+
+    """
+    Re-embed the active version of an alias with another model into a new version.
+
+    Queries keep using the active version while this runs; the new version is activated
+    only after it holds every document.
+
+    Args:
+        db_path: ChromaDB directory
+        alias: Index alias
+        provider: Embedding provider of the new version, "openai" or "gemini"
+        model_name: Embedding model of the new version (default is the provider's Model_Name)
+        registry_path: Registry file
+        batch_size: Texts per embedding request (default is the provider's Batch_Size)
+        requests_per_minute: Rate limit of the embedding requests (default is the provider's
+            Delay_Between_Batches between two requests)
+        page_size: Documents read from the old version at a time
+        keep_versions: Number of versions kept, the active one included
+        max_retries: Number of retries for a failing batch before giving up
+
+    Returns:
+        Dict: The registry record of the new active version
+
+    Raises:
+        RuntimeError: If the old version changed during the migration (run again to resume)
+    """
+
+    from .ChromaDB import initialize_chroma_db
+
+    embedding_module = importlib.import_module(f"tools.generate_embedding_{provider}")
+    model_name = model_name or embedding_module.Model_Name
+    batch_size = batch_size or embedding_module.Batch_Size
+    interval = 60.0 / requests_per_minute if requests_per_minute else embedding_module.Delay_Between_Batches
+
+    registry = IndexRegistry(registry_path)
+    _register_legacy(registry, db_path, alias)
+    active = registry.active(alias)
+    if active is None:
+        raise ValueError(f"Nothing to migrate, '{alias}' has no active version")
+    if active["provider"] == provider and active["model"] == model_name:
+        print(f"'{active['name']}' already uses {provider} / {model_name}")
+        return active
+
+    source = initialize_chroma_db(db_path, active["name"])
+    record = registry.find_building(alias, provider, model_name, source=active["name"]) \
+        or registry.create_version(alias, provider, model_name, source=active["name"])
+    stamp = embedding_stamp(provider, model_name, record["version"])
+    target = initialize_chroma_db(db_path, record["name"], metadata=stamp)
+
+    total = source.count()
+    print(f"Migrating {total} documents of '{active['name']}' to '{record['name']}' ({provider} / {model_name})")
+
+    started = time.perf_counter()
+    last_request: Optional[float] = None
+    embedded = 0
+    for offset in range(0, total, page_size):
+        page = source.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+        existing = set(target.get(ids=page["ids"], include=[])["ids"])
+        todo = [i for i, document_id in enumerate(page["ids"]) if document_id not in existing]
+
+        for start in range(0, len(todo), batch_size):
+            rows = todo[start:start + batch_size]
+
+            # Space the requests so the migration stays under the rate limit and leaves
+            # the rest of the quota to the query traffic
+            if last_request is not None and interval > 0:
+                time.sleep(max(0.0, last_request + interval - time.monotonic()))
+            last_request = time.monotonic()
+
+            embeddings = embed_with_retry(
+                lambda texts: embedding_module.embed_batch(texts, model_name),
+                [page["documents"][i] for i in rows],
+                max_retries,
+            )
+            target.add(
+                ids=[page["ids"][i] for i in rows],
+                documents=[page["documents"][i] for i in rows],
+                embeddings=embeddings,
+                metadatas=[{**(page["metadatas"][i] or {}), **stamp} for i in rows],
+            )
+            embedded += len(rows)
+
+        print(f"  {min(offset + page_size, total)} / {total} documents ({embedded} embedded in this run)")
+
+    if target.count() != source.count():
+        raise RuntimeError(
+            f"'{active['name']}' changed during the migration ({source.count()} vs {target.count()} documents), "
+            f"run again to resume"
+        )
+
+    registry.update_version(alias, record["name"], status="complete", count=target.count(), completed_at=_now())
+    registry.activate(alias, record["name"])
+    dropped = drop_old_versions(db_path, alias, registry, keep_versions)
+    print(
+        f"Activated '{record['name']}' after {time.perf_counter() - started:.1f} sec"
+        + (f", dropped {', '.join(dropped)}" if dropped else "")
+    )
+    return registry.active(alias)
+
+
+def print_registry(registry: IndexRegistry) -> None:
+    for alias, entry in registry.load().items():
+        print(f"{alias}:")
+        for name, record in sorted(entry["versions"].items(), key=lambda item: item[1]["version"]):
+            marker = "*" if name == entry.get("active") else " "
+            print(f"  {marker} {name:<40} {record['provider']:<8} {record['model']:<32} "
+                  f"{record['status']:<9} {record.get('count', '-')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage index versions and migrate them to another embedding model.")
+    parser.add_argument("--db-path", default="./chroma_db")
+    parser.add_argument("--registry", default=REGISTRY_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="Show the versions of every alias")
+
+    migrate_parser = subparsers.add_parser("migrate", help="Re-embed the active version with another model")
+    migrate_parser.add_argument("--alias", default="text_embedding_openai")
+    migrate_parser.add_argument("--provider", default="openai", choices=["openai", "gemini"])
+    migrate_parser.add_argument("--model", default=None, help="Default is the provider's Model_Name")
+    migrate_parser.add_argument("--batch-size", type=int, default=None)
+    migrate_parser.add_argument("--rpm", type=float, default=None, help="Embedding requests per minute")
+    migrate_parser.add_argument("--keep-versions", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print_registry(IndexRegistry(args.registry))
+    else:
+        migrate_index(
+            args.db_path,
+            args.alias,
+            args.provider,
+            model_name=args.model,
+            registry_path=args.registry,
+            batch_size=args.batch_size,
+            requests_per_minute=args.rpm,
+            keep_versions=args.keep_versions,
+        )
@@ -0,0 +1,150 @@
+"""
+Language partitions of a corpus with query routing by detected language.
+Steps:
+1. Every chunk carries the language detected at ingestion (see source_metadata.chunk_language);
+   chunks of older files without one are detected when the partitions are built.
+2. Split the corpus into one partition per language; a partition is the chunk rows of its
+   language (and the titles owning them), so a query scores only those rows of the shared
+   matrices. No matrix is copied, which keeps an attached shared corpus zero-copy.
+3. Detect the language of the query with langid, restricted to the partition languages.
+4. Search the partition of that language when the detection is confident, otherwise search
+   the whole corpus (cross-language fallback).
+5. ChromaDB keeps all chunks in one collection; there the same routing becomes a
+   "chunk_language" metadata filter (see language_where), and the query is repeated
+   without it when the collection has no chunk of that language.
+"""
+
+import threading
+from typing import List, Dict, Any, Optional, Iterable, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .corpus import Corpus
+from .source_metadata import LANGUAGES, detect_language
+
+
+def route_language(
+    query_text: str,
+    languages: Iterable[str] = LANGUAGES,
+    min_confidence: float = 0.9
+) -> Optional[str]:
+
+    """
+    Language to search a query in, or None to search across languages.
+
+    Args:
+        query_text: Question text
+        languages: Languages that have a partition
+        min_confidence: Minimum detection probability to route to a single language
+
+    Returns:
+        Optional[str]: langid code, None when the detection is not confident
+    """
+
+    languages = list(languages)
+    if not languages or not (query_text or "").strip():
+        return None
+    if len(languages) == 1:
+        return languages[0]
+
+    language, confidence = detect_language(query_text, languages)
+    return language if confidence >= min_confidence else None
+
+
+def language_where(
+    query_text: str,
+    where: Optional[Dict[str, Any]] = None,
+    languages: Iterable[str] = LANGUAGES,
+    min_confidence: float = 0.9
+) -> Optional[Dict[str, Any]]:
+
+    """
+    Add the routed language of a query to a ChromaDB where filter.
+
+    The filter is built from the query alone, so a collection without chunks of that
+    language (or without chunk_language metadata) returns nothing; callers query again
+    with where when the filtered result is empty.
+
+    Returns:
+        Optional[Dict]: where restricted to the chunks of the query language, or where
+            unchanged (the same object) when the query is not routed
+    """
+
+    language = route_language(query_text, languages, min_confidence)
+    if language is None:
+        return where
+    language_filter = {"chunk_language": language}
+    return {"$and": [where, language_filter]} if where else language_filter
+
+
+class LanguagePartitions:
+    """
+    Chunk rows per language of one corpus, the whole corpus being the fallback.
+
+    Args:
+        corpus: Corpus with chunk languages
+        min_confidence: Minimum detection probability to route a query to one partition
+    """
+
+    def __init__(self, corpus: Corpus, min_confidence: float = 0.9):
+        self.corpus = corpus
+        self.min_confidence = min_confidence
+        self.partitions: Dict[str, NDArray[np.int64]] = {}
+        self._title_rows: Dict[str, NDArray[np.int64]] = {}
+
+        corpus.detect_chunk_languages()
+        for language_id in np.unique(corpus.chunk_language_ids):
+            language = corpus.strings[language_id]
+            if language:
+                chunk_rows = np.flatnonzero(corpus.chunk_language_ids == language_id)
+                self.partitions[language] = chunk_rows
+                self._title_rows[language] = np.unique(corpus.chunk_title_ids[chunk_rows])
+
+        self._lock = threading.Lock()
+        self._counts = {language: 0 for language in self.partitions}
+        self._counts["fallback"] = 0
+
+    def route(self, query_text: str) -> Optional[str]:
+        """Partition a query is searched in, None for the whole corpus."""
+
+        return route_language(query_text, self.partitions, self.min_confidence)
+
+    def search(
+        self,
+        query_embedding: Union[List[float], NDArray[np.float64]],
+        query_text: str,
+        **search_options: Any
+    ) -> List[Dict[str, Any]]:
+
+        """
+        Search the partition of the query language, see Corpus.search for the options.
+        """
+
+        language = self.route(query_text)
+        with self._lock:
+            self._counts[language or "fallback"] += 1
+
+        if language is None:
+            return self.corpus.search(query_embedding, **search_options)
+        return self.corpus.search(
+            query_embedding,
+            chunk_rows=self.partitions[language],
+            title_rows=self._title_rows[language],
+            **search_options
+        )
+
+    def metrics(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns:
+            Dict: Number of chunks and of routed queries per partition, "fallback" for
+                queries searched across languages
+        """
+
+        with self._lock:
+            metrics = {
+                language: {"chunks": len(chunk_rows), "queries": self._counts[language]}
+                for language, chunk_rows in self.partitions.items()
+            }
+            metrics["fallback"] = {"chunks": self.corpus.n_chunks, "queries": self._counts["fallback"]}
+        return metrics
@@ -26,4 +26,34 @@ def save_to_json(data: list, output_file_path: str):
             json.dump(data, f, ensure_ascii=False, indent=2)
         print(f"成功將儲存資料至 '{output_file_path}'")
     except IOError as e:
-        print(f"寫入檔案時發生錯誤：{e}")
\ No newline at end of file
+        print(f"寫入檔案時發生錯誤：{e}")
+
+
+def iter_json_data(file_path: str, buffer_size: int = 1 << 20):
+    """逐筆讀取 JSON 陣列檔案中的物件，不需將整個檔案載入記憶體。"""
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\n\r,'
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(buffer_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"'{file_path}' 不是 JSON 陣列。")
+        position = 1
+        eof = False
+
+        while True:
+            while position < len(buffer) and buffer[position] in whitespace:
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # 物件跨越緩衝區邊界，繼續讀取
+                if eof:
+                    raise
+                more = f.read(buffer_size)
+                eof = not more
+                buffer = buffer[position:] + more
+                position = 0
+                continue
+            yield item
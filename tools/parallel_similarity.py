@@ -0,0 +1,291 @@
+"""
+Multi-core similarity search for large offline evaluation jobs.
+Steps:
+1. Take the normalized float32 chunk matrix of the Corpus and publish it in shared memory.
+2. Start a process pool whose workers attach to the shared matrix (no per-worker copies).
+3. Score the question titles in the parent process and fan question batches out to every chunk shard.
+4. Merge the per-shard top-k (or above-threshold) results into the final ranking for each question.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Dict, Any, Union, Optional, Tuple
+import numpy as np
+from numpy.typing import NDArray
+
+from .corpus import Corpus
+
+
+# Worker side views of the shared chunk index, set by _attach_shared_index
+_worker_segments: List[shared_memory.SharedMemory] = []
+_worker_chunk_matrix: Optional[NDArray[np.float32]] = None
+_worker_chunk_title_ids: Optional[NDArray[np.int32]] = None
+
+
+def _normalize_rows(embeddings: List[List[float]]) -> NDArray[np.float32]:
+    """
+    Stack embeddings into a float32 matrix whose rows have unit length.
+    Zero vectors are kept as zeros so they score 0 against every query.
+    """
+
+    matrix = np.array(embeddings, dtype=np.float32)
+    if matrix.ndim != 2:
+        raise ValueError("Embeddings must all have the same dimension")
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_chunk_index(
+    data_with_embeddings: Union[List[Dict[str, Any]], Corpus]
+) -> Tuple[NDArray[np.float32], List[str], NDArray[np.float32], NDArray[np.int32], List[int], List[str]]:
+
+    """
+    Lay out the corpus matrices for sharding.
+
+    Args:
+        data_with_embeddings: List of data items containing chunks and their embeddings, or a Corpus
+
+    Returns:
+        Tuple of (title_matrix, titles, chunk_matrix, chunk_title_ids, chunk_text_ids, strings),
+        where chunk_title_ids[i] is the row in title_matrix that chunk row i belongs to and
+        chunk_text_ids[i] indexes its text in strings
+    """
+
+    corpus = data_with_embeddings if isinstance(data_with_embeddings, Corpus) else Corpus.from_records(data_with_embeddings)
+    if corpus.n_chunks == 0:
+        raise ValueError("Data with embeddings does not contain any chunk embedding")
+
+    rows = np.arange(corpus.n_chunks)
+    chunk_title_ids = corpus.chunk_title_ids
+
+    # A deduplicated chunk gets one extra row per other source title so title filtering still finds it
+    if len(corpus.source_title_ids):
+        title_rows = {int(string_id): row for row, string_id in reversed(list(enumerate(corpus.title_text_ids)))}
+        owners = np.repeat(np.arange(corpus.n_chunks), np.diff(corpus.source_offsets))
+        extra = [
+            (int(owner), title_rows[int(string_id)])
+            for owner, string_id in zip(owners, corpus.source_title_ids)
+            if int(string_id) in title_rows and title_rows[int(string_id)] != corpus.chunk_title_ids[owner]
+        ]
+        if extra:
+            rows = np.concatenate([rows, [owner for owner, _ in extra]])
+            chunk_title_ids = np.concatenate([chunk_title_ids, np.array([row for _, row in extra], dtype=np.int32)])
+
+    return (
+        corpus.title_matrix,
+        [corpus.title(row) for row in range(corpus.n_titles)],
+        corpus.chunk_matrix[rows],
+        chunk_title_ids.astype(np.int32),
+        corpus.chunk_text_ids[rows].tolist(),
+        corpus.strings,
+    )
+
+
+def _publish_array(array: NDArray[Any]) -> shared_memory.SharedMemory:
+    """Copy an array into a new shared memory segment."""
+
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+    shared[...] = array
+    return segment
+
+
+def _attach_shared_index(
+    matrix_name: str,
+    matrix_shape: Tuple[int, int],
+    title_ids_name: str,
+    title_ids_shape: Tuple[int]
+) -> None:
+
+    """Process pool initializer: map the shared chunk index into this worker."""
+
+    global _worker_chunk_matrix, _worker_chunk_title_ids
+
+    matrix_segment = shared_memory.SharedMemory(name=matrix_name)
+    title_ids_segment = shared_memory.SharedMemory(name=title_ids_name)
+    _worker_segments.extend([matrix_segment, title_ids_segment])
+
+    _worker_chunk_matrix = np.ndarray(matrix_shape, dtype=np.float32, buffer=matrix_segment.buf)
+    _worker_chunk_title_ids = np.ndarray(title_ids_shape, dtype=np.int32, buffer=title_ids_segment.buf)
+
+
+def _search_shard(
+    start: int,
+    end: int,
+    query_matrix: NDArray[np.float32],
+    allowed_titles: Optional[NDArray[np.bool_]],
+    top_k: Optional[int],
+    threshold: Optional[float]
+) -> List[Tuple[NDArray[np.int64], NDArray[np.float32]]]:
+
+    """
+    Score a batch of questions against chunk rows [start, end) of the shared matrix.
+
+    Args:
+        start: First chunk row of the shard
+        end: End (exclusive) chunk row of the shard
+        query_matrix: Normalized question embeddings, one row per question
+        allowed_titles: Boolean matrix (questions x titles) restricting which titles
+            each question may match, or None to search every chunk
+        top_k: Number of top chunks to keep per question (if specified)
+        threshold: Minimum similarity to keep (if specified)
+
+    Returns:
+        List of (chunk_indices, similarities) pairs, one per question
+    """
+
+    shard = _worker_chunk_matrix[start:end]
+    scores = query_matrix @ shard.T
+
+    if allowed_titles is not None:
+        shard_title_ids = _worker_chunk_title_ids[start:end]
+        scores[~allowed_titles[:, shard_title_ids]] = -np.inf
+
+    results = []
+    for row in scores:
+        if threshold is not None:
+            candidates = np.flatnonzero(row >= threshold)
+        else:
+            candidates = np.flatnonzero(row > -np.inf)
+
+        if top_k is not None and len(candidates) > top_k:
+            # Stable, so ties keep the lowest rows like the single-core search
+            best = np.argsort(-row[candidates], kind='stable')[:top_k]
+            candidates = np.sort(candidates[best])
+
+        results.append((candidates + start, row[candidates]))
+
+    return results
+
+
+def process_questions_similarity_parallel(
+    questions_with_embeddings: List[Dict[str, Any]],
+    data_with_embeddings: Union[List[Dict[str, Any]], Corpus],
+    title_top_k: Optional[int] = 5,
+    chunk_top_percentage: Optional[float] = 0.75,
+    chunk_top_k: Optional[int] = None,
+    workers: Optional[int] = None,
+    question_batch_size: int = 64
+) -> Dict[str, List[Dict[str, Any]]]:
+
+    """
+    Parallel version of process_questions_similarity for large corpora.
+
+    The chunk matrix is placed in shared memory once and split into one shard per
+    worker. Every question batch is scored against every shard and the per-shard
+    results are merged, so the result matches the single-core search.
+
+    Args:
+        questions_with_embeddings: List of questions with their embeddings
+        data_with_embeddings: List of data items with their embeddings, or a Corpus
+        title_top_k: Number of top similar titles to consider (None searches every chunk)
+        chunk_top_percentage: Minimum similarity threshold for chunks (if specified)
+        chunk_top_k: Number of top chunks to return per question (if specified)
+        workers: Number of worker processes (default is os.cpu_count())
+        question_batch_size: Number of questions sent to a shard in one task
+
+    Returns:
+        Dict: A mapping of questions to their most similar content
+    """
+
+    questions = []
+    question_embeddings = []
+    for question_item in questions_with_embeddings:
+        question = question_item.get('question')
+        question_embedding = question_item.get('question_embedding')
+
+        if not question or question_embedding is None:
+            print(f"Warning: Question or its embedding is missing, skipping...")
+            continue
+
+        questions.append(question)
+        question_embeddings.append(question_embedding)
+
+    if not questions:
+        return {}
+
+    title_matrix, _, chunk_matrix, chunk_title_ids, chunk_text_ids, strings = build_chunk_index(data_with_embeddings)
+    query_matrix = _normalize_rows(question_embeddings)
+
+    # Title filtering is cheap (one row per page), so it stays in the parent process
+    allowed_titles = None
+    if title_top_k is not None:
+        title_scores = query_matrix @ title_matrix.T
+        # Titles without embedding are zero rows and must never be selected
+        title_scores[:, ~title_matrix.any(axis=1)] = -np.inf
+        # Stable sort, so tied titles are picked in the same order as Corpus.search
+        top_titles = np.argsort(-title_scores, axis=1, kind='stable')[:, :title_top_k]
+        top_titles = np.where(np.take_along_axis(title_scores, top_titles, axis=1) > -np.inf, top_titles, -1)
+        allowed_titles = np.zeros((title_scores.shape[0], title_scores.shape[1] + 1), dtype=bool)
+        np.put_along_axis(allowed_titles, top_titles, True, axis=1)
+        # Column -1 collects the padding of questions with fewer scorable titles than title_top_k
+        allowed_titles = allowed_titles[:, :-1]
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(chunk_text_ids))
+    shard_bounds = np.linspace(0, len(chunk_text_ids), workers + 1, dtype=int)
+
+    matrix_segment = _publish_array(chunk_matrix)
+    title_ids_segment = _publish_array(chunk_title_ids)
+    del chunk_matrix
+
+    merged: List[List[Tuple[NDArray[np.int64], NDArray[np.float32]]]] = [[] for _ in questions]
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_attach_shared_index,
+            initargs=(
+                matrix_segment.name, (len(chunk_text_ids), query_matrix.shape[1]),
+                title_ids_segment.name, (len(chunk_text_ids),),
+            )
+        ) as executor:
+            futures = []
+            for batch_start in range(0, len(questions), question_batch_size):
+                batch_end = min(batch_start + question_batch_size, len(questions))
+                batch_allowed = None if allowed_titles is None else allowed_titles[batch_start:batch_end]
+
+                for start, end in zip(shard_bounds[:-1], shard_bounds[1:]):
+                    future = executor.submit(
+                        _search_shard,
+                        int(start), int(end),
+                        query_matrix[batch_start:batch_end],
+                        batch_allowed,
+                        chunk_top_k,
+                        chunk_top_percentage,
+                    )
+                    futures.append((batch_start, future))
+
+            for batch_start, future in futures:
+                for offset, shard_result in enumerate(future.result()):
+                    merged[batch_start + offset].append(shard_result)
+    finally:
+        matrix_segment.close()
+        matrix_segment.unlink()
+        title_ids_segment.close()
+        title_ids_segment.unlink()
+
+    results = {}
+    for question, shard_results in zip(questions, merged):
+        indices = np.concatenate([indices for indices, _ in shard_results])
+        scores = np.concatenate([scores for _, scores in shard_results])
+        # Ties are ordered by chunk row, as in the single-core search
+        order = np.lexsort((indices, -scores))
+
+        # Remove duplicates based on chunk_text while preserving order
+        seen_texts = set()
+        similar_chunks = []
+        for idx in order:
+            text = strings[chunk_text_ids[indices[idx]]]
+            if text and text not in seen_texts:
+                seen_texts.add(text)
+                similar_chunks.append({'chunk_text': text, 'similarity': float(scores[idx])})
+            if chunk_top_k is not None and len(similar_chunks) >= chunk_top_k:
+                break
+
+        results[question] = similar_chunks
+
+    return results
@@ -0,0 +1,320 @@
+"""
+Parameter sweep over chunking and retrieval settings on a labeled question set.
+Steps:
+1. Embed the labeled questions once.
+2. For every chunking variant (chunk_size, chunk_overlap), split the cleaned pages with
+   split_text and embed the titles and chunks through an EmbeddingCache, so only chunks
+   that no earlier variant (or earlier run) produced are sent to the API.
+3. Compute the question × title and question × chunk similarity matrices of the variant
+   once, with one matrix product each.
+4. Evaluate every retrieval setting (title_top_k, chunk_top_percentage) from those matrices
+   without searching again: for a question and a title_top_k, the deduplicated chunks sorted
+   by similarity are the same for every threshold, a threshold only cuts that list.
+5. Report recall@k and MRR of every combination side by side.
+
+The near-duplicate removal of the pipeline is not applied to the variants.
+Providers without split_text (gemini) are swept over the retrieval settings only.
+
+Run with:
+    python -m tools.parameter_sweep --chunk-sizes 300 600 900 --chunk-overlaps 0 30 \\
+        --title-top-k 1 3 5 --thresholds 0.3 0.4 0.5
+"""
+
+import argparse
+import importlib
+import itertools
+import time
+from typing import List, Dict, Any, Optional, Set, Iterable, Callable
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .corpus import Corpus
+from .embedding_jobs import EmbeddingCache
+from .evaluate_retrieval import embed_labeled_questions, first_relevant_rank, summarize_run
+from .load_save_data import load_json_data, save_to_json
+from .source_metadata import page_metadata
+
+
+def chunk_variant(
+    pages: List[Dict[str, Any]],
+    split_text: Callable[..., List[str]],
+    chunk_size: int,
+    chunk_overlap: int
+) -> List[Dict[str, Any]]:
+
+    """
+    Split every page with the given chunk size and overlap.
+
+    Returns:
+        List[Dict]: Chunked data in the format of chunk_data
+    """
+
+    return [
+        {
+            "title": page.get('title', ''),
+            **page_metadata(page),
+            "chunks": split_text(page.get('content', ''), chunk_size, chunk_overlap),
+        }
+        for page in pages
+    ]
+
+
+def embed_variant(
+    chunked_data: List[Dict[str, Any]],
+    cache: EmbeddingCache,
+    embed_batch: Callable[[List[str]], List[List[float]]],
+    batch_size: int = 100,
+    delay_between_batches: float = 0.0
+) -> Corpus:
+
+    """Embed the titles and chunks of a variant through the cache and build its corpus."""
+
+    texts = []
+    for item in chunked_data:
+        if item.get('title'):
+            texts.append(item['title'])
+        texts.extend(item.get('chunks', []))
+
+    embeddings = cache.embed(texts, embed_batch, batch_size, delay_between_batches=delay_between_batches)
+    return Corpus.from_embeddings(chunked_data, embeddings)
+
+
+def _text_sources(corpus: Corpus) -> Dict[int, Set[str]]:
+    """Map every chunk string id to the titles / URLs of the pages it belongs to."""
+
+    sources: Dict[int, Set[str]] = {}
+    for row in range(corpus.n_chunks):
+        title_row = int(corpus.chunk_title_ids[row])
+        text_sources = sources.setdefault(int(corpus.chunk_text_ids[row]), set())
+        text_sources.add(corpus.title(title_row))
+        if "url" in corpus.title_fields and corpus.title_field(title_row, "url"):
+            text_sources.add(corpus.title_field(title_row, "url"))
+        text_sources.update(corpus.chunk_source_titles(row))
+    sources.pop(corpus.string_id(""), None)
+    return sources
+
+
+def sweep_retrieval(
+    corpus: Corpus,
+    question_matrix: NDArray[np.float32],
+    labeled_questions: List[Dict[str, Any]],
+    title_top_ks: Iterable[int],
+    chunk_top_percentages: Iterable[float],
+    ks: Iterable[int] = (1, 3, 5)
+) -> List[Dict[str, Any]]:
+
+    """
+    Evaluate every (title_top_k, chunk_top_percentage) pair on one corpus.
+
+    The results equal those of Corpus.search with include_titles=True and no coarse
+    shortlist, computed from one question × title and one question × chunk matrix.
+
+    Args:
+        corpus: Corpus of the chunking variant
+        question_matrix: Normalized question embeddings, one row per labeled question
+        labeled_questions: Labeled questions in the order of question_matrix
+        title_top_ks: Values of title_top_k to evaluate
+        chunk_top_percentages: Values of chunk_top_percentage to evaluate
+        ks: Cutoffs for recall@k
+
+    Returns:
+        List[Dict]: One entry per setting with its config and metrics
+    """
+
+    title_top_ks = list(title_top_ks)
+    chunk_top_percentages = list(chunk_top_percentages)
+    ks = list(ks)
+
+    title_scores = question_matrix @ corpus.title_matrix.T
+    chunk_scores = question_matrix @ corpus.chunk_matrix.T
+    valid_titles = np.flatnonzero(corpus.title_norms > 0)
+    sources = _text_sources(corpus)
+
+    ranks = {setting: [] for setting in itertools.product(title_top_ks, chunk_top_percentages)}
+    retrieved = {setting: 0 for setting in ranks}
+
+    for q, label in enumerate(labeled_questions):
+        title_order = valid_titles[np.argsort(-title_scores[q, valid_titles], kind='stable')]
+
+        for title_top_k in title_top_ks:
+            rows = corpus.chunk_rows_for_titles(corpus.title_text_ids[title_order[:title_top_k]])
+            scores = chunk_scores[q, rows]
+
+            # Unique chunk texts, most similar first, as Corpus.search returns them
+            unique_scores = []
+            unique_sources = []
+            seen_text_ids = set()
+            for idx in np.argsort(-scores, kind='stable'):
+                text_id = int(corpus.chunk_text_ids[rows[idx]])
+                if text_id in seen_text_ids or text_id not in sources:
+                    continue
+                seen_text_ids.add(text_id)
+                unique_scores.append(scores[idx])
+                unique_sources.append(sources[text_id])
+
+            rank = first_relevant_rank(unique_sources, label.get("expected_title"), label.get("expected_url"))
+            unique_scores = np.array(unique_scores, dtype=np.float32)
+
+            for chunk_top_percentage in chunk_top_percentages:
+                kept = int(np.count_nonzero(unique_scores >= chunk_top_percentage))
+                ranks[(title_top_k, chunk_top_percentage)].append(rank if rank is not None and rank <= kept else None)
+                retrieved[(title_top_k, chunk_top_percentage)] += kept
+
+    results = []
+    for (title_top_k, chunk_top_percentage), setting_ranks in ranks.items():
+        metrics = summarize_run(setting_ranks, None, ks)
+        metrics["avg_retrieved"] = retrieved[(title_top_k, chunk_top_percentage)] / len(labeled_questions) \
+            if labeled_questions else 0.0
+        results.append({
+            "config": {"title_top_k": title_top_k, "chunk_top_percentage": chunk_top_percentage},
+            "metrics": metrics,
+        })
+    return results
+
+
+def run_sweep(
+    labels_file: str,
+    llm: str = "openai",
+    pages_file: str = "output/json/cleaned_manual_data.json",
+    chunk_sizes: Iterable[int] = (600,),
+    chunk_overlaps: Iterable[int] = (30,),
+    title_top_ks: Iterable[int] = (1, 3, 5),
+    chunk_top_percentages: Iterable[float] = (0.3, 0.4, 0.5),
+    cache_path: Optional[str] = None,
+    question_embedding_file: Optional[str] = None,
+    ks: Iterable[int] = (1, 3, 5)
+) -> List[Dict[str, Any]]:
+
+    """
+    Sweep chunking and retrieval settings and evaluate every combination.
+
+    Args:
+        labels_file: Labeled question file (see evaluate_retrieval)
+        llm: Embedding provider, "openai" or "gemini"
+        pages_file: Cleaned pages ({'title', 'url', 'content'})
+        chunk_sizes: Values of chunk_size passed to split_text
+        chunk_overlaps: Values of chunk_overlap passed to split_text (pairs with an
+            overlap not below the chunk size are skipped)
+        title_top_ks: Values of title_top_k
+        chunk_top_percentages: Values of chunk_top_percentage
+        cache_path: Embedding cache file (default is output/cache/embeddings_<llm>.jsonl)
+        question_embedding_file: Optional file with precomputed question embeddings
+        ks: Cutoffs for recall@k
+
+    Returns:
+        List[Dict]: One entry per combination with its config, metrics and variant statistics
+    """
+
+    labeled_questions = load_json_data(labels_file)
+    if not labeled_questions:
+        raise ValueError(f"Can't load labeled questions from '{labels_file}'")
+    pages = load_json_data(pages_file)
+    if not pages:
+        raise ValueError(f"Can't load pages from '{pages_file}'")
+
+    embedding_module = importlib.import_module(f"tools.generate_embedding_{llm}")
+    split_text = getattr(embedding_module, "split_text", None)
+    cache = EmbeddingCache(cache_path or f"output/cache/embeddings_{llm}.jsonl", embedding_module.Model_Name)
+    embed_batch = lambda batch: embedding_module.embed_batch(batch, embedding_module.Model_Name)
+
+    question_embeddings = embed_labeled_questions(labeled_questions, llm, question_embedding_file)
+    question_matrix = np.array([question_embeddings[label["question"]] for label in labeled_questions], dtype=np.float32)
+    norms = np.linalg.norm(question_matrix, axis=1, keepdims=True)
+    question_matrix /= np.where(norms > 0, norms, 1)
+
+    if split_text is None:
+        variants = [(None, None)]
+    else:
+        variants = [(size, overlap) for size, overlap in itertools.product(chunk_sizes, chunk_overlaps) if overlap < size]
+
+    report = []
+    for chunk_size, chunk_overlap in variants:
+        misses_before = cache.misses
+        start = time.perf_counter()
+        if split_text is None:
+            chunked_data = embedding_module.chunk_data(pages)
+        else:
+            chunked_data = chunk_variant(pages, split_text, chunk_size, chunk_overlap)
+        corpus = embed_variant(
+            chunked_data, cache, embed_batch,
+            embedding_module.Batch_Size, embedding_module.Delay_Between_Batches
+        )
+        embed_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = sweep_retrieval(corpus, question_matrix, labeled_questions, title_top_ks, chunk_top_percentages, ks)
+        sweep_seconds = time.perf_counter() - start
+
+        variant = {
+            "chunks": corpus.n_chunks,
+            "texts_embedded": cache.misses - misses_before,
+            "embed_seconds": round(embed_seconds, 3),
+            "sweep_seconds": round(sweep_seconds, 3),
+        }
+        print(
+            f"chunk_size={chunk_size} chunk_overlap={chunk_overlap}: {corpus.n_chunks} chunks, "
+            f"{variant['texts_embedded']} new texts embedded, {len(results)} settings in {sweep_seconds * 1000:.1f} ms"
+        )
+
+        for result in results:
+            result["config"] = {"provider": llm, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap, **result["config"]}
+            result["variant"] = variant
+            report.append(result)
+
+    return report
+
+
+def print_sweep_report(report: List[Dict[str, Any]]) -> None:
+    """Print one row per combination, best MRR marked."""
+
+    if not report:
+        print("No results.")
+        return
+
+    recall_keys = [key for key in report[0]["metrics"] if key.startswith("recall@")]
+    best = max(range(len(report)), key=lambda i: (report[i]["metrics"]["mrr"], -i))
+
+    header = f"  {'size':>6} {'overlap':>7} {'top_k':>5} {'thresh':>6}"
+    header += "".join(f" {key:>9}" for key in recall_keys) + f" {'MRR':>6} {'avg_ret':>7}"
+    print(f"\n{'='*len(header)}")
+    print(header)
+    for i, run in enumerate(report):
+        config, metrics = run["config"], run["metrics"]
+        line = "* " if i == best else "  "
+        line += f"{str(config['chunk_size']):>6} {str(config['chunk_overlap']):>7} "
+        line += f"{config['title_top_k']:>5} {config['chunk_top_percentage']:>6.2f}"
+        line += "".join(f" {metrics[key]:>9.3f}" for key in recall_keys)
+        line += f" {metrics['mrr']:>6.3f} {metrics['avg_retrieved']:>7.1f}"
+        print(line)
+    print(f"{'='*len(header)}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep chunking and retrieval parameters on a labeled question set.")
+    parser.add_argument("--labels", default="output/json/labeled_questions.json", help="Labeled question file")
+    parser.add_argument("--llm", default="openai", choices=["openai", "gemini"], help="Embedding provider")
+    parser.add_argument("--pages", default="output/json/cleaned_manual_data.json", help="Cleaned pages")
+    parser.add_argument("--question-embeddings", help="Precomputed question embedding file")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[300, 600, 900])
+    parser.add_argument("--chunk-overlaps", type=int, nargs="+", default=[0, 30, 60])
+    parser.add_argument("--title-top-k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.4, 0.5, 0.6],
+                        help="Values of chunk_top_percentage")
+    parser.add_argument("--cache", default=None, help="Default is output/cache/embeddings_<llm>.jsonl")
+    parser.add_argument("--output", default="output/json/parameter_sweep.json", help="Report file")
+    args = parser.parse_args()
+
+    report = run_sweep(
+        labels_file=args.labels,
+        llm=args.llm,
+        pages_file=args.pages,
+        chunk_sizes=args.chunk_sizes,
+        chunk_overlaps=args.chunk_overlaps,
+        title_top_ks=args.title_top_k,
+        chunk_top_percentages=args.thresholds,
+        cache_path=args.cache,
+        question_embedding_file=args.question_embeddings,
+    )
+    print_sweep_report(report)
+    save_to_json(report, args.output)
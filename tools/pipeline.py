@@ -0,0 +1,320 @@
+"""
+Incremental pipeline runner for scrape → clean → chunk → dedup → embed → index → evaluate.
+
+Every stage declares the artifacts it reads, the artifacts it writes and the
+parameters that affect its output. The runner fingerprints the content of the
+inputs together with the parameters and stores the fingerprint in a manifest
+after a successful run, so a stage is rebuilt only when one of them changed
+(or an output is missing). Because fingerprints are content based, a stage
+that is re-run but produces byte-identical output does not invalidate the
+stages after it.
+"""
+
+import hashlib
+import importlib
+import json
+import os
+from typing import List, Dict, Any, Callable, Optional, Iterable
+
+from .embedding_jobs import clear_checkpoint
+from .load_save_data import load_json_data, save_to_json
+
+
+DEFAULT_MANIFEST_PATH = "output/pipeline_manifest.json"
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Args:
+        name: Stage name used on the command line and in the manifest
+        run: Callable that builds the outputs, called as run(stage)
+        inputs: Artifact paths the stage reads
+        outputs: Artifact paths the stage writes
+        params: JSON serializable parameters that affect the outputs
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[["Stage"], None],
+        inputs: Optional[List[str]] = None,
+        outputs: Optional[List[str]] = None,
+        params: Optional[Dict[str, Any]] = None
+    ):
+        self.name = name
+        self.run = run
+        self.inputs = inputs or []
+        self.outputs = outputs or []
+        self.params = params or {}
+
+
+def fingerprint_file(file_path: str) -> str:
+    """Return the sha256 of a file's content, or "missing" if it does not exist."""
+
+    if not os.path.isfile(file_path):
+        return "missing"
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PipelineRunner:
+    """
+    Run pipeline stages in order, skipping the ones whose fingerprint is unchanged.
+    """
+
+    def __init__(self, stages: List[Stage], manifest_path: str = DEFAULT_MANIFEST_PATH):
+        self.stages = stages
+        self.manifest_path = manifest_path
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        return load_json_data(self.manifest_path) or {}
+
+    def _save_manifest(self) -> None:
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def fingerprint(self, stage: Stage) -> str:
+        """Fingerprint a stage from its parameters and the content of its inputs."""
+
+        digest = hashlib.sha256()
+        digest.update(stage.name.encode('utf-8'))
+        digest.update(json.dumps(stage.params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        for input_path in stage.inputs:
+            digest.update(input_path.encode('utf-8'))
+            digest.update(fingerprint_file(input_path).encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_stale(self, stage: Stage) -> bool:
+        """A stage is stale if it never ran, its fingerprint changed or an output is missing."""
+
+        record = self.manifest.get(stage.name)
+        if not record or record.get("fingerprint") != self.fingerprint(stage):
+            return True
+        return any(not os.path.exists(output) for output in stage.outputs)
+
+    def status(self) -> Dict[str, bool]:
+        """Return a mapping of stage name to whether it is stale."""
+
+        return {stage.name: self.is_stale(stage) for stage in self.stages}
+
+    def run(self, targets: Optional[Iterable[str]] = None, force: Iterable[str] = ()) -> List[str]:
+        """
+        Run the selected stages in pipeline order.
+
+        Args:
+            targets: Names of the stages to run (default is every stage)
+            force: Names of the stages to rebuild even if they are up to date
+
+        Returns:
+            List[str]: Names of the stages that were actually rebuilt
+        """
+
+        names = [stage.name for stage in self.stages]
+        targets = set(targets) if targets else set(names)
+        force = set(force)
+
+        unknown = (targets | force) - set(names)
+        if unknown:
+            raise ValueError(f"Unknown stage(s): {', '.join(sorted(unknown))}. Available: {', '.join(names)}")
+
+        rebuilt = []
+        for stage in self.stages:
+            if stage.name not in targets:
+                continue
+
+            if stage.name not in force and not self.is_stale(stage):
+                print(f"[{stage.name}] up to date, skipping")
+                continue
+
+            missing = [path for path in stage.inputs if not os.path.exists(path)]
+            if missing:
+                raise FileNotFoundError(f"[{stage.name}] missing input(s): {', '.join(missing)}")
+
+            print(f"[{stage.name}] running...")
+            stage.run(stage)
+
+            missing = [path for path in stage.outputs if not os.path.exists(path)]
+            if missing:
+                raise RuntimeError(f"[{stage.name}] did not produce: {', '.join(missing)}")
+
+            # Record the fingerprint only after the stage finished successfully
+            self.manifest[stage.name] = {
+                "fingerprint": self.fingerprint(stage),
+                "outputs": {output: fingerprint_file(output) for output in stage.outputs},
+            }
+            self._save_manifest()
+            rebuilt.append(stage.name)
+
+        return rebuilt
+
+
+def _write_json(data: Any, file_path: str) -> None:
+    """Write JSON through a temporary file, raising on failure and never leaving a partial file."""
+
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, file_path)
+
+
+def _scrape(stage: Stage) -> None:
+    from .airpods_manual_fetch import iter_airpods_manual
+
+    # Errors of the table of contents page propagate, so a failed scrape that leaves the
+    # previous manual file behind is not recorded as a success
+    pages = list(iter_airpods_manual(stage.params["url"]))
+    if not pages:
+        raise RuntimeError(f"No page scraped from {stage.params['url']}, the previous manual file is kept")
+    _write_json(pages, stage.outputs[0])
+
+
+def _clean(stage: Stage) -> None:
+    from .clean_data import preprocess_text
+
+    pages = load_json_data(stage.inputs[0])
+    for page in pages:
+        page["content"] = preprocess_text(page.get("content", ""))
+    save_to_json(pages, stage.outputs[0])
+
+
+def _chunk(stage: Stage) -> None:
+    embedding_module = importlib.import_module(f"tools.generate_embedding_{stage.params['llm']}")
+    save_to_json(embedding_module.chunk_data(load_json_data(stage.inputs[0])), stage.outputs[0])
+
+
+def _dedup(stage: Stage) -> None:
+    from .deduplicate import deduplicate_chunks
+
+    chunked_data = load_json_data(stage.inputs[0])
+    if stage.params.get("threshold") is not None:
+        chunked_data = deduplicate_chunks(chunked_data, threshold=stage.params["threshold"])
+    save_to_json(chunked_data, stage.outputs[0])
+
+
+def _embed(stage: Stage) -> None:
+    embedding_module = importlib.import_module(f"tools.generate_embedding_{stage.params['llm']}")
+    embedded_data = embedding_module.embed_chunked_data(
+        load_json_data(stage.inputs[0]),
+        coarse_dim=stage.params.get("coarse_dim")
+    )
+    if not embedded_data:
+        raise RuntimeError("Embedding failed, the previous embedding file is kept")
+    save_to_json(embedded_data, stage.outputs[0])
+
+    # The embeddings are saved, the checkpoint is no longer needed
+    clear_checkpoint(embedding_module.Checkpoint_Path)
+
+
+def _embed_questions(stage: Stage) -> None:
+    embedding_module = importlib.import_module(f"tools.generate_embedding_{stage.params['llm']}")
+    question_embeddings = embedding_module.process_and_embed_questions(stage.params["questions"])
+    if not question_embeddings:
+        raise RuntimeError("Question embedding failed, the previous question file is kept")
+    save_to_json(question_embeddings, stage.outputs[0])
+
+
+def _index(stage: Stage) -> None:
+    from .index_versions import build_index_version
+
+    # Built as a new index version next to the active one and switched to when complete,
+    # so queries are served by the previous version during the rebuild
+    embedding_module = importlib.import_module(f"tools.generate_embedding_{stage.params['llm']}")
+    version = build_index_version(
+        stage.params["db_path"],
+        stage.params["collection_name"],
+        stage.inputs[0],
+        provider=stage.params["llm"],
+        model_name=embedding_module.Model_Name,
+    )
+
+    # The Chroma directory is not a single file, so leave a marker as the stage output
+    with open(stage.outputs[0], 'w', encoding='utf-8') as f:
+        json.dump({"collection": stage.params["collection_name"], "version": version["name"], "count": version["count"]}, f)
+
+
+def _evaluate(stage: Stage) -> None:
+    from .similarity_calculation import calculate, print_similarity_results
+
+    qa_data = calculate(
+        question_file=stage.inputs[0],
+        data_file=stage.inputs[1],
+        chunk_top_percentage=stage.params["chunk_top_percentage"],
+        coarse_candidates=stage.params.get("coarse_candidates"),
+        route_by_language=stage.params.get("route_by_language", False),
+    )
+    if qa_data is None:
+        raise RuntimeError("Similarity calculation failed")
+    print_similarity_results(qa_data)
+    save_to_json(qa_data, stage.outputs[0])
+
+
+def build_stages(
+    llm: str,
+    url: str,
+    questions: List[str],
+    output_dir: str = "output/json",
+    db_path: str = "./chroma_db",
+    chunk_top_percentage: float = 0.5,
+    coarse_dim: Optional[int] = None,
+    coarse_candidates: Optional[int] = None,
+    dedup_threshold: Optional[float] = 0.85,
+    route_by_language: bool = False
+) -> List[Stage]:
+
+    """
+    Declare the stages of the AirPods manual pipeline for one embedding provider.
+
+    Args:
+        llm: Embedding provider, "openai" or "gemini"
+        url: Table of contents page of the manual to scrape
+        questions: Questions used by the evaluate stage
+        output_dir: Directory for the JSON artifacts
+        db_path: ChromaDB directory for the index stage
+        chunk_top_percentage: Minimum similarity threshold used by the evaluate stage
+        coarse_dim: Dimension of the coarse embeddings (None disables them)
+        coarse_candidates: Shortlist size for coarse-to-fine search in the evaluate stage
+        dedup_threshold: Jaccard threshold of near-duplicate chunk removal (None keeps every chunk)
+        route_by_language: Search each question in the chunks of its language in the evaluate stage
+
+    Returns:
+        List[Stage]: Stages in execution order
+    """
+
+    manual_file = os.path.join(output_dir, "airpods_manual_data.json")
+    cleaned_file = os.path.join(output_dir, "cleaned_manual_data.json")
+    chunked_file = os.path.join(output_dir, f"chunked_data_{llm}.json")
+    deduplicated_file = os.path.join(output_dir, f"deduplicated_data_{llm}.json")
+    embedding_file = os.path.join(output_dir, f"text_embedding_{llm}.json")
+    question_file = os.path.join(output_dir, f"question_embeddings_{llm}.json")
+    index_marker = os.path.join(output_dir, f"chroma_index_{llm}.json")
+    results_file = os.path.join(output_dir, f"similarity_results_{llm}.json")
+
+    return [
+        Stage("scrape", _scrape, outputs=[manual_file], params={"url": url}),
+        Stage("clean", _clean, inputs=[manual_file], outputs=[cleaned_file]),
+        Stage("chunk", _chunk, inputs=[cleaned_file], outputs=[chunked_file], params={"llm": llm}),
+        Stage("dedup", _dedup, inputs=[chunked_file], outputs=[deduplicated_file],
+              params={"threshold": dedup_threshold}),
+        Stage("embed", _embed, inputs=[deduplicated_file], outputs=[embedding_file],
+              params={"llm": llm, "coarse_dim": coarse_dim}),
+        Stage("embed_questions", _embed_questions, outputs=[question_file],
+              params={"llm": llm, "questions": questions}),
+        Stage("index", _index, inputs=[embedding_file], outputs=[index_marker],
+              params={"db_path": db_path, "collection_name": f"text_embedding_{llm}", "llm": llm}),
+        Stage("evaluate", _evaluate, inputs=[question_file, embedding_file], outputs=[results_file],
+              params={"chunk_top_percentage": chunk_top_percentage, "coarse_candidates": coarse_candidates,
+                      "route_by_language": route_by_language}),
+    ]
@@ -1,32 +1,43 @@
 import os
 import sys
+import time
 import openai
 
 # 動態添加專案根目錄到 sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from tools.ChromaDB import initialize_chroma_db, query_chromadb
+from tools.ChromaDB import query_chromadb_results
+from tools.index_versions import ActiveIndex
+from tools.context_packing import pack_context, format_context
+from tools.answer_router import AnswerRouter, EXTRACTIVE
 
 client_llm = openai.ChatCompletion(api_key=os.getenv("OPENAI_API_KEY"))
 
-def ask_with_context(question: str, top_k: int = 1):
+LLM_Model = "gpt-4o-mini"
+
+def build_context(results, max_context_tokens: int = 1500):
     """
-    使用 ChromaDB 查詢並回答問題。
+    將 ChromaDB 的查詢結果整理成提示中的文件內容。
+    查詢到的 chunk 會先合併同一頁中相鄰或重疊的部分、去除近似重複，
+    再依相關度填入 max_context_tokens 的 token 預算中。
     """
-    # 初始化 ChromaDB
-    db_path = "./chroma_db"
-    collection_name = "text_embedding_openai"
-    collection = initialize_chroma_db(db_path, collection_name)
-
-    # 查詢 ChromaDB
-    results = query_chromadb(collection, question, n_results=top_k)
+    passages = pack_context(
+        results["documents"][0] if results.get("documents") else [],
+        results["metadatas"][0] if results.get("metadatas") else None,
+        token_budget=max_context_tokens,
+    )
+    return format_context(passages) or "沒有找到相關的內容。"
 
-    prompt = f"""
+def build_prompt(question: str, context: str):
+    """
+    組合送給 LLM 的提示。
+    """
+    return f"""
     你是一個智慧助理，根據以下文件內容回答問題。
     如果文件中沒有相關資訊，就回答「文件中沒有提到」。
 
     文件內容：
-    {results}
+    {context}
 
     使用者問題：
     {question}
@@ -34,17 +45,50 @@ def ask_with_context(question: str, top_k: int = 1):
     請以清楚、自然且簡短的中文回答：
     """
 
+def ask_with_context(question: str, top_k: int = 1, max_context_tokens: int = 1500, router: AnswerRouter = None,
+                     where: dict = None, route_by_language: bool = False):
+    """
+    使用 ChromaDB 查詢並回答問題。
+    指定 router 時，依檢索的相似度決定直接回傳最相近的 chunk、使用便宜的模型或使用完整的模型。
+    指定 where 時（例如 {"product": "AirPods Pro"}），只在符合 metadata 條件的 chunk 中查詢。
+    route_by_language 為 True 時，只在與問題相同語言的 chunk 中查詢。
+    """
+    start = time.perf_counter()
+
+    # 初始化 ChromaDB（使用目前啟用的索引版本）
+    db_path = "./chroma_db"
+    collection_name = "text_embedding_openai"
+    collection = ActiveIndex(db_path, collection_name)
+
+    # 查詢 ChromaDB
+    results = query_chromadb_results(collection, question, n_results=top_k, where=where,
+                                     route_by_language=route_by_language)
+
+    route, model = None, LLM_Model
+    if router is not None:
+        route = router.choose_for_results(results)
+        # 幾乎完全相符時直接回傳 chunk，不呼叫 LLM
+        if route == EXTRACTIVE:
+            answer = router.extractive_answer(results)
+            router.record(route, time.perf_counter() - start)
+            return answer
+        model = router.model_for(route)
+
+    prompt = build_prompt(question, build_context(results, max_context_tokens))
+
     # 呼叫 LLM 生成回覆
     response = client_llm.create(
-        model="gpt-4o-mini",
+        model=model,
         messages=[{"role": "user", "content": prompt}],
         temperature=0.3,
     )
 
     answer = response.choices[0].message.content.strip()
+    if router is not None:
+        router.record(route, time.perf_counter() - start)
     return answer
 
 if __name__ == "__main__":
     query = input("請輸入你的問題：")
-    response = ask_with_context(query, top_k=1)
+    response = ask_with_context(query, top_k=5)
     print(f"回答：{response}")
\ No newline at end of file
@@ -0,0 +1,452 @@
+"""
+Incrementally updatable similarity index made of immutable segments.
+Steps:
+1. The index directory holds a base segment plus small delta segments, each a JSON file with
+   records (the text_embedding_*.json format) and tombstones (deleted chunks / titles).
+2. A chunk is identified by (title, chunk_text). A newer segment that adds or deletes the same
+   key hides the older copy, so updates never rewrite existing segments.
+3. Searches score every segment (as a Corpus) restricted to its visible rows and merge the results.
+   Visibility masks are replaced copy-on-write, so queries keep running while updates are applied.
+4. Compaction merges all segments into a new base segment in a background thread, then
+   switches the manifest atomically and removes the old segment files.
+"""
+
+import json
+import os
+import threading
+from typing import List, Dict, Any, Union, Optional, Iterable, Tuple
+import numpy as np
+from numpy.typing import NDArray
+
+from .corpus import Corpus
+
+
+MANIFEST_FILE = "manifest.json"
+
+ChunkKey = Tuple[str, str]
+
+
+def _write_json_atomic(data: Any, file_path: str) -> None:
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, file_path)
+
+
+class Segment:
+    """
+    One immutable segment: a Corpus plus the tombstones written with it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        records: List[Dict[str, Any]],
+        deleted_chunks: Iterable[ChunkKey] = (),
+        deleted_titles: Iterable[str] = ()
+    ):
+        self.name = name
+        self.corpus = Corpus.from_records(records)
+        self.deleted_chunks = [tuple(key) for key in deleted_chunks]
+        self.deleted_titles = list(deleted_titles)
+
+    @classmethod
+    def load(cls, directory: str, name: str) -> "Segment":
+        with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(name, data.get("records", []), data.get("deleted_chunks", []), data.get("deleted_titles", []))
+
+    def save(self, directory: str) -> None:
+        # The records come from the float32 Corpus, see Corpus.to_records for the precision
+        _write_json_atomic({
+            "records": self.corpus.to_records(),
+            "deleted_chunks": [list(key) for key in self.deleted_chunks],
+            "deleted_titles": self.deleted_titles,
+        }, os.path.join(directory, self.name))
+
+    def chunk_key(self, row: int) -> ChunkKey:
+        return self.corpus.title(self.corpus.chunk_title_ids[row]), self.corpus.chunk_text(row)
+
+
+class _Snapshot:
+    """Segments with their visibility masks; never modified once published."""
+
+    __slots__ = ("segments", "chunk_masks", "title_masks")
+
+    def __init__(self, segments: List[Segment], chunk_masks: List[NDArray[np.bool_]], title_masks: List[NDArray[np.bool_]]):
+        self.segments = segments
+        self.chunk_masks = chunk_masks
+        self.title_masks = title_masks
+
+
+class SegmentedIndex:
+    """
+    Similarity index supporting add / update / delete through append-only delta segments.
+
+        index = SegmentedIndex.open("output/index_openai", load_json_data("output/json/text_embedding_openai.json"))
+        index.replace_titles(updated_records)    # re-scraped pages
+        index.delete_titles(["Removed page"])
+        results = index.search(query_embedding, title_top_k=5, chunk_top_percentage=0.5)
+    """
+
+    def __init__(self, directory: str, compact_after: Optional[int] = 8):
+
+        """
+        Args:
+            directory: Directory of the manifest and segment files
+            compact_after: Start a background compaction when there are more segments
+                than this (None disables automatic compaction)
+        """
+
+        self.directory = directory
+        self.compact_after = compact_after
+
+        self._write_lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._next_id = 0
+        self._reset_state()
+        self._snapshot = _Snapshot([], [], [])
+
+    @classmethod
+    def open(
+        cls,
+        directory: str,
+        base_records: Optional[List[Dict[str, Any]]] = None,
+        compact_after: Optional[int] = 8
+    ) -> "SegmentedIndex":
+
+        """
+        Open an index directory, creating it from base_records if it has no manifest yet.
+
+        Args:
+            directory: Directory of the manifest and segment files
+            base_records: Data with embeddings used as the base segment of a new index
+            compact_after: See SegmentedIndex
+
+        Returns:
+            SegmentedIndex: The loaded index
+        """
+
+        index = cls(directory, compact_after)
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            index._next_id = manifest.get("next_id", 0)
+            index._replay([Segment.load(directory, name) for name in manifest.get("segments", [])])
+        else:
+            os.makedirs(directory, exist_ok=True)
+            index._commit(base_records or [], (), ())
+
+        return index
+
+    # ---- state ----
+
+    def _reset_state(self) -> None:
+        # Writer side bookkeeping (guarded by _write_lock): where the visible copy of each
+        # chunk key / title embedding lives, as (segment position, row)
+        self._live_chunks: Dict[ChunkKey, Tuple[int, int]] = {}
+        self._title_chunks: Dict[str, set] = {}
+        self._live_titles: Dict[str, Tuple[int, int]] = {}
+        self._titles: Dict[str, None] = {}
+
+    def _apply(
+        self,
+        position: int,
+        segment: Segment,
+        chunk_masks: List[NDArray[np.bool_]],
+        title_masks: List[NDArray[np.bool_]]
+    ) -> None:
+
+        """Apply one segment on top of the state, hiding what it replaces (copy-on-write)."""
+
+        copied = set()
+
+        def writable(masks: List[NDArray[np.bool_]], seg: int) -> NDArray[np.bool_]:
+            if (id(masks), seg) not in copied:
+                masks[seg] = masks[seg].copy()
+                copied.add((id(masks), seg))
+            return masks[seg]
+
+        def hide_chunk(key: ChunkKey) -> None:
+            location = self._live_chunks.pop(key, None)
+            if location is not None:
+                writable(chunk_masks, location[0])[location[1]] = False
+                self._title_chunks[key[0]].discard(key)
+
+        def hide_title(title: str) -> None:
+            location = self._live_titles.pop(title, None)
+            if location is not None:
+                writable(title_masks, location[0])[location[1]] = False
+
+        # Tombstones apply to older segments only, so they go before the segment's own records
+        for title in segment.deleted_titles:
+            for key in list(self._title_chunks.get(title, ())):
+                hide_chunk(key)
+            hide_title(title)
+            self._titles.pop(title, None)
+        for key in segment.deleted_chunks:
+            hide_chunk(key)
+
+        corpus = segment.corpus
+        chunk_masks.append(np.ones(corpus.n_chunks, dtype=bool))
+        title_masks.append(corpus.title_norms > 0)
+        copied.update({(id(chunk_masks), position), (id(title_masks), position)})
+
+        for row in range(corpus.n_titles):
+            title = corpus.title(row)
+            self._titles.setdefault(title, None)
+            # A record without title embedding keeps the previous embedding of that title
+            if title_masks[position][row]:
+                hide_title(title)
+                self._live_titles[title] = (position, row)
+
+        for row in range(corpus.n_chunks):
+            key = segment.chunk_key(row)
+            hide_chunk(key)
+            self._live_chunks[key] = (position, row)
+            self._title_chunks.setdefault(key[0], set()).add(key)
+
+    def _replay(self, segments: List[Segment]) -> None:
+        with self._write_lock:
+            self._reset_state()
+            chunk_masks, title_masks = [], []
+            for position, segment in enumerate(segments):
+                self._apply(position, segment, chunk_masks, title_masks)
+            self._snapshot = _Snapshot(list(segments), chunk_masks, title_masks)
+
+    def _save_manifest(self, segments: List[Segment]) -> None:
+        _write_json_atomic(
+            {"segments": [segment.name for segment in segments], "next_id": self._next_id},
+            os.path.join(self.directory, MANIFEST_FILE),
+        )
+
+    def _new_segment_name(self) -> str:
+        name = f"segment_{self._next_id:06d}.json"
+        self._next_id += 1
+        return name
+
+    def _commit(
+        self,
+        records: List[Dict[str, Any]],
+        deleted_chunks: Iterable[ChunkKey],
+        deleted_titles: Iterable[str]
+    ) -> None:
+
+        """Write a delta segment, record it in the manifest and publish the new snapshot."""
+
+        with self._write_lock:
+            segment = Segment(self._new_segment_name(), records, deleted_chunks, deleted_titles)
+            segment.save(self.directory)
+
+            snapshot = self._snapshot
+            segments = snapshot.segments + [segment]
+            chunk_masks, title_masks = list(snapshot.chunk_masks), list(snapshot.title_masks)
+            self._apply(len(snapshot.segments), segment, chunk_masks, title_masks)
+
+            # The manifest switch is the commit point; a crash before it leaves an unused file
+            self._save_manifest(segments)
+            self._snapshot = _Snapshot(segments, chunk_masks, title_masks)
+
+        if self.compact_after is not None and len(segments) > self.compact_after:
+            self.compact(wait=False)
+
+    # ---- updates ----
+
+    def add(self, records: List[Dict[str, Any]]) -> None:
+        """
+        Add chunks, or update them if a chunk with the same title and text exists.
+
+        Args:
+            records: Data with embeddings in the text_embedding_*.json format
+        """
+
+        self._commit(records, (), ())
+
+    def delete(self, chunk_keys: Iterable[ChunkKey]) -> None:
+        """
+        Delete chunks.
+
+        Args:
+            chunk_keys: (title, chunk_text) of each chunk to delete
+        """
+
+        self._commit([], [tuple(key) for key in chunk_keys], ())
+
+    def delete_titles(self, titles: Iterable[str]) -> None:
+        """Delete pages with all their chunks."""
+
+        self._commit([], (), list(titles))
+
+    def replace_titles(self, records: List[Dict[str, Any]]) -> None:
+        """
+        Replace whole pages: the chunks of every title in records that are not in records
+        any more are deleted, the others are added or updated.
+        """
+
+        self._commit(records, (), [record.get('title', '') for record in records])
+
+    # ---- compaction ----
+
+    @staticmethod
+    def _merged_records(
+        segments: List[Segment],
+        live_chunks: Dict[ChunkKey, Tuple[int, int]],
+        live_titles: Dict[str, Tuple[int, int]],
+        titles: Iterable[str]
+    ) -> List[Dict[str, Any]]:
+
+        """Records of every visible title and chunk, in the order they were first added."""
+
+        segment_records = [segment.corpus.to_records() for segment in segments]
+
+        chunks_by_title: Dict[str, List[Tuple[Tuple[int, int], Dict[str, Any]]]] = {}
+        for key, (position, row) in live_chunks.items():
+            corpus = segments[position].corpus
+            title_row = int(corpus.chunk_title_ids[row])
+            chunk = segment_records[position][title_row]["chunks"][row - int(corpus.chunk_offsets[title_row])]
+            chunks_by_title.setdefault(key[0], []).append(((position, row), chunk))
+
+        records = []
+        for title in titles:
+            record = {"title": title, "title_embedding": []}
+            if title in live_titles:
+                position, row = live_titles[title]
+                record = {key: value for key, value in segment_records[position][row].items() if key != "chunks"}
+            record["chunks"] = [chunk for _, chunk in sorted(chunks_by_title.get(title, []), key=lambda item: item[0])]
+            records.append(record)
+
+        return records
+
+    def _compact(self) -> None:
+        with self._compaction_lock:
+            with self._write_lock:
+                segments = self._snapshot.segments
+                if len(segments) <= 1:
+                    return
+                state = (dict(self._live_chunks), dict(self._live_titles), list(self._titles))
+                name = self._new_segment_name()
+
+            # Merging and writing the new base segment blocks neither queries nor updates
+            merged = Segment(name, self._merged_records(segments, *state))
+            merged.save(self.directory)
+
+            with self._write_lock:
+                # Updates committed in the meantime are replayed on top of the merged segment
+                new_segments = [merged] + self._snapshot.segments[len(segments):]
+                self._replay(new_segments)
+                self._save_manifest(new_segments)
+
+            for segment in segments:
+                try:
+                    os.remove(os.path.join(self.directory, segment.name))
+                except FileNotFoundError:
+                    pass
+
+            print(f"Compacted {len(segments)} segments into '{name}'")
+
+    def compact(self, wait: bool = True) -> None:
+        """
+        Merge all segments into one base segment.
+
+        Args:
+            wait: Block until the compaction finished; otherwise run it in a background
+                thread (nothing happens if a compaction is already running)
+        """
+
+        if wait:
+            self._compact()
+        elif not self._compaction_lock.locked():
+            threading.Thread(target=self._compact, daemon=True).start()
+
+    # ---- queries ----
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._snapshot.segments)
+
+    @property
+    def chunk_count(self) -> int:
+        return int(sum(mask.sum() for mask in self._snapshot.chunk_masks))
+
+    def search(
+        self,
+        query_embedding: Union[List[float], NDArray[np.float64]],
+        title_top_k: int = 5,
+        chunk_top_percentage: Optional[float] = 0.75,
+        include_titles: bool = True,
+        coarse_candidates: Optional[int] = None,
+        chunk_top_k: Optional[int] = None,
+        where: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+
+        """
+        Find the most similar visible chunks, with the same arguments and result as Corpus.search.
+        """
+
+        snapshot = self._snapshot
+        pairs = [
+            (segment, chunk_mask, title_mask)
+            for segment, chunk_mask, title_mask in zip(snapshot.segments, snapshot.chunk_masks, snapshot.title_masks)
+            if segment.corpus.n_titles or segment.corpus.n_chunks
+        ]
+
+        # The metadata of a title lives in the segment that holds its visible copy
+        if where:
+            pairs = [
+                (segment, chunk_mask, title_mask & segment.corpus.title_mask_where(where))
+                for segment, chunk_mask, title_mask in pairs
+            ]
+            allowed_titles = {
+                segment.corpus.title(row) for segment, _, title_mask in pairs for row in np.flatnonzero(title_mask)
+            }
+
+        top_titles = None
+        if include_titles:
+            query = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if norm == 0:
+                return []
+            query = query / norm
+
+            titles, scores = [], []
+            for segment, _, title_mask in pairs:
+                rows = np.flatnonzero(title_mask)
+                if len(rows):
+                    titles.extend(segment.corpus.title(row) for row in rows)
+                    scores.append(segment.corpus.title_matrix[rows] @ query)
+            if not titles:
+                return []
+            scores = np.concatenate(scores)
+            top_titles = [titles[idx] for idx in np.argsort(-scores, kind='stable')[:title_top_k]]
+
+        results = []
+        for segment, chunk_mask, _ in pairs:
+            corpus = segment.corpus
+            rows = np.flatnonzero(chunk_mask)
+            if where:
+                title_ids = [corpus.string_id(title) for title in allowed_titles]
+                rows = np.intersect1d(rows, corpus.chunk_rows_for_titles(i for i in title_ids if i is not None))
+            if top_titles is not None:
+                title_ids = [corpus.string_id(title) for title in top_titles]
+                rows = np.intersect1d(rows, corpus.chunk_rows_for_titles(i for i in title_ids if i is not None))
+            if len(rows):
+                results.extend(corpus.search(
+                    query_embedding, chunk_top_percentage=chunk_top_percentage, include_titles=False,
+                    coarse_candidates=coarse_candidates, chunk_top_k=chunk_top_k, chunk_rows=rows,
+                ))
+
+        # Merge the segments and remove duplicates based on chunk_text while preserving order
+        results.sort(key=lambda result: -result['similarity'])
+        merged = []
+        seen_texts = set()
+        for result in results:
+            if result['chunk_text'] in seen_texts:
+                continue
+            seen_texts.add(result['chunk_text'])
+            merged.append(result)
+            if chunk_top_k is not None and len(merged) >= chunk_top_k:
+                break
+
+        return merged
@@ -0,0 +1,264 @@
+"""
+Read-only Corpus shared by several worker processes on one node.
+Steps:
+1. A loader process builds the Corpus once and publishes it as a generation directory:
+   every array as a .npy file and the string table as one UTF-8 blob with an offset array.
+2. A CURRENT file names the live generation. It is replaced atomically (os.replace), so a
+   reload publishes a new generation and every worker switches to it on its next search.
+3. Workers attach the generation with np.load(mmap_mode='r'), without copying: the pages are
+   shared through the page cache, so N workers cost one copy of the corpus. Put the
+   directory on a tmpfs (e.g. /dev/shm) to keep it in RAM. LanguagePartitions of an
+   attached corpus only keep the chunk rows of each language, the matrices stay shared.
+4. Strings are decoded when they are read; the text → id map is built only when a filter
+   needs it.
+5. Old generations stay mapped by workers still searching them (removing a mapped file is
+   safe on POSIX) and are removed by the loader, keeping the newest keep_generations.
+
+Publish (loader) and attach (workers):
+    python -m tools.shared_corpus output/json/text_embedding_openai.json --directory /dev/shm/airpods_corpus
+
+    shared = SharedCorpus("/dev/shm/airpods_corpus")
+    results = find_most_similar_chunks(query_embedding, shared.corpus(), title_top_k=1)
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from typing import List, Dict, Any, Union, Optional, Iterator
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .corpus import Corpus
+from .load_save_data import load_json_data
+
+
+CURRENT_FILE = "CURRENT"
+
+# Corpus arrays stored one .npy file each; the coarse matrices are optional
+_ARRAYS = (
+    "title_text_ids",
+    "title_matrix",
+    "title_norms",
+    "chunk_text_ids",
+    "chunk_matrix",
+    "chunk_norms",
+    "chunk_offsets",
+    "chunk_title_ids",
+    "source_offsets",
+    "source_title_ids",
+    "chunk_language_ids",
+)
+_OPTIONAL_ARRAYS = ("title_coarse_matrix", "chunk_coarse_matrix")
+
+
+class MappedStrings:
+    """String table backed by a memory-mapped UTF-8 blob, decoded on access."""
+
+    def __init__(self, blob: NDArray[np.uint8], offsets: NDArray[np.int64]):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, string_id: int) -> str:
+        start, end = self.offsets[string_id], self.offsets[string_id + 1]
+        return bytes(self.blob[start:end]).decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[string_id] for string_id in range(len(self)))
+
+
+class _LazyStringIds:
+    """Text → string id map of a MappedStrings, built the first time it is used."""
+
+    def __init__(self, strings: MappedStrings):
+        self._strings = strings
+        self._ids: Optional[Dict[str, int]] = None
+        self._lock = threading.Lock()
+
+    def get(self, text: str, default: Optional[int] = None) -> Optional[int]:
+        if self._ids is None:
+            with self._lock:
+                if self._ids is None:
+                    ids: Dict[str, int] = {}
+                    for string_id, string in enumerate(self._strings):
+                        ids.setdefault(string, string_id)
+                    self._ids = ids
+        return self._ids.get(text, default)
+
+
+def _load(file_path: str) -> NDArray[Any]:
+    try:
+        return np.load(file_path, mmap_mode='r')
+    except ValueError:
+        # Empty arrays can't be memory-mapped
+        return np.load(file_path)
+
+
+def _write_current(directory: str, current: Dict[str, Any]) -> None:
+    temp_path = os.path.join(directory, f"{CURRENT_FILE}.tmp")
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(current, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(directory, CURRENT_FILE))
+
+
+def read_current(directory: str) -> Optional[Dict[str, Any]]:
+    """The CURRENT record ({"generation", "published_at", "chunks"}), or None before the first publish."""
+
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def publish_corpus(
+    data_with_embeddings: Union[List[Dict[str, Any]], Corpus],
+    directory: str,
+    keep_generations: int = 2
+) -> str:
+
+    """
+    Write the corpus as a new generation and make it the current one.
+
+    Args:
+        data_with_embeddings: List of data items with their embeddings, or a Corpus
+        directory: Shared directory (a tmpfs such as /dev/shm keeps the pages in RAM)
+        keep_generations: Number of generations kept, the new one included
+
+    Returns:
+        str: Name of the published generation
+    """
+
+    corpus = data_with_embeddings if isinstance(data_with_embeddings, Corpus) else Corpus.from_records(data_with_embeddings)
+    # Attached corpora are read-only, so missing chunk languages are filled in before writing
+    corpus.detect_chunk_languages()
+    os.makedirs(directory, exist_ok=True)
+
+    generation = f"gen_{time.time_ns()}"
+    # Written under a temporary name and renamed, so a half written generation is never visible
+    temp_directory = os.path.join(directory, f".{generation}.tmp")
+    os.makedirs(temp_directory)
+
+    for name in _ARRAYS:
+        np.save(os.path.join(temp_directory, f"{name}.npy"), np.ascontiguousarray(getattr(corpus, name)))
+    for name in _OPTIONAL_ARRAYS:
+        if getattr(corpus, name) is not None:
+            np.save(os.path.join(temp_directory, f"{name}.npy"), np.ascontiguousarray(getattr(corpus, name)))
+    for field, values in corpus.title_fields.items():
+        np.save(os.path.join(temp_directory, f"title_field_{field}.npy"), values)
+
+    offsets = np.zeros(len(corpus.strings) + 1, dtype=np.int64)
+    with open(os.path.join(temp_directory, "strings.bin"), 'wb') as f:
+        for string_id, string in enumerate(corpus.strings):
+            encoded = string.encode('utf-8')
+            f.write(encoded)
+            offsets[string_id + 1] = offsets[string_id] + len(encoded)
+    np.save(os.path.join(temp_directory, "string_offsets.npy"), offsets)
+
+    os.rename(temp_directory, os.path.join(directory, generation))
+    _write_current(directory, {"generation": generation, "published_at": time.time(), "chunks": corpus.n_chunks})
+
+    generations = sorted(name for name in os.listdir(directory) if name.startswith("gen_"))
+    for old in generations[:max(0, len(generations) - keep_generations)]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+    print(f"Published {corpus.n_chunks} chunks as '{generation}' in '{directory}'")
+    return generation
+
+
+def attach_corpus(directory: str, generation: Optional[str] = None) -> Corpus:
+    """
+    Map a published generation (default is the current one) as a read-only Corpus.
+
+    Raises:
+        FileNotFoundError: If nothing was published in directory
+    """
+
+    if generation is None:
+        current = read_current(directory)
+        if current is None:
+            raise FileNotFoundError(f"No corpus published in '{directory}'")
+        generation = current["generation"]
+    path = os.path.join(directory, generation)
+
+    corpus = Corpus()
+    for name in _ARRAYS:
+        setattr(corpus, name, _load(os.path.join(path, f"{name}.npy")))
+    for name in _OPTIONAL_ARRAYS:
+        if os.path.exists(os.path.join(path, f"{name}.npy")):
+            setattr(corpus, name, _load(os.path.join(path, f"{name}.npy")))
+    corpus.title_fields = {
+        file_name[len("title_field_"):-len(".npy")]: _load(os.path.join(path, file_name))
+        for file_name in sorted(os.listdir(path))
+        if file_name.startswith("title_field_")
+    }
+
+    blob_path = os.path.join(path, "strings.bin")
+    blob = np.memmap(blob_path, dtype=np.uint8, mode='r') if os.path.getsize(blob_path) else np.zeros(0, dtype=np.uint8)
+    corpus.strings = MappedStrings(blob, _load(os.path.join(path, "string_offsets.npy")))
+    corpus._string_ids = _LazyStringIds(corpus.strings)
+    return corpus
+
+
+class SharedCorpus:
+    """
+    Worker side handle of a published corpus that follows reloads.
+
+    corpus() checks CURRENT (one stat call) and attaches the new generation when it
+    changed; a search that already holds the previous Corpus finishes on it.
+
+    Args:
+        directory: Directory the loader publishes to
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.generation: Optional[str] = None
+        self._corpus: Optional[Corpus] = None
+        self._current_mtime: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def corpus(self) -> Corpus:
+        mtime = os.stat(os.path.join(self.directory, CURRENT_FILE)).st_mtime_ns
+        with self._lock:
+            if mtime != self._current_mtime:
+                for attempt in range(2):
+                    generation = read_current(self.directory)["generation"]
+                    if generation == self.generation:
+                        break
+                    try:
+                        self._corpus = attach_corpus(self.directory, generation)
+                        self.generation = generation
+                        break
+                    except FileNotFoundError:
+                        # Two reloads in a row removed the generation read from CURRENT
+                        if attempt:
+                            raise
+                self._current_mtime = mtime
+            return self._corpus
+
+    def search(self, query_embedding: Union[List[float], NDArray[np.float64]], **search_options: Any) -> List[Dict[str, Any]]:
+        """Corpus.search on the current generation."""
+
+        return self.corpus().search(query_embedding, **search_options)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish an embedded data file as the shared read-only corpus.")
+    parser.add_argument("data_file", help="File written by process_and_embed_data")
+    parser.add_argument("--directory", default="/dev/shm/airpods_corpus", help="Shared directory the workers attach to")
+    parser.add_argument("--keep-generations", type=int, default=2)
+    args = parser.parse_args()
+
+    data_with_embeddings = load_json_data(args.data_file)
+    if not data_with_embeddings:
+        raise SystemExit(f"Can't load embedded data from '{args.data_file}'")
+    publish_corpus(data_with_embeddings, args.directory, args.keep_generations)
@@ -11,7 +11,10 @@ from typing import List, Dict, Any, Union, Optional
 import numpy as np
 from numpy.typing import NDArray
 
+from .corpus import Corpus
+from .language_partitions import LanguagePartitions
 from .load_save_data import load_json_data
+from .parallel_similarity import process_questions_similarity_parallel
 
 
 def calculate_cosine_similarity(
@@ -53,66 +56,14 @@ def calculate_cosine_similarity(
     return float(similarity)
 
 
-
-def _calculate_similarities_for_items(
-    query_embedding: NDArray[np.float64],
-    items: List[Dict[str, Any]],
-    embedding_key: str,
-    text_key: str,
-    top_k: Optional[int] = None,
-    top_percentage: Optional[float] = None
-) -> List[Dict[str, Any]]:
-    
-    """
-    Calculate similarities between a query embedding and a list of items.
-    
-    Args:
-        query_embedding: The embedding vector for the query
-        items: List of items to compare against
-        embedding_key: The key in each item dict that contains the embedding
-        text_key: The key in each item dict that contains the text
-        top_k: Number of top results to return (if specified)
-        top_percentage: Minimum similarity threshold (if specified)
-        
-    Returns:
-        List[Dict]: A list of dicts containing the text and similarity score
-    """
-
-    similarities = []
-    
-    for item in items:
-        embedding = item.get(embedding_key)
-        text = item.get(text_key)
-        
-        if embedding is not None and text is not None:
-            try:
-                similarity = calculate_cosine_similarity(query_embedding, embedding)
-                similarities.append({
-                    text_key: text,
-                    'similarity': similarity
-                })
-            except (ValueError, Exception) as e:
-                print(f"Warning : Calculate cosine similarity Error - {e}")
-                continue
-    
-    # Sort by similarity in descending order
-    similarities.sort(key=lambda x: x['similarity'], reverse=True)
-    
-    # Apply filtering based on parameters
-    if top_k is not None:
-        return similarities[:top_k]
-    elif top_percentage is not None:
-        return [item for item in similarities if item['similarity'] >= top_percentage]
-    else:
-        return similarities
-
-
 def find_most_similar_chunks(
     query_embedding: Union[List[float], NDArray[np.float64]], 
-    data_with_embeddings: List[Dict[str, Any]], 
+    data_with_embeddings: Union[List[Dict[str, Any]], Corpus], 
     title_top_k: int = 5,
     chunk_top_percentage: float = 0.75,
-    include_titles: bool = True
+    include_titles: bool = True,
+    coarse_candidates: Optional[int] = None,
+    where: Optional[Dict[str, Any]] = None
 ) -> List[Dict[str, Any]]:
     
     """
@@ -120,10 +71,15 @@ def find_most_similar_chunks(
     
     Args:
         query_embedding: The embedding vector for the query (list or numpy array)
-        data_with_embeddings: List of data items containing chunks and their embeddings
+        data_with_embeddings: List of data items containing chunks and their embeddings, or a Corpus;
+            a list is converted on every call, so build the Corpus once to search it many times
         title_top_k: Number of top similar titles to consider (default is 5)
         chunk_top_percentage: Minimum similarity threshold for chunks (default is 0.75)
         include_titles: Whether to include title similarity in the calculation (default is True)
+        coarse_candidates: If specified, scan the coarse embeddings first and rescore only
+            this many titles / chunks with the full embeddings (default is None, exact scan)
+        where: Metadata filter in the ChromaDB syntax, e.g. {"product": "AirPods Pro"};
+            only matching titles and their chunks are scored (default is None, no filter)
         
     Returns:
         List[Dict]: A list of similar chunks with similarity >= chunk_top_percentage
@@ -135,73 +91,29 @@ def find_most_similar_chunks(
     if not data_with_embeddings:
         raise ValueError("Data with embeddings is empty or None")
     
-    # Convert query embedding to numpy array
-    query_array = np.array(query_embedding, dtype=np.float64)
+    corpus = data_with_embeddings if isinstance(data_with_embeddings, Corpus) else Corpus.from_records(data_with_embeddings)
+    if corpus.n_chunks == 0:
+        return []
     
-    all_similarities = []
-    
-    # Calculate title similarities if required
-    if include_titles:
-        title_similarities = _calculate_similarities_for_items(
-            query_array,
-            data_with_embeddings,
-            'title_embedding',
-            'title',
-            top_k=title_top_k
-        )
-        
-        # Find the items corresponding to the most similar titles
-        top_titles = [item['title'] for item in title_similarities]
-        
-        # Filter data items that match the top similar titles
-        relevant_items = [
-            item for item in data_with_embeddings 
-            if item.get('title') in top_titles
-        ]
-        
-        # Extract chunks only from the relevant items (titles with high similarity)
-        chunk_list = []
-        for item in relevant_items:
-            chunks = item.get('chunks', [])
-            chunk_list.extend(chunks)
-    else:
-        # If not including titles, search all chunks
-        chunk_list = []
-        for item in data_with_embeddings:
-            chunks = item.get('chunks', [])
-            chunk_list.extend(chunks)
-    
-    # Calculate chunk similarities from the filtered chunk list
-    # Use top_percentage to filter chunks with similarity >= chunk_top_percentage
-    chunk_similarities = _calculate_similarities_for_items(
-        query_array,
-        chunk_list,
-        'chunk_embedding',
-        'chunk_text',
-        top_percentage=chunk_top_percentage
+    # Title filtering, threshold filtering, sorting and removing duplicate chunk_text
+    # all run on the embedding matrices of the corpus
+    return corpus.search(
+        query_embedding,
+        title_top_k=title_top_k,
+        chunk_top_percentage=chunk_top_percentage,
+        include_titles=include_titles,
+        coarse_candidates=coarse_candidates,
+        where=where,
     )
-    all_similarities.extend(chunk_similarities)
-    
-    # According to similarity sort and return filtered results
-    all_similarities.sort(key=lambda x: x['similarity'], reverse=True)
-    
-    # Remove duplicates based on chunk_text while preserving order
-    seen_texts = set()
-    unique_similarities = []
-    for item in all_similarities:
-        text = item.get('chunk_text', '')
-        if text and text not in seen_texts:
-            seen_texts.add(text)
-            unique_similarities.append(item)
-    
-    return unique_similarities
 
 
 def process_questions_similarity(
     questions_with_embeddings: List[Dict[str, Any]],
-    data_with_embeddings: List[Dict[str, Any]],
+    data_with_embeddings: Union[List[Dict[str, Any]], Corpus],
     title_top_k: int = 5,
-    chunk_top_percentage: float = 0.75
+    chunk_top_percentage: float = 0.75,
+    coarse_candidates: Optional[int] = None,
+    route_by_language: bool = False
 ) -> Dict[str, List[Dict[str, Any]]]:
     
     """
@@ -209,15 +121,22 @@ def process_questions_similarity(
     
     Args:
         questions_with_embeddings: List of questions with their embeddings
-        data_with_embeddings: List of data items with their embeddings
+        data_with_embeddings: List of data items with their embeddings, or a Corpus
         title_top_k: Number of top similar titles to consider (default is 5)
         chunk_top_percentage: Minimum similarity threshold for chunks (default is 0.75)
+        coarse_candidates: Shortlist size for coarse-to-fine search (default is None, exact scan)
+        route_by_language: Search each question only in the chunks of its detected language,
+            across languages when the detection is not confident (default is False)
         
     Returns:
         Dict: A mapping of questions to their most similar content
     """
     
     results = {}
+
+    # Build the columnar corpus once for all questions
+    corpus = data_with_embeddings if isinstance(data_with_embeddings, Corpus) else Corpus.from_records(data_with_embeddings)
+    partitions = LanguagePartitions(corpus) if route_by_language else None
     
     for question_item in questions_with_embeddings:
         question = question_item.get('question')
@@ -228,12 +147,22 @@ def process_questions_similarity(
             continue
         
         try:
-            top_similar_chunks = find_most_similar_chunks(
-                question_embedding, 
-                data_with_embeddings, 
-                title_top_k,
-                chunk_top_percentage,
-            )
+            if partitions is not None:
+                top_similar_chunks = partitions.search(
+                    question_embedding,
+                    question,
+                    title_top_k=title_top_k,
+                    chunk_top_percentage=chunk_top_percentage,
+                    coarse_candidates=coarse_candidates,
+                )
+            else:
+                top_similar_chunks = find_most_similar_chunks(
+                    question_embedding, 
+                    corpus, 
+                    title_top_k,
+                    chunk_top_percentage,
+                    coarse_candidates=coarse_candidates,
+                )
             results[question] = top_similar_chunks
         except Exception as e:
             print(f"Error: Error occurs when process question : '{question}' - {e}")
@@ -276,10 +205,29 @@ def print_similarity_results(
         print()
 
 
-def calculate(question_file: str, data_file:str, chunk_top_percentage: float) -> list:
+def calculate(
+    question_file: str,
+    data_file:str,
+    chunk_top_percentage: float,
+    coarse_candidates: Optional[int] = None,
+    workers: Optional[int] = None,
+    route_by_language: bool = False
+) -> list:
     """
     Main function: Load data, calculate similarities, and display results.
+
+    When workers is given, the questions are scored by a process pool over
+    shared-memory shards of the chunk matrix instead of one by one.
+    When route_by_language is set, each question is searched in the language
+    partition it is written in.
+
+    Raises:
+        ValueError: If workers is combined with coarse_candidates or route_by_language,
+            which only the single-process search supports
     """
+
+    if workers is not None and (coarse_candidates is not None or route_by_language):
+        raise ValueError("workers can't be combined with coarse_candidates or route_by_language")
     
     try:
         print("Loading JSON file...")
@@ -298,11 +246,22 @@ def calculate(question_file: str, data_file:str, chunk_top_percentage: float) ->
         print(f"Successfully loaded {len(questions_with_embeddings)} questions")
         
         print("\nStart similarity calculation...")
+        if workers is not None:
+            return process_questions_similarity_parallel(
+                questions_with_embeddings,
+                data_with_embeddings,
+                title_top_k=1,
+                chunk_top_percentage=chunk_top_percentage,
+                workers=workers
+            )
+
         results = process_questions_similarity(
             questions_with_embeddings,
             data_with_embeddings,
             title_top_k=1,
-            chunk_top_percentage=chunk_top_percentage
+            chunk_top_percentage=chunk_top_percentage,
+            coarse_candidates=coarse_candidates,
+            route_by_language=route_by_language
         )
         
         return results
@@ -0,0 +1,179 @@
+"""
+Source metadata of scraped pages and chunks, stored with the embeddings and used as search filters.
+Steps:
+1. Take the url the scraper recorded for every page.
+2. Read the language from the locale segment of the url (e.g. /zh-tw/guide/ → "zh-tw").
+3. Detect the product model named in the page title (e.g. "AirPods Pro"); pages about the
+   whole product line get "AirPods".
+4. Identify every chunk text by a content hash, so the same text can be recognized across
+   re-scrapes and collections.
+5. Detect the language of every chunk with langid (normalized probabilities, restricted to
+   the languages of the manual), falling back to the page locale when the text is ambiguous.
+6. A deduplicated chunk belongs to several pages, while a Chroma metadata value is a single
+   scalar; every page value is therefore also stored as a boolean key ("product:AirPods Pro"),
+   and source_where rewrites a where filter to match those keys too.
+"""
+
+import hashlib
+import re
+import threading
+from typing import Dict, Any, Iterable, Tuple, Optional
+
+from langid.langid import LanguageIdentifier, model as langid_model
+
+
+# Fields kept per page (title level); "title" itself is always available as a filter too
+PAGE_FIELDS = ("url", "product", "language")
+
+# Longest names first, so "AirPods Pro 2" is not reported as "AirPods Pro"
+PRODUCTS = (
+    "AirPods Pro 3",
+    "AirPods Pro 2",
+    "AirPods Pro",
+    "AirPods Max",
+    "AirPods 4",
+    "AirPods 3",
+    "AirPods 2",
+)
+DEFAULT_PRODUCT = "AirPods"
+
+# Languages the manual is scraped in, as langid codes
+LANGUAGES = ("en", "zh")
+
+_LOCALE_PATTERN = re.compile(r'/([a-z]{2}(?:-[a-z]{2,4})?)/guide/', re.IGNORECASE)
+
+
+def language_from_url(url: str) -> str:
+    """Locale of an Apple support guide url, or "" if it has none."""
+
+    match = _LOCALE_PATTERN.search(url or "")
+    return match.group(1).lower() if match else ""
+
+
+def product_from_title(title: str) -> str:
+    """Product model named in a page title, DEFAULT_PRODUCT if none is named."""
+
+    normalized = re.sub(r'\s+', ' ', title or "")
+    for product in PRODUCTS:
+        if re.search(re.escape(product) + r'(?![0-9A-Za-z])', normalized, re.IGNORECASE):
+            return product
+    return DEFAULT_PRODUCT
+
+
+def page_metadata(page: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Metadata of a scraped page ({'title', 'url', 'content'}).
+
+    Returns:
+        Dict: {"url", "product", "language"}, empty strings when unknown
+    """
+
+    url = page.get('url', '') or ''
+    return {
+        "url": url,
+        "product": product_from_title(page.get('title', '')),
+        "language": language_from_url(url),
+    }
+
+
+# Fields a where filter may name that describe the source page of a chunk
+SOURCE_FIELDS = ("title",) + PAGE_FIELDS
+
+
+def source_key(field: str, value: str) -> str:
+    """Boolean metadata key marking a chunk as coming from a page with this field value."""
+
+    return f"{field}:{value}"
+
+
+def source_where(where: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Rewrite a ChromaDB where filter so that page conditions match every source page of a chunk.
+
+    {"product": "AirPods Pro"} becomes {"$or": [{"product": "AirPods Pro"}, {"product:AirPods Pro": True}]},
+    and $in conditions are expanded the same way. This matches the local engine, which finds
+    a deduplicated chunk through any of its source titles. $ne / $nin stay on the canonical
+    page's value; other fields (e.g. "chunk_language") are left unchanged.
+    """
+
+    if not where:
+        return where
+
+    conditions = []
+    for field, condition in where.items():
+        if field in ("$and", "$or"):
+            conditions.append({field: [source_where(sub_where) for sub_where in condition]})
+            continue
+
+        operator, operand = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+        if field not in SOURCE_FIELDS or operator not in ("$eq", "$in"):
+            conditions.append({field: condition})
+            continue
+
+        values = [operand] if operator == "$eq" else list(operand)
+        conditions.append({"$or": [{field: condition}] + [{source_key(field, value): True} for value in values]})
+
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def content_hash(text: str) -> str:
+    """sha256 of a chunk text."""
+
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+_identifiers: Dict[Tuple[str, ...], LanguageIdentifier] = {}
+_identifiers_lock = threading.Lock()
+
+
+def locale_language(locale: str) -> str:
+    """langid code of a locale, e.g. "zh-tw" → "zh"."""
+
+    return (locale or "").split("-")[0].lower()
+
+
+def detect_language(text: str, languages: Iterable[str] = LANGUAGES) -> Tuple[str, float]:
+    """
+    Detect the language of a text among the given languages.
+
+    Args:
+        text: Text to classify
+        languages: Candidate langid codes
+
+    Returns:
+        Tuple[str, float]: langid code and its probability, normalized over the candidates
+    """
+
+    languages = tuple(sorted(languages))
+    identifier = _identifiers.get(languages)
+    if identifier is None:
+        with _identifiers_lock:
+            identifier = _identifiers.get(languages)
+            if identifier is None:
+                # Loading the model takes a while, so each language set is loaded once
+                identifier = LanguageIdentifier.from_modelstring(langid_model, norm_probs=True)
+                identifier.set_languages(list(languages))
+                _identifiers[languages] = identifier
+    language, probability = identifier.classify(text)
+    return language, float(probability)
+
+
+def chunk_language(text: str, page_language: str = "", min_confidence: float = 0.8) -> str:
+    """
+    Language of a chunk, the page locale's language when detection is not confident.
+
+    Args:
+        text: Chunk text
+        page_language: Locale of the page the chunk comes from (e.g. "zh-tw")
+        min_confidence: Minimum detection probability to trust langid
+
+    Returns:
+        str: langid code, "" for an empty text
+    """
+
+    if not (text or "").strip():
+        return ""
+    language, confidence = detect_language(text)
+    if confidence < min_confidence and locale_language(page_language):
+        return locale_language(page_language)
+    return language
@@ -0,0 +1,257 @@
+"""
+Streaming ingest: scrape → clean → chunk → embed with the stages running at the same time.
+Steps:
+1. A scraper thread yields pages one by one (iter_airpods_manual) into a bounded queue.
+2. A chunker thread cleans and chunks each page as soon as it arrives and cuts the texts
+   (each title followed by its chunks, the same order embed_chunked_data uses) into batches.
+3. Embedding worker threads send every batch as soon as it is full, with retries and the
+   same checkpoint format as embed_in_batches, so an interrupted ingest resumes.
+4. When the last batch returns, the embeddings are mapped back through the Corpus.
+
+The queues are bounded, so a fast stage waits for a slow one instead of buffering without
+limit, and the total time approaches that of the slowest stage rather than the sum.
+Near-duplicate removal needs every chunk at once and is not part of the stream.
+"""
+
+import argparse
+import importlib
+import queue
+import threading
+import time
+from typing import List, Dict, Any, Callable, Iterable, Optional
+
+from .clean_data import preprocess_text
+from .corpus import Corpus
+from .embedding_jobs import BatchCheckpoint, embed_with_retry, clear_checkpoint
+from .load_save_data import save_to_json
+
+
+_DONE = object()
+
+
+class _Stop(Exception):
+    """Raised in a stage thread when another stage failed."""
+
+
+def _put(target: queue.Queue, item: Any, stop: threading.Event) -> None:
+    # A blocked put must notice when the consumer died
+    while True:
+        if stop.is_set():
+            raise _Stop()
+        try:
+            target.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(source: queue.Queue, stop: threading.Event) -> Any:
+    while True:
+        if stop.is_set():
+            raise _Stop()
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+
+def stream_ingest(
+    pages: Iterable[Dict[str, Any]],
+    chunk_page: Callable[[Dict[str, Any]], Dict[str, Any]],
+    embed_batch: Callable[[List[str]], List[List[float]]],
+    model_name: str,
+    batch_size: int = 100,
+    embed_workers: int = 2,
+    queue_size: int = 16,
+    delay_between_batches: float = 0.0,
+    checkpoint_path: Optional[str] = None,
+    coarse_dim: Optional[int] = None,
+    max_retries: int = 5
+) -> List[Dict[str, Any]]:
+
+    """
+    Clean, chunk and embed pages while they are still being fetched.
+
+    Args:
+        pages: Iterable of fetched pages ({'title', 'content', ...}), e.g. iter_airpods_manual(url)
+        chunk_page: Function splitting one cleaned page into {'title', 'chunks'}
+        embed_batch: Function embedding one batch of texts
+        model_name: Embedding model name, part of the checkpoint key
+        batch_size: Number of texts sent per API request
+        embed_workers: Number of embedding requests in flight
+        queue_size: Capacity of each queue between two stages
+        delay_between_batches: Pause of each embedding worker between two requests
+        checkpoint_path: JSON Lines file recording completed batches (None disables checkpointing);
+            the caller removes it with clear_checkpoint once the returned data is saved
+        coarse_dim: If given, also store a reduced embedding with this many dimensions
+        max_retries: Number of retries for a batch failing with a transient error before giving up
+
+    Returns:
+        List[Dict]: Data with embeddings in the format of process_and_embed_data
+
+    Raises:
+        Exception: The first error raised by a stage; the other stages are stopped.
+            Completed batches stay in the checkpoint.
+    """
+
+    page_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    batch_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    chunked_data: List[Dict[str, Any]] = []
+    # Batches are numbered in text order; the embeddings of batch i land in embedded[i]
+    embedded: Dict[int, List[List[float]]] = {}
+    busy = {"scrape": 0.0, "chunk": 0.0, "embed": 0.0}
+    busy_lock = threading.Lock()
+    checkpoint = BatchCheckpoint(checkpoint_path, model_name)
+
+    def stage(name: str, body: Callable[[], None]) -> threading.Thread:
+        def run() -> None:
+            try:
+                body()
+            except _Stop:
+                pass
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+        return threading.Thread(target=run, name=f"ingest-{name}", daemon=True)
+
+    def scrape() -> None:
+        iterator = iter(pages)
+        while True:
+            start = time.perf_counter()
+            page = next(iterator, _DONE)
+            busy["scrape"] += time.perf_counter() - start
+            if page is _DONE:
+                break
+            _put(page_queue, page, stop)
+        _put(page_queue, _DONE, stop)
+
+    def chunk() -> None:
+        batch: List[str] = []
+        batch_index = 0
+        while True:
+            page = _get(page_queue, stop)
+            if page is _DONE:
+                break
+
+            start = time.perf_counter()
+            cleaned = dict(page, content=preprocess_text(page.get('content', '')))
+            item = chunk_page(cleaned)
+            chunked_data.append(item)
+            texts = ([item['title']] if item.get('title') else []) + item.get('chunks', [])
+            busy["chunk"] += time.perf_counter() - start
+
+            for text in texts:
+                batch.append(text)
+                if len(batch) == batch_size:
+                    _put(batch_queue, (batch_index, batch), stop)
+                    batch, batch_index = [], batch_index + 1
+
+        if batch:
+            _put(batch_queue, (batch_index, batch), stop)
+        for _ in range(embed_workers):
+            _put(batch_queue, _DONE, stop)
+
+    def embed() -> None:
+        requested = False
+        while True:
+            item = _get(batch_queue, stop)
+            if item is _DONE:
+                return
+            batch_index, batch = item
+
+            embeddings = checkpoint.get(batch)
+            if embeddings is None:
+                # To avoid hitting the per-minute request limit, wait between two requests
+                if requested and delay_between_batches > 0:
+                    time.sleep(delay_between_batches)
+                start = time.perf_counter()
+                embeddings = embed_with_retry(embed_batch, batch, max_retries)
+                with busy_lock:
+                    busy["embed"] += time.perf_counter() - start
+                requested = True
+                checkpoint.add(batch, embeddings)
+            embedded[batch_index] = embeddings
+
+    started = time.perf_counter()
+    threads = [stage("scrape", scrape), stage("chunk", chunk)]
+    threads += [stage(f"embed-{i}", embed) for i in range(embed_workers)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        stop.set()
+        checkpoint.close()
+
+    if errors:
+        print(f"Completed batches are kept in '{checkpoint_path}', run again to resume.")
+        raise errors[0]
+
+    all_embeddings = [embedding for batch_index in sorted(embedded) for embedding in embedded[batch_index]]
+    processed_data = Corpus.from_embeddings(chunked_data, all_embeddings, coarse_dim).to_records()
+
+    print(
+        f"Ingested {len(chunked_data)} pages / {len(all_embeddings)} texts in {time.perf_counter() - started:.1f} sec "
+        f"(busy: scrape {busy['scrape']:.1f}, chunk {busy['chunk']:.1f}, "
+        f"embed {busy['embed']:.1f} over {embed_workers} workers)"
+    )
+    return processed_data
+
+
+def stream_ingest_manual(
+    url: str,
+    llm: str = "openai",
+    embed_workers: int = 2,
+    queue_size: int = 16,
+    coarse_dim: Optional[int] = None
+) -> List[Dict[str, Any]]:
+
+    """
+    Stream the AirPods manual at url into embedded data with the given provider.
+
+    Args:
+        url: Table of contents page of the manual
+        llm: Embedding provider, "openai" or "gemini"
+        embed_workers: Number of embedding requests in flight
+        queue_size: Capacity of each queue between two stages
+        coarse_dim: If given, also store a reduced embedding with this many dimensions
+
+    Returns:
+        List[Dict]: Data with embeddings in the format of process_and_embed_data
+    """
+
+    from .airpods_manual_fetch import iter_airpods_manual
+
+    embedding_module = importlib.import_module(f"tools.generate_embedding_{llm}")
+    return stream_ingest(
+        iter_airpods_manual(url),
+        embedding_module.chunk_page,
+        embedding_module.embed_batch,
+        model_name=embedding_module.Model_Name,
+        batch_size=embedding_module.Batch_Size,
+        embed_workers=embed_workers,
+        queue_size=queue_size,
+        delay_between_batches=embedding_module.Delay_Between_Batches,
+        checkpoint_path=embedding_module.Checkpoint_Path,
+        coarse_dim=coarse_dim,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape, chunk and embed the AirPods manual as a stream.")
+    parser.add_argument("--url", default="https://support.apple.com/zh-tw/guide/airpods/welcome/web")
+    parser.add_argument("--llm", default="openai", choices=["openai", "gemini"])
+    parser.add_argument("--embed-workers", type=int, default=2)
+    parser.add_argument("--coarse-dim", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Default is output/json/text_embedding_<llm>.json")
+    args = parser.parse_args()
+
+    data = stream_ingest_manual(args.url, args.llm, args.embed_workers, coarse_dim=args.coarse_dim)
+    save_to_json(data, args.output or f"output/json/text_embedding_{args.llm}.json")
+
+    # The embeddings are saved, the checkpoint is no longer needed
+    clear_checkpoint(importlib.import_module(f"tools.generate_embedding_{args.llm}").Checkpoint_Path)
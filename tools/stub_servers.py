@@ -0,0 +1,475 @@
+"""
+Local stand-ins for the upstreams of the async query pipeline, for load and behaviour checks.
+Steps:
+1. StubOpenAIServer serves POST /embeddings and /chat/completions in the OpenAI format
+   on 127.0.0.1, with a fixed latency per request. Embeddings are derived from the text,
+   so the same text always gets the same vector.
+2. StubCollection answers query() like a Chroma collection from a few fixed documents,
+   with a fixed latency, from any thread.
+3. Both record every request and the peak number of requests in flight.
+4. check_async_pipeline runs AsyncQueryPipeline against them and checks the concurrency
+   bound of every upstream, the admission bound of ask_many, the embedding micro-batches
+   and the rate limit.
+5. check_embedding_batcher checks EmbeddingBatcher alone: coalescing, identical texts
+   sent once, every caller getting its own vector, and no caller left waiting when a
+   batch fails or is cancelled.
+6. check_bulk_resume interrupts a bulk_answer job, tears its last line and resumes it.
+
+Run with:
+    python -m tools.stub_servers serve --port 8000   # stand-in LLM server for --api-base
+    python -m tools.stub_servers check-pipeline
+    python -m tools.stub_servers check-batcher
+    python -m tools.stub_servers check-bulk-resume
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from aiohttp import web
+
+
+STUB_EMBEDDING_MODEL = "stub-embedding"
+STUB_DIMENSION = 8
+
+
+def stub_embedding(text: str, dimension: int = STUB_DIMENSION) -> List[float]:
+    """Deterministic unit-length vector of a text."""
+
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).normal(size=dimension)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class UpstreamStats:
+    """Requests and in-flight peak of one stub upstream, safe to update from several threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.batch_sizes: List[int] = []
+        self.started_at: List[float] = []
+
+    def enter(self, batch_size: int = 1) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.requests += 1
+            self.batch_sizes.append(batch_size)
+            self.started_at.append(time.monotonic())
+
+    def leave(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+
+class StubOpenAIServer:
+    """
+    OpenAI compatible embedding and chat server on a free local port.
+
+        async with StubOpenAIServer(latency=0.05) as server:
+            pipeline = AsyncQueryPipeline(collection, api_key="stub", api_base=server.api_base)
+
+    Args:
+        latency: Seconds every request takes
+        fail_chat_requests: Number of first chat requests answered with HTTP 500
+    """
+
+    def __init__(self, latency: float = 0.02, fail_chat_requests: int = 0):
+        self.latency = latency
+        self.fail_chat_requests = fail_chat_requests
+        self.embeddings = UpstreamStats()
+        self.chat = UpstreamStats()
+        self.chat_prompts: List[str] = []
+        self.port: Optional[int] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def _embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        self.embeddings.enter(len(texts))
+        try:
+            await asyncio.sleep(self.latency)
+            return web.json_response({
+                "object": "list",
+                "model": body.get("model"),
+                "data": [
+                    {"object": "embedding", "index": index, "embedding": stub_embedding(text)}
+                    for index, text in enumerate(texts)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        finally:
+            self.embeddings.leave()
+
+    async def _chat(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        self.chat.enter()
+        try:
+            await asyncio.sleep(self.latency)
+            if self.chat.requests <= self.fail_chat_requests:
+                return web.json_response({"error": {"message": "Stub failure", "type": "server_error"}}, status=500)
+            self.chat_prompts.append(prompt)
+            return web.json_response({
+                "object": "chat.completion",
+                "model": body.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f"stub answer {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]}"},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+        finally:
+            self.chat.leave()
+
+    async def start(self, port: int = 0) -> None:
+        app = web.Application()
+        app.router.add_post("/v1/embeddings", self._embeddings)
+        app.router.add_post("/v1/chat/completions", self._chat)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> "StubOpenAIServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+
+class StubCollection:
+    """
+    In-memory stand-in of a Chroma collection, stamped with the stub embedding model.
+
+    Args:
+        documents: Chunk texts returned by query (default is a few fixed AirPods chunks)
+        latency: Seconds every query takes (blocking, like Chroma)
+    """
+
+    name = "stub_collection"
+    metadata = {"embedding_provider": "openai", "embedding_model": STUB_EMBEDDING_MODEL}
+
+    def __init__(self, documents: Optional[List[str]] = None, latency: float = 0.02):
+        self.documents = documents or [
+            "打開充電盒的蓋子，將 AirPods 靠近 iPhone，然後點一下「連線」。",
+            "按住充電盒背面的設定按鈕約 15 秒，直到狀態燈號閃爍琥珀色再閃爍白色。",
+            "打開充電盒的蓋子並靠近 iPhone，即可在螢幕上看到 AirPods 的電量。",
+        ]
+        self.latency = latency
+        self.queries = UpstreamStats()
+        self._matrix = np.array([stub_embedding(document) for document in self.documents])
+
+    def count(self) -> int:
+        return len(self.documents)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 1, where: Optional[dict] = None, **_: Any) -> Dict[str, Any]:
+        self.queries.enter()
+        try:
+            time.sleep(self.latency)
+            scores = self._matrix @ np.asarray(query_embeddings[0])
+            rows = np.argsort(-scores, kind='stable')[:n_results]
+            return {
+                "ids": [[f"chunk_{row}" for row in rows]],
+                "documents": [[self.documents[row] for row in rows]],
+                "metadatas": [[{"title": "AirPods", "chunk_index": int(row)} for row in rows]],
+                # Squared euclidean distance of unit vectors, as Chroma's default "l2" space
+                "distances": [[float(2 - 2 * scores[row]) for row in rows]],
+            }
+        finally:
+            self.queries.leave()
+
+
+async def check_async_pipeline(
+    questions: int = 200,
+    latency: float = 0.02,
+    embedding_concurrency: int = 3,
+    vector_store_concurrency: int = 2,
+    llm_concurrency: int = 4,
+    max_pending: int = 16,
+    llm_requests_per_minute: Optional[float] = None
+) -> Dict[str, Any]:
+
+    """
+    Answer generated questions with AsyncQueryPipeline against the stubs and check its bounds.
+
+    Returns:
+        Dict: The measured peaks and counts, and "failures", the list of violated bounds
+    """
+
+    from .async_query import AsyncQueryPipeline
+
+    collection = StubCollection(latency=latency)
+    read = 0
+    finished = 0
+    peak_admitted = 0
+
+    async def question_source():
+        nonlocal read, peak_admitted
+        for index in range(questions):
+            read += 1
+            peak_admitted = max(peak_admitted, read - finished)
+            # Every fifth question repeats an earlier one, its embedding is requested once per batch
+            yield f"怎麼使用AirPods？#{index - index % 5 if index % 5 == 4 else index}"
+
+    def on_answer(index: int, question: str, answer: Any) -> None:
+        nonlocal finished
+        finished += 1
+
+    async with StubOpenAIServer(latency=latency) as server:
+        started = time.perf_counter()
+        async with AsyncQueryPipeline(
+            collection,
+            api_key="stub",
+            api_base=server.api_base,
+            embedding_concurrency=embedding_concurrency,
+            vector_store_concurrency=vector_store_concurrency,
+            llm_concurrency=llm_concurrency,
+            max_pending=max_pending,
+            llm_requests_per_minute=llm_requests_per_minute,
+        ) as pipeline:
+            answers = await pipeline.ask_many(question_source(), top_k=2, on_answer=on_answer)
+        seconds = time.perf_counter() - started
+
+    errors = [answer for answer in answers if isinstance(answer, BaseException)]
+    report = {
+        "questions": questions,
+        "seconds": round(seconds, 2),
+        "errors": [f"{type(error).__name__}: {error}" for error in errors[:3]],
+        "peak_admitted": peak_admitted,
+        "peak_embedding_requests": server.embeddings.peak_in_flight,
+        "peak_vector_store_queries": collection.queries.peak_in_flight,
+        "peak_chat_requests": server.chat.peak_in_flight,
+        "embedding_requests": server.embeddings.requests,
+        "embedded_texts": sum(server.embeddings.batch_sizes),
+        "chat_requests": server.chat.requests,
+    }
+
+    checks = [
+        (not errors, "every question is answered"),
+        (len(answers) == questions and finished == questions, "every question is reported once"),
+        (peak_admitted <= max_pending, f"at most max_pending ({max_pending}) questions admitted"),
+        (report["peak_embedding_requests"] <= embedding_concurrency, f"at most {embedding_concurrency} embedding requests in flight"),
+        (report["peak_vector_store_queries"] <= vector_store_concurrency, f"at most {vector_store_concurrency} vector store queries in flight"),
+        (report["peak_chat_requests"] <= llm_concurrency, f"at most {llm_concurrency} chat requests in flight"),
+        (report["embedding_requests"] < questions, "question embeddings are coalesced into batches"),
+        (report["embedded_texts"] < questions, "repeated questions in a batch are embedded once"),
+        (report["chat_requests"] == questions, "one chat request per question"),
+    ]
+    if llm_requests_per_minute:
+        starts = server.chat.started_at
+        interval = 60.0 / llm_requests_per_minute
+        report["chat_span"] = round(starts[-1] - starts[0], 2)
+        # Small tolerance for the timer resolution of the event loop
+        checks.append((starts[-1] - starts[0] >= interval * (len(starts) - 1) * 0.95, f"chat requests spaced by {interval:.3f} sec"))
+
+    report["failures"] = [description for passed, description in checks if not passed]
+    return report
+
+
+async def check_embedding_batcher(callers: int = 100, max_batch_size: int = 16) -> Dict[str, Any]:
+    """
+    Embed texts from many concurrent callers through EmbeddingBatcher with a stub embed_batch.
+
+    Returns:
+        Dict: The measured counts, and "failures", the list of failed checks
+    """
+
+    from .embedding_batcher import EmbeddingBatcher
+
+    sent_batches: List[List[str]] = []
+
+    async def embed_batch(texts: List[str]) -> List[List[float]]:
+        sent_batches.append(list(texts))
+        await asyncio.sleep(0.01)
+        return [stub_embedding(text) for text in texts]
+
+    # Every third caller repeats the text of the caller before it
+    texts = [f"question {index - 1 if index % 3 == 2 else index}" for index in range(callers)]
+    batcher = EmbeddingBatcher(embed_batch, max_batch_size=max_batch_size, max_wait=0.005)
+    vectors = await asyncio.gather(*(batcher.embed(text) for text in texts))
+    await batcher.close()
+
+    sent_texts = [text for batch in sent_batches for text in batch]
+    checks = [
+        (len(sent_batches) == -(-callers // max_batch_size), "concurrent texts are coalesced into full batches"),
+        (all(len(batch) == len(set(batch)) for batch in sent_batches), "identical texts are sent once per batch"),
+        (len(sent_texts) < callers, "repeated texts are not embedded again"),
+        (all(vector == stub_embedding(text) for text, vector in zip(texts, vectors)), "every caller gets the vector of its own text"),
+        (batcher.calls_made == len(sent_batches) and batcher.texts_embedded == len(sent_texts), "counters match the calls made"),
+    ]
+
+    async def failing_batch(texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(0.01)
+        return [stub_embedding(text) for text in texts[1:]]
+
+    batcher = EmbeddingBatcher(failing_batch, max_batch_size=4)
+    results = await asyncio.gather(*(batcher.embed(f"text {index}") for index in range(6)), return_exceptions=True)
+    checks.append((all(isinstance(result, ValueError) for result in results), "a failed batch raises in every caller"))
+
+    async def slow_batch(texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(60)
+        return [stub_embedding(text) for text in texts]
+
+    batcher = EmbeddingBatcher(slow_batch, max_batch_size=4)
+    waiting = [asyncio.ensure_future(batcher.embed(f"text {index}")) for index in range(4)]
+    await asyncio.sleep(0.01)
+    for task in list(batcher._in_flight):
+        task.cancel()
+    done, _ = await asyncio.wait(waiting, timeout=1)
+    checks.append((len(done) == len(waiting) and all(task.cancelled() for task in waiting), "a cancelled batch cancels its callers"))
+
+    return {
+        "callers": callers,
+        "batches": len(sent_batches),
+        "embedded_texts": len(sent_texts),
+        "failures": [description for passed, description in checks if not passed],
+    }
+
+
+async def check_bulk_resume(questions: int = 40, interrupt_after: int = 15, failed_chat_requests: int = 2) -> Dict[str, Any]:
+    """
+    Kill a bulk_answer job partway, leave a torn last line, and resume it against the stubs.
+
+    The first chat requests of the first run fail, so resuming also has to retry them.
+
+    Returns:
+        Dict: The measured counts, and "failures", the list of failed checks
+    """
+
+    import tempfile
+    from .bulk_answer import load_answered, run_bulk_job
+
+    question_list = [f"怎麼使用AirPods？#{index}" for index in range(questions)]
+    collection = StubCollection(latency=0.005)
+    pipeline_options = {"api_key": "stub", "llm_concurrency": 2, "max_pending": 4}
+
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, "answers.jsonl")
+
+        def written_lines() -> List[str]:
+            if not os.path.exists(output_file):
+                return []
+            with open(output_file, 'r', encoding='utf-8') as f:
+                return f.read().splitlines()
+
+        async with StubOpenAIServer(latency=0.01, fail_chat_requests=failed_chat_requests) as first_server:
+            job = asyncio.ensure_future(run_bulk_job(
+                question_list, output_file, collection, top_k=2, api_base=first_server.api_base, **pipeline_options
+            ))
+            while len(written_lines()) < interrupt_after and not job.done():
+                await asyncio.sleep(0.005)
+            job.cancel()
+            try:
+                await job
+            except asyncio.CancelledError:
+                pass
+
+        first_records = [json.loads(line) for line in written_lines()]
+        first_answered = {record["question"] for record in first_records if record["answer"] is not None}
+        torn_question = next(question for question in question_list if question not in first_answered)
+        with open(output_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"question": torn_question, "answer": "half written"}, ensure_ascii=False)[:-12])
+
+        loaded = load_answered(output_file)
+
+        async with StubOpenAIServer(latency=0.01) as second_server:
+            summary = await run_bulk_job(
+                question_list, output_file, collection, top_k=2, api_base=second_server.api_base, **pipeline_options
+            )
+
+        lines = written_lines()
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+
+    answers_per_question = {question: 0 for question in question_list}
+    for record in records:
+        if record["answer"] is not None:
+            answers_per_question[record["question"]] += 1
+
+    checks = [
+        (0 < len(first_answered) < questions, "the first run was interrupted partway"),
+        (sum(record["answer"] is None for record in first_records) == failed_chat_requests, "the first run recorded its failed questions"),
+        (len(records) == len(lines), "every line of the resumed file is a whole record"),
+        (loaded == first_answered, "load_answered skips the torn last line and the failed questions"),
+        (second_server.chat.requests == questions - len(first_answered), "the resumed run asks only the unanswered questions"),
+        (all(count == 1 for count in answers_per_question.values()), "every question is answered exactly once"),
+        (summary["skipped"] == len(first_answered) and summary["failed"] == 0, "the summary counts the skipped questions"),
+    ]
+
+    return {
+        "questions": questions,
+        "answered_before_interrupt": len(first_answered),
+        "chat_requests_on_resume": second_server.chat.requests,
+        "failures": [description for passed, description in checks if not passed],
+    }
+
+
+async def serve(port: int, latency: float) -> None:
+    """Run StubOpenAIServer until interrupted."""
+
+    server = StubOpenAIServer(latency=latency)
+    await server.start(port)
+    print(f"Stub OpenAI server on {server.api_base}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-ins of the embedding, chat and vector store upstreams.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check_parser = subparsers.add_parser("check-pipeline", help="Check the bounds of AsyncQueryPipeline against the stubs")
+    check_parser.add_argument("--questions", type=int, default=200)
+    check_parser.add_argument("--latency", type=float, default=0.02, help="Seconds per upstream request")
+    check_parser.add_argument("--llm-rpm", type=float, default=None, help="Also check the chat rate limit")
+    subparsers.add_parser("check-batcher", help="Check EmbeddingBatcher with a stub embedding call")
+    subparsers.add_parser("check-bulk-resume", help="Check that an interrupted bulk_answer job resumes")
+    serve_parser = subparsers.add_parser("serve", help="Run the stub embedding and chat server")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--latency", type=float, default=0.2, help="Seconds per request")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args.port, args.latency))
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if args.command == "check-batcher":
+        report = asyncio.run(check_embedding_batcher())
+    elif args.command == "check-bulk-resume":
+        report = asyncio.run(check_bulk_resume())
+    else:
+        report = asyncio.run(check_async_pipeline(args.questions, args.latency, llm_requests_per_minute=args.llm_rpm))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(1 if report["failures"] else 0)